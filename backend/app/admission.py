@@ -0,0 +1,106 @@
+"""
+Admission control for the Ollama generation stage.
+
+A single Ollama container serves every request, so generation concurrency
+is capped and excess requests wait in a bounded queue. Requests that would
+overflow the queue are rejected immediately (429), and requests that wait
+longer than the queue deadline give up (503); both carry a Retry-After hint
+derived from recent generation times.
+"""
+
+import asyncio
+import math
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict
+
+from .metrics import (
+    GENERATION_IN_FLIGHT,
+    GENERATION_QUEUE_DEPTH,
+    GENERATION_QUEUE_WAIT_SECONDS,
+    GENERATION_REJECTIONS,
+)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a request cannot be admitted to the generation stage"""
+
+    def __init__(self, reason: str, status_code: int, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Concurrency limiter with a bounded wait queue and per-request deadline"""
+
+    def __init__(self, max_concurrency: int = 2, max_queue: int = 32, queue_timeout: float = 30.0):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._in_flight = 0
+        self._waiting = 0
+        # Exponentially weighted average of how long a slot is held
+        self._avg_hold_seconds = 5.0
+        self.stats = {"admitted": 0, "queued": 0, "rejected_queue_full": 0, "rejected_timeout": 0}
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog should have drained"""
+        backlog = self._waiting + self._in_flight
+        return max(1, math.ceil(backlog * self._avg_hold_seconds / self.max_concurrency))
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[float]:
+        """Hold a generation slot; yields the seconds spent queueing"""
+        wait_start = time.time()
+        if not self._semaphore.locked() and not self._waiting:
+            # Free slot and nobody ahead of us: acquire() completes without suspending
+            await self._semaphore.acquire()
+        else:
+            await self._wait_for_slot()
+
+        queue_wait = time.time() - wait_start
+        GENERATION_QUEUE_WAIT_SECONDS.observe(queue_wait)
+        self.stats["admitted"] += 1
+        self._in_flight += 1
+        GENERATION_IN_FLIGHT.set(self._in_flight)
+        hold_start = time.time()
+        try:
+            yield queue_wait
+        finally:
+            self._in_flight -= 1
+            GENERATION_IN_FLIGHT.set(self._in_flight)
+            self._avg_hold_seconds = 0.8 * self._avg_hold_seconds + 0.2 * (time.time() - hold_start)
+            self._semaphore.release()
+
+    async def _wait_for_slot(self):
+        if self._waiting >= self.max_queue:
+            self.stats["rejected_queue_full"] += 1
+            GENERATION_REJECTIONS.labels(reason="queue_full").inc()
+            raise AdmissionRejected("Generation queue is full", 429, self.retry_after())
+
+        self.stats["queued"] += 1
+        self._waiting += 1
+        GENERATION_QUEUE_DEPTH.set(self._waiting)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.stats["rejected_timeout"] += 1
+            GENERATION_REJECTIONS.labels(reason="queue_timeout").inc()
+            raise AdmissionRejected("Timed out waiting for a generation slot", 503, self.retry_after())
+        finally:
+            self._waiting -= 1
+            GENERATION_QUEUE_DEPTH.set(self._waiting)
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "in_flight": self._in_flight,
+            "queue_depth": self._waiting,
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "queue_timeout_s": self.queue_timeout,
+            "avg_generation_s": self._avg_hold_seconds,
+        }
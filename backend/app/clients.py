@@ -0,0 +1,106 @@
+"""
+Async HTTP clients for the query path.
+
+Both clients sit on a pooled keep-alive ``httpx.AsyncClient`` so a single
+worker can hold many in-flight queries while waiting on Supabase or Ollama
+without tying up a thread per request.
+"""
+
+import json
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+
+
+def _limits(config: Dict[str, Any]) -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=config["http_max_connections"],
+        max_keepalive_connections=config["http_max_keepalive"],
+        keepalive_expiry=config["http_keepalive_expiry"],
+    )
+
+
+def parse_keep_alive(value: str) -> Any:
+    """Ollama takes a duration string ("30m") or a number of seconds (negative = forever)"""
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+class SupabaseRPC:
+    """Calls PostgREST RPC endpoints (e.g. ``match_documents``) asynchronously"""
+
+    def __init__(self, config: Dict[str, Any]):
+        key = config["supabase_key"]
+        self.http = httpx.AsyncClient(
+            base_url=config["supabase_url"].rstrip("/") + "/rest/v1",
+            headers={
+                "apikey": key,
+                "Authorization": f"Bearer {key}",
+                "Content-Type": "application/json",
+            },
+            limits=_limits(config),
+            timeout=httpx.Timeout(config["supabase_timeout"]),
+        )
+
+    async def rpc(self, function_name: str, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        response = await self.http.post(f"/rpc/{function_name}", json=params)
+        response.raise_for_status()
+        return response.json() or []
+
+    async def aclose(self):
+        await self.http.aclose()
+
+
+class OllamaClient:
+    """Minimal async client for Ollama's ``/api/generate`` endpoint"""
+
+    def __init__(self, config: Dict[str, Any]):
+        self.model = config["llm_model"]
+        self.options = {
+            "temperature": config["temperature"],
+            "num_predict": config["num_predict"],
+            "num_ctx": config["num_ctx"],
+        }
+        self.keep_alive = parse_keep_alive(config["ollama_keep_alive"])
+        self.timeout = config["ollama_timeout"]
+        self.http = httpx.AsyncClient(
+            base_url=config["ollama_url"],
+            limits=_limits(config),
+            # Generation can legitimately take a while; only bound connecting.
+            timeout=httpx.Timeout(config["ollama_timeout"], connect=10.0),
+        )
+
+    def _payload(self, prompt: str, stream: bool, options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "prompt": prompt,
+            "stream": stream,
+            "options": {**self.options, **(options or {})},
+            "keep_alive": self.keep_alive,
+        }
+
+    async def generate(self, prompt: str, options: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Return Ollama's final response object (``response`` plus eval counters)"""
+        response = await self.http.post("/api/generate", json=self._payload(prompt, False, options))
+        response.raise_for_status()
+        return response.json()
+
+    async def stream(self, prompt: str, options: Optional[Dict[str, Any]] = None) -> AsyncIterator[Dict[str, Any]]:
+        """Yield each NDJSON chunk Ollama emits; the last one has ``done: true``"""
+        async with self.http.stream("POST", "/api/generate", json=self._payload(prompt, True, options)) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line:
+                    yield json.loads(line)
+
+    def warm_up(self, prompt: str):
+        """Blocking one-token generation that loads the model and caches ``prompt``'s KV"""
+        response = httpx.post(self.http.base_url.join("/api/generate"),
+                              json=self._payload(prompt, False, {"num_predict": 1}),
+                              timeout=httpx.Timeout(self.timeout, connect=10.0))
+        response.raise_for_status()
+
+    async def aclose(self):
+        await self.http.aclose()
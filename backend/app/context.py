@@ -0,0 +1,173 @@
+"""
+Token-budgeted context assembly for the "stuff" prompt.
+
+Retrieved chunks are packed into the prompt in rank order until the token
+budget is spent. Before counting, text that a chunk shares with an already
+selected neighbour (the ``chunk_overlap`` region the splitter duplicated)
+is cut, and chunks that are near-duplicates of a selected one are dropped.
+The chunk that crosses the budget is truncated on a token boundary.
+
+Tokens are counted with the LLM's own tokenizer when ``tokenizers`` can
+load it (``CONTEXT_TOKENIZER``: a Hugging Face repo ID or a local
+``tokenizer.json``); otherwise a conservative characters-per-token estimate
+is used and ``describe()`` reports ``exact: False``.
+"""
+
+import math
+import os
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import structlog
+
+try:
+    from tokenizers import Tokenizer
+    TOKENIZERS_AVAILABLE = True
+except ImportError:
+    TOKENIZERS_AVAILABLE = False
+
+logger = structlog.get_logger()
+
+CONTEXT_SEPARATOR = "\n\n"
+
+# English prose averages ~4 characters per Llama 3 token; 3.5 errs toward overcounting
+ESTIMATED_CHARS_PER_TOKEN = 3.5
+
+
+class TokenCounter:
+    """Counts and truncates text in LLM tokens"""
+
+    def __init__(self, tokenizer: Optional[str] = None):
+        self.name = tokenizer
+        self._tokenizer = None
+        if tokenizer and TOKENIZERS_AVAILABLE:
+            try:
+                if os.path.exists(tokenizer):
+                    self._tokenizer = Tokenizer.from_file(tokenizer)
+                else:
+                    self._tokenizer = Tokenizer.from_pretrained(tokenizer)
+            except Exception as e:
+                logger.warning(f"Failed to load tokenizer {tokenizer}, estimating token counts: {e}")
+        elif tokenizer:
+            logger.warning("tokenizers not installed; estimating token counts")
+
+    @property
+    def exact(self) -> bool:
+        return self._tokenizer is not None
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self._tokenizer is not None:
+            return len(self._tokenizer.encode(text, add_special_tokens=False).ids)
+        return int(len(text) / ESTIMATED_CHARS_PER_TOKEN) + 1
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Longest prefix of ``text`` within ``max_tokens``, cut at a token (or word) boundary"""
+        if max_tokens <= 0:
+            return ""
+        if self._tokenizer is not None:
+            encoding = self._tokenizer.encode(text, add_special_tokens=False)
+            if len(encoding.ids) <= max_tokens:
+                return text
+            return text[:encoding.offsets[max_tokens - 1][1]]
+        # Longest length whose estimated count() is still within max_tokens
+        limit = math.ceil(max_tokens * ESTIMATED_CHARS_PER_TOKEN) - 1
+        if len(text) <= limit:
+            return text
+        cut = text.rfind(" ", 0, limit)
+        return text[:cut if cut > 0 else limit]
+
+    def describe(self) -> Dict[str, Any]:
+        return {"tokenizer": self.name, "exact": self.exact}
+
+
+def strip_overlap(selected: str, candidate: str, min_overlap: int, max_overlap: int) -> str:
+    """Remove text ``candidate`` shares with the start or end of ``selected``
+
+    Adjacent splitter chunks repeat up to ``chunk_overlap`` characters: the
+    tail of one chunk is the head of the next, in either retrieval order.
+    """
+    if len(candidate) < min_overlap or len(selected) < min_overlap:
+        return candidate
+    # selected precedes candidate in the source document
+    head = candidate[:min_overlap]
+    start = selected.find(head, max(0, len(selected) - max_overlap))
+    while start != -1:
+        tail = selected[start:]
+        if candidate.startswith(tail):
+            return candidate[len(tail):].lstrip()
+        start = selected.find(head, start + 1)
+    # candidate precedes selected
+    tail = candidate[-min_overlap:]
+    end = selected.rfind(tail, 0, max_overlap)
+    while end != -1:
+        head = selected[:end + min_overlap]
+        if candidate.endswith(head):
+            return candidate[:-len(head)].rstrip()
+        end = selected.rfind(tail, 0, end + min_overlap - 1)
+    return candidate
+
+
+def shingles(text: str, size: int = 3) -> set:
+    words = re.findall(r"\w+", text.lower())
+    return {tuple(words[i:i + size]) for i in range(max(1, len(words) - size + 1))}
+
+
+def jaccard(a: set, b: set) -> float:
+    return len(a & b) / len(a | b) if a and b else 0.0
+
+
+class ContextBuilder:
+    """Packs retrieved chunks into a token budget"""
+
+    def __init__(self, counter: TokenCounter, budget: int, duplicate_threshold: float = 0.9,
+                 min_overlap: int = 40, max_overlap: int = 400, min_chunk_tokens: int = 32):
+        self.counter = counter
+        self.budget = budget
+        self.duplicate_threshold = duplicate_threshold
+        self.min_overlap = min_overlap
+        self.max_overlap = max_overlap
+        self.min_chunk_tokens = min_chunk_tokens
+
+    def build(self, chunks: List[Dict[str, Any]], budget: Optional[int] = None
+              ) -> Tuple[str, List[Dict[str, Any]], Dict[str, Any]]:
+        """Return (context, chunks used with their trimmed text, stats)"""
+        budget = self.budget if budget is None else budget
+        separator_tokens = self.counter.count(CONTEXT_SEPARATOR)
+        used: List[Dict[str, Any]] = []
+        used_shingles: List[set] = []
+        stats = {"budget": budget, "overlap_chars_removed": 0, "duplicates_dropped": 0,
+                 "budget_dropped": 0, "truncated": False}
+        remaining = budget
+        for chunk in chunks:
+            text = chunk["content"]
+            for previous in used:
+                text = strip_overlap(previous["content"], text, self.min_overlap, self.max_overlap)
+            stats["overlap_chars_removed"] += len(chunk["content"]) - len(text)
+            if not text.strip():
+                stats["duplicates_dropped"] += 1
+                continue
+            text_shingles = shingles(text)
+            if any(jaccard(text_shingles, seen) >= self.duplicate_threshold for seen in used_shingles):
+                stats["duplicates_dropped"] += 1
+                continue
+
+            cost = self.counter.count(text) + (separator_tokens if used else 0)
+            if cost > remaining:
+                room = remaining - (separator_tokens if used else 0)
+                if room < self.min_chunk_tokens:
+                    stats["budget_dropped"] += 1
+                    continue
+                text = self.counter.truncate(text, room)
+                cost = self.counter.count(text) + (separator_tokens if used else 0)
+                stats["truncated"] = True
+            used.append({**chunk, "content": text})
+            used_shingles.append(text_shingles)
+            remaining -= cost
+
+        stats["context_tokens"] = budget - remaining
+        return CONTEXT_SEPARATOR.join(chunk["content"] for chunk in used), used, stats
+
+    def describe(self) -> Dict[str, Any]:
+        return {"budget": self.budget, **self.counter.describe()}
@@ -0,0 +1,119 @@
+"""
+Persistent content-addressed embedding cache.
+
+Document embeddings are stored in SQLite under SHA-256(model name + text),
+so re-ingesting a file (also after a restart, or from another worker)
+skips ONNX inference for every chunk text seen before. Query embeddings
+are not stored here; they use the in-memory LRU. The file can be shared
+by several worker processes (WAL mode). When it grows past ``max_mb``,
+the least recently used vectors are evicted.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Key + last_used + SQLite row/index overhead, on top of the vector bytes
+ROW_OVERHEAD_BYTES = 96
+
+# SQLite's default limit on host parameters per statement is 999
+QUERY_BATCH = 500
+
+
+class DiskEmbeddingCache:
+    """SQLite store of text -> float32 vector for one embedding model"""
+
+    def __init__(self, path: str, model_name: str, dimension: int = 384, max_mb: float = 512):
+        self.path = path
+        self.model_name = model_name
+        self.dimension = dimension
+        self.max_entries = max(1, int(max_mb * 1024 * 1024) // (dimension * 4 + ROW_OVERHEAD_BYTES))
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings "
+            "(key BLOB PRIMARY KEY, vector BLOB NOT NULL, last_used INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0}
+
+    def key(self, text: str) -> bytes:
+        return hashlib.sha256(f"{self.model_name}\0{text}".encode("utf-8")).digest()
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[List[float]]]:
+        """Cached vector per text, or None; hits are marked as recently used"""
+        keys = [self.key(text) for text in texts]
+        found: Dict[bytes, List[float]] = {}
+        with self._lock:
+            for start in range(0, len(keys), QUERY_BATCH):
+                batch = keys[start:start + QUERY_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                for key, blob in self._conn.execute(
+                        f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch):
+                    vector = np.frombuffer(blob, dtype=np.float32)
+                    if vector.shape[0] == self.dimension:
+                        found[key] = vector.tolist()
+            if found:
+                hit_keys = list(found)
+                now = int(time.time())
+                for start in range(0, len(hit_keys), QUERY_BATCH):
+                    batch = hit_keys[start:start + QUERY_BATCH]
+                    placeholders = ",".join("?" * len(batch))
+                    self._conn.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE key IN ({placeholders})", [now, *batch])
+            vectors = [found.get(key) for key in keys]
+            hits = sum(vector is not None for vector in vectors)
+            self.stats["hits"] += hits
+            self.stats["misses"] += len(keys) - hits
+        return vectors
+
+    def put_many(self, texts: Sequence[str], vectors: Sequence[Sequence[float]]):
+        """Store vectors, then evict least recently used rows beyond the size limit"""
+        now = int(time.time())
+        rows = [(self.key(text), np.asarray(vector, dtype=np.float32).tobytes(), now)
+                for text, vector in zip(texts, vectors)]
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?)", rows)
+                # Evict down to 90% so eviction doesn't run on every insert at the limit
+                excess = self._count() - self.max_entries
+                if excess > 0:
+                    excess += self.max_entries // 10
+                    self._conn.execute(
+                        "DELETE FROM embeddings WHERE key IN "
+                        "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)", (excess,))
+                    self.stats["evictions"] += excess
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self.stats["writes"] += len(rows)
+
+    def _count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    def describe(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+                "entries": self._count(),
+                "max_entries": self.max_entries,
+                "path": self.path,
+            }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
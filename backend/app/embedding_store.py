@@ -0,0 +1,357 @@
+"""
+Memory-mapped on-disk embedding store.
+
+Layout of a store directory::
+
+    CURRENT                 name of the live generation directory
+    LOCK                    flock target serializing appends and compaction
+    gen-000001/
+        meta.json           {"version", "dimension", "dtype"}
+        vectors.bin         row-major normalized float32/float16 matrix
+        index.bin           fixed-width records: id, chunk offset/length, deleted flag
+        chunks.bin          concatenated JSON records {"content", "metadata"}
+        <sidecar files>     derived data such as quantized codes (see ``sidecar_path``)
+
+Every file is opened with mmap, so uvicorn workers share the pages through
+the OS page cache and a restart only has to map the files, not reload the
+corpus. Appends write chunks and vectors first and the index record last;
+the index record count is the commit point, and the only in-place change
+is the one-byte deleted flag. A metadata update appends the row again and
+tombstones the old copy. Compaction writes a new generation without
+deleted rows and atomically repoints ``CURRENT``; readers notice on their
+next ``refresh()``.
+
+Usage::
+
+    python -m app.embedding_store stats /app/data/embeddings
+    python -m app.embedding_store compact /app/data/embeddings
+"""
+
+import json
+import mmap
+import os
+import shutil
+import sys
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are not serialized across processes
+    fcntl = None
+
+FORMAT_VERSION = 1
+ID_BYTES = 64
+
+INDEX_DTYPE = np.dtype([
+    ("id", f"S{ID_BYTES}"),
+    ("offset", "<u8"),
+    ("length", "<u4"),
+    ("deleted", "u1"),
+])
+
+
+class EmbeddingStore:
+    """Append-only mmap store of (id, normalized vector, content, metadata) rows"""
+
+    def __init__(self, path: str, dimension: int = 384, dtype: str = "float32"):
+        self.path = path
+        self.dimension = dimension
+        self.dtype = np.dtype(dtype)
+        os.makedirs(path, exist_ok=True)
+        self._lock_path = os.path.join(path, "LOCK")
+
+        with self._exclusive():
+            if not os.path.exists(os.path.join(path, "CURRENT")):
+                self._create_generation("gen-000001")
+                self._set_current("gen-000001")
+
+        # (generation, index.bin size, index.bin mtime) of the current mapping
+        self._signature: Optional[tuple] = None
+        self._vectors = np.zeros((0, dimension), dtype=self.dtype)
+        self._index = np.zeros(0, dtype=INDEX_DTYPE)
+        self._chunks: Optional[mmap.mmap] = None
+        self._deleted = np.zeros(0, dtype=bool)
+        self.refresh()
+
+    # Read side -------------------------------------------------------------
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._vectors
+
+    @property
+    def deleted(self) -> np.ndarray:
+        return self._deleted
+
+    @property
+    def generation(self) -> Optional[str]:
+        return self._signature[0] if self._signature else None
+
+    def id(self, row: int) -> str:
+        return self._index[row]["id"].decode("ascii")
+
+    def ids(self) -> List[str]:
+        return [raw.decode("ascii") for raw in self._index["id"]]
+
+    def record(self, row: int) -> Dict[str, Any]:
+        entry = self._index[row]
+        start = int(entry["offset"])
+        return json.loads(self._chunks[start:start + int(entry["length"])])
+
+    def content(self, row: int) -> str:
+        return self.record(row)["content"]
+
+    def metadata(self, row: int) -> Dict[str, Any]:
+        return self.record(row)["metadata"]
+
+    def sidecar_path(self, name: str) -> str:
+        """Path of a file derived from the current generation's rows; compaction discards it"""
+        return os.path.join(self.path, self._read_current(), name)
+
+    def writer_lock(self):
+        """Context manager held by every writer, across processes"""
+        return self._exclusive()
+
+    def refresh(self) -> bool:
+        """Remap if another process appended, deleted or compacted; returns True if changed"""
+        generation = self._read_current()
+        gen_dir = os.path.join(self.path, generation)
+        index_stat = os.stat(os.path.join(gen_dir, "index.bin"))
+        signature = (generation, index_stat.st_size, index_stat.st_mtime_ns)
+        if signature == self._signature:
+            return False
+
+        meta = self._read_meta(gen_dir)
+        self.dimension = meta["dimension"]
+        self.dtype = np.dtype(meta["dtype"])
+        rows = index_stat.st_size // INDEX_DTYPE.itemsize
+        self._index = self._map(os.path.join(gen_dir, "index.bin"), INDEX_DTYPE, (rows,))
+        self._vectors = self._map(os.path.join(gen_dir, "vectors.bin"), self.dtype, (rows, self.dimension))
+        self._deleted = self._index["deleted"].astype(bool) if rows else np.zeros(0, dtype=bool)
+        self._chunks = self._map_bytes(os.path.join(gen_dir, "chunks.bin"))
+        self._signature = signature
+        return True
+
+    # Write side ------------------------------------------------------------
+
+    def append(self, ids: Sequence[str], contents: Sequence[str],
+               metadatas: Sequence[Dict[str, Any]], vectors: np.ndarray):
+        """Append rows (``vectors`` must already be normalized)"""
+        with self._exclusive():
+            self._append(os.path.join(self.path, self._read_current()), ids, contents, metadatas, vectors)
+        self.refresh()
+
+    def delete(self, ids: Sequence[str]) -> int:
+        """Tombstone rows by ID; space is reclaimed by ``compact()``"""
+        wanted = {str(row_id).encode("ascii") for row_id in ids}
+        if not wanted:
+            return 0
+        removed = 0
+        with self._exclusive():
+            gen_dir = os.path.join(self.path, self._read_current())
+            rows = os.path.getsize(os.path.join(gen_dir, "index.bin")) // INDEX_DTYPE.itemsize
+            if rows:
+                index = np.memmap(os.path.join(gen_dir, "index.bin"), dtype=INDEX_DTYPE, mode="r", shape=(rows,))
+                hits = np.flatnonzero(np.isin(index["id"], list(wanted)) & (index["deleted"] == 0))
+                del index
+                removed = len(hits)
+                self._tombstone(gen_dir, hits)
+        self.refresh()
+        return removed
+
+    def update_metadata(self, ids: Sequence[str], metadatas: Sequence[Dict[str, Any]]) -> int:
+        """Replace the metadata of rows by ID; returns how many actually changed.
+
+        A changed row is appended again (same ID, content and vector) and the
+        old row tombstoned, so committed index entries are never rewritten;
+        a reader refreshing in between may see both copies for one query.
+        The old rows are reclaimed by ``compact()``.
+        """
+        wanted = {str(row_id).encode("ascii"): metadata for row_id, metadata in zip(ids, metadatas)}
+        if not wanted:
+            return 0
+        with self._exclusive():
+            self.refresh()
+            changed = []
+            for row in np.flatnonzero(np.isin(self._index["id"], list(wanted)) & ~self._deleted):
+                record = self.record(int(row))
+                metadata = wanted[bytes(self._index["id"][row])]
+                if record["metadata"] != metadata:
+                    changed.append((int(row), record["content"], metadata))
+            if changed:
+                rows = [row for row, _, _ in changed]
+                gen_dir = os.path.join(self.path, self._read_current())
+                self._append(gen_dir, [self.id(row) for row in rows], [content for _, content, _ in changed],
+                             [metadata for _, _, metadata in changed], self._vectors[rows])
+                self._tombstone(gen_dir, rows)
+        self.refresh()
+        return len(changed)
+
+    def compact(self) -> Dict[str, int]:
+        """Rewrite the live rows into a new generation and switch to it"""
+        with self._exclusive():
+            old_generation = self._read_current()
+            self.refresh()
+            rows_before = len(self._deleted)
+            live = np.flatnonzero(~self._deleted)
+            new_generation = f"gen-{int(old_generation.split('-')[1]) + 1:06d}"
+            new_dir = self._create_generation(new_generation)
+
+            records = np.zeros(len(live), dtype=INDEX_DTYPE)
+            with open(os.path.join(new_dir, "chunks.bin"), "wb") as chunks_file:
+                offset = 0
+                for i, row in enumerate(live):
+                    entry = self._index[row]
+                    start = int(entry["offset"])
+                    payload = self._chunks[start:start + int(entry["length"])]
+                    chunks_file.write(payload)
+                    records[i] = (entry["id"], offset, len(payload), 0)
+                    offset += len(payload)
+            with open(os.path.join(new_dir, "vectors.bin"), "wb") as vectors_file:
+                vectors_file.write(np.ascontiguousarray(self._vectors[live]).tobytes())
+            with open(os.path.join(new_dir, "index.bin"), "wb") as index_file:
+                index_file.write(records.tobytes())
+
+            self._set_current(new_generation)
+            # Processes still mapping the old files keep them alive until they refresh
+            shutil.rmtree(os.path.join(self.path, old_generation), ignore_errors=True)
+        self.refresh()
+        return {"rows_before": rows_before, "rows_after": int(len(live))}
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "storage": "mmap",
+            "generation": self.generation,
+            "rows": len(self),
+            "deleted_rows": int(self._deleted.sum()),
+            "dtype": self.dtype.name,
+            "vector_bytes": int(self._vectors.nbytes),
+        }
+
+    # Helpers ---------------------------------------------------------------
+
+    def _append(self, gen_dir: str, ids: Sequence[str], contents: Sequence[str],
+                metadatas: Sequence[Dict[str, Any]], vectors: np.ndarray):
+        # Caller holds the writer lock
+        vectors = np.ascontiguousarray(vectors, dtype=self.dtype).reshape(len(ids), self.dimension)
+        records = np.zeros(len(ids), dtype=INDEX_DTYPE)
+        with open(os.path.join(gen_dir, "chunks.bin"), "ab") as chunks_file:
+            offset = chunks_file.tell()
+            for i, (row_id, content, metadata) in enumerate(zip(ids, contents, metadatas)):
+                encoded_id = str(row_id).encode("ascii")
+                if len(encoded_id) > ID_BYTES:
+                    raise ValueError(f"ID longer than {ID_BYTES} bytes: {row_id}")
+                payload = json.dumps({"content": content, "metadata": metadata or {}}).encode("utf-8")
+                chunks_file.write(payload)
+                records[i] = (encoded_id, offset, len(payload), 0)
+                offset += len(payload)
+            chunks_file.flush()
+            os.fsync(chunks_file.fileno())
+
+        # Vectors may be ahead of the index after a crash; trim to the committed rows
+        committed = os.path.getsize(os.path.join(gen_dir, "index.bin")) // INDEX_DTYPE.itemsize
+        with open(os.path.join(gen_dir, "vectors.bin"), "r+b") as vectors_file:
+            vectors_file.truncate(committed * self.dimension * self.dtype.itemsize)
+            vectors_file.seek(0, os.SEEK_END)
+            vectors_file.write(vectors.tobytes())
+            vectors_file.flush()
+            os.fsync(vectors_file.fileno())
+
+        with open(os.path.join(gen_dir, "index.bin"), "ab") as index_file:
+            index_file.write(records.tobytes())
+            index_file.flush()
+            os.fsync(index_file.fileno())
+
+    @staticmethod
+    def _tombstone(gen_dir: str, rows: Sequence[int]):
+        # Caller holds the writer lock; only the one-byte deleted flag changes in place
+        if len(rows) == 0:
+            return
+        index_path = os.path.join(gen_dir, "index.bin")
+        size = os.path.getsize(index_path) // INDEX_DTYPE.itemsize
+        index = np.memmap(index_path, dtype=INDEX_DTYPE, mode="r+", shape=(size,))
+        index["deleted"][np.asarray(rows)] = 1
+        index.flush()
+        del index
+        # Bump mtime explicitly so other processes' refresh() sees the tombstones
+        os.utime(index_path)
+
+    @contextmanager
+    def _exclusive(self) -> Iterator[None]:
+        if fcntl is None:
+            yield
+            return
+        with open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _create_generation(self, generation: str) -> str:
+        gen_dir = os.path.join(self.path, generation)
+        os.makedirs(gen_dir, exist_ok=True)
+        for name in ("vectors.bin", "index.bin", "chunks.bin"):
+            open(os.path.join(gen_dir, name), "ab").close()
+        with open(os.path.join(gen_dir, "meta.json"), "w") as f:
+            json.dump({"version": FORMAT_VERSION, "dimension": self.dimension, "dtype": self.dtype.name}, f)
+        return gen_dir
+
+    def _read_current(self) -> str:
+        with open(os.path.join(self.path, "CURRENT")) as f:
+            return f.read().strip()
+
+    def _set_current(self, generation: str):
+        tmp_path = os.path.join(self.path, "CURRENT.tmp")
+        with open(tmp_path, "w") as f:
+            f.write(generation)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, os.path.join(self.path, "CURRENT"))
+
+    @staticmethod
+    def _read_meta(gen_dir: str) -> Dict[str, Any]:
+        with open(os.path.join(gen_dir, "meta.json")) as f:
+            meta = json.load(f)
+        if meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported embedding store version: {meta.get('version')}")
+        return meta
+
+    @staticmethod
+    def _map(path: str, dtype: np.dtype, shape: tuple) -> np.ndarray:
+        if shape[0] == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r", shape=shape)
+
+    @staticmethod
+    def _map_bytes(path: str) -> Optional[mmap.mmap]:
+        if os.path.getsize(path) == 0:
+            return None
+        with open(path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def main(argv: List[str]) -> int:
+    if len(argv) != 2 or argv[0] not in ("stats", "compact"):
+        print("usage: python -m app.embedding_store {stats|compact} <store-dir>")
+        return 2
+    command, path = argv
+    if not os.path.exists(os.path.join(path, "CURRENT")):
+        print(f"No embedding store at {path}")
+        return 1
+    store = EmbeddingStore(path)
+    if command == "compact":
+        print(json.dumps(store.compact()))
+    print(json.dumps(store.describe()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
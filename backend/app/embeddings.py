@@ -0,0 +1,211 @@
+"""
+Embedding layer shared by the query path and ingestion.
+
+``CachedEmbeddings`` wraps the FastEmbed model with a bounded LRU cache of
+normalized query text -> vector, so questions the evaluator and agents
+re-send constantly skip ONNX inference. Vectors are stored as compact
+float32 arrays (384 * 4 bytes for bge-small) rather than Python float lists.
+Document embeddings can additionally go through a persistent
+``DiskEmbeddingCache``, so known chunk texts are never embedded twice.
+
+``BatchingEmbedder`` collects query-embedding requests from concurrent
+requests for a few milliseconds and runs them as one batched inference,
+which ONNX executes far more efficiently than single strings.
+"""
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Executor
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from .embedding_cache import DiskEmbeddingCache
+from .metrics import EMBED_BATCH_SIZE, EMBED_BATCH_WAIT_SECONDS, EMBED_BATCH_INFERENCE_SECONDS
+
+
+def normalize_query(text: str) -> str:
+    """Cache key for a query: surrounding and repeated whitespace removed"""
+    return " ".join(text.split())
+
+
+class CachedEmbeddings(Embeddings):
+    """LangChain ``Embeddings`` wrapper with an exact-match query LRU cache"""
+
+    def __init__(self, base: Embeddings, max_entries: int = 4096,
+                 disk_cache: Optional[DiskEmbeddingCache] = None):
+        self.base = base
+        self.max_entries = max_entries
+        self.disk_cache = disk_cache
+        self._cache: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def lookup(self, text: str) -> Optional[List[float]]:
+        """Return the cached vector for ``text`` without running inference"""
+        key = normalize_query(text)
+        with self._lock:
+            vector = self._cache.get(key)
+            if vector is None:
+                return None
+            self._cache.move_to_end(key)
+            self.stats["hits"] += 1
+        return vector.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        cached = self.lookup(text)
+        if cached is not None:
+            return cached
+
+        key = normalize_query(text)
+        with self._lock:
+            self.stats["misses"] += 1
+        vector = self.base.embed_query(key)
+        self._remember(key, vector)
+        return vector
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed several queries, running one batched inference for the cache misses"""
+        vectors: List[Optional[List[float]]] = [self.lookup(text) for text in texts]
+        missing = list(dict.fromkeys(
+            normalize_query(text) for text, vector in zip(texts, vectors) if vector is None
+        ))
+        if missing:
+            with self._lock:
+                self.stats["misses"] += len(missing)
+            computed = dict(zip(missing, self._base_embed_queries(missing)))
+            for key, vector in computed.items():
+                self._remember(key, vector)
+            vectors = [vector if vector is not None else computed[normalize_query(text)]
+                       for text, vector in zip(texts, vectors)]
+        return vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed chunk texts, running inference only for texts not in the disk cache"""
+        if self.disk_cache is None:
+            return self.base.embed_documents(texts)
+        vectors = self.disk_cache.get_many(texts)
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if missing:
+            computed = dict(zip(missing, self.base.embed_documents(missing)))
+            self.disk_cache.put_many(missing, list(computed.values()))
+            vectors = [vector if vector is not None else computed[text] for text, vector in zip(texts, vectors)]
+        return vectors
+
+    def _base_embed_queries(self, texts: List[str]) -> List[List[float]]:
+        # FastEmbed's query_embed accepts a list and batches it in one ONNX
+        # run; LangChain only exposes the single-string form.
+        model = getattr(self.base, "model", None) or getattr(self.base, "_model", None)
+        if model is not None and hasattr(model, "query_embed"):
+            return [vector.tolist() for vector in model.query_embed(texts)]
+        return [self.base.embed_query(text) for text in texts]
+
+    def describe(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+                "entries": len(self._cache),
+                "max_entries": self.max_entries,
+                "memory_bytes": sum(vector.nbytes for vector in self._cache.values()),
+            }
+
+    def _remember(self, key: str, vector: List[float]):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._cache[key] = np.asarray(vector, dtype=np.float32)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+                self.stats["evictions"] += 1
+
+
+class BatchingEmbedder:
+    """Coalesces concurrent query embeddings into micro-batches.
+
+    The first request to arrive opens a batch; it is closed and embedded
+    after ``max_wait_ms`` or as soon as ``max_batch_size`` requests are
+    waiting, whichever comes first. Must be used from the event loop.
+    """
+
+    def __init__(self, embeddings: CachedEmbeddings, executor: Executor,
+                 max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.embeddings = embeddings
+        self.executor = executor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._opened_at = 0.0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set()
+        self.stats = {"requests": 0, "batches": 0, "batch_size_histogram": {}}
+
+    async def embed(self, text: str) -> List[float]:
+        cached = self.embeddings.lookup(text)
+        if cached is not None:
+            return cached
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        self.stats["requests"] += 1
+        if len(self._pending) == 1:
+            self._opened_at = time.time()
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        return await future
+
+    async def embed_many(self, texts: List[str]) -> List[List[float]]:
+        return list(await asyncio.gather(*(self.embed(text) for text in texts)))
+
+    def describe(self) -> Dict[str, Any]:
+        batches = self.stats["batches"]
+        return {
+            **self.stats,
+            "mean_batch_size": self.stats["requests"] / batches if batches else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+        }
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+
+        size = len(batch)
+        EMBED_BATCH_SIZE.observe(size)
+        EMBED_BATCH_WAIT_SECONDS.observe(time.time() - self._opened_at)
+        self.stats["batches"] += 1
+        histogram = self.stats["batch_size_histogram"]
+        histogram[size] = histogram.get(size, 0) + 1
+
+        task = asyncio.get_running_loop().create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future]]):
+        texts = [text for text, _ in batch]
+        loop = asyncio.get_running_loop()
+        start_time = time.time()
+        try:
+            vectors = await loop.run_in_executor(self.executor, self.embeddings.embed_queries, texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            EMBED_BATCH_INFERENCE_SECONDS.observe(time.time() - start_time)
+
+        for (_, future), vector in zip(batch, vectors):
+            if not future.done():
+                future.set_result(vector)
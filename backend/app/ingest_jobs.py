@@ -0,0 +1,296 @@
+"""
+Background ingestion jobs.
+
+``POST /api/ingest`` spools the upload into ``INGEST_JOBS_PATH/<job_id>/``
+and returns a job ID at once; a small pool of asyncio workers runs the
+streaming ingest (``ingestion.ingest_stream``) and ``GET
+/api/ingest/{job_id}`` reports its progress.
+
+Job state is written to ``job.json`` after every committed batch. Jobs
+still queued or running when the process stops are picked up again on the
+next start; chunks committed before the interruption are recognised by
+their content hash, so the job resumes after the last committed batch
+without embedding them again. An attempt cut short by a resource reload
+is re-queued the same way. Each job holds an
+exclusive ``flock`` on its directory while it is owned by a process, so
+with several uvicorn workers only one of them runs (or resumes) a job,
+and a crashed worker's lock is released by the OS.
+"""
+
+import asyncio
+import json
+import os
+import shutil
+import time
+import uuid
+from typing import Any, BinaryIO, Dict, List, Optional
+
+import structlog
+
+from .ingestion import IngestProgress, ingest_stream
+from .resources import RAGResources, get_resources
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process job locking
+    fcntl = None
+
+logger = structlog.get_logger()
+
+UNFINISHED = ("queued", "running")
+
+
+class IngestJob:
+    """One upload's ingest: spooled file, metadata, status and committed progress"""
+
+    def __init__(self, job_id: str, directory: str, source: str, metadata: Dict[str, Any],
+                 total_bytes: Optional[int] = None):
+        self.id = job_id
+        self.directory = directory
+        self.metadata = metadata
+        self.status = "queued"
+        self.error: Optional[str] = None
+        self.attempts = 0
+        self.created_at = time.time()
+        # Chunks stored by all attempts; ``progress`` only covers the current attempt
+        self.committed_chunks = 0
+        self.progress = IngestProgress(source, total_bytes)
+        self._lock_file: Optional[BinaryIO] = None
+
+    @property
+    def upload_path(self) -> str:
+        return os.path.join(self.directory, "upload")
+
+    @property
+    def finished(self) -> bool:
+        return self.status not in UNFINISHED
+
+    def lock(self) -> bool:
+        """Take ownership of the job; False if another process holds it"""
+        if fcntl is None:
+            return True
+        lock_file = open(os.path.join(self.directory, "lock"), "wb")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def unlock(self):
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def save(self):
+        """Atomically write the job state (called after every committed batch)"""
+        state = {
+            "id": self.id,
+            "source": self.progress.source,
+            "metadata": self.metadata,
+            "status": self.status,
+            "error": self.error,
+            "attempts": self.attempts,
+            "created_at": self.created_at,
+            "committed_chunks": self.committed_chunks,
+            "finished_at": self.progress.finished_at,
+            "total_bytes": self.progress.total_bytes,
+            "chunks": self.progress.chunks,
+            "batches": self.progress.batches,
+            "unchanged": self.progress.unchanged,
+            "deleted": self.progress.deleted,
+            "updated": self.progress.updated,
+        }
+        tmp_path = os.path.join(self.directory, "job.json.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, os.path.join(self.directory, "job.json"))
+
+    @classmethod
+    def load(cls, directory: str) -> "IngestJob":
+        with open(os.path.join(directory, "job.json")) as f:
+            state = json.load(f)
+        job = cls(state["id"], directory, state["source"], state["metadata"], state["total_bytes"])
+        job.status = state["status"]
+        job.error = state["error"]
+        job.attempts = state["attempts"]
+        job.created_at = state["created_at"]
+        job.committed_chunks = state.get("committed_chunks", state["chunks"])
+        job.progress.finished_at = state["finished_at"]
+        job.progress.chunks = state["chunks"]
+        job.progress.batches = state["batches"]
+        job.progress.unchanged = state.get("unchanged", 0)
+        job.progress.deleted = state.get("deleted", 0)
+        job.progress.updated = state.get("updated", 0)
+        return job
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "error": self.error,
+            "attempts": self.attempts,
+            "created_at": self.created_at,
+            "metadata": self.metadata,
+            "committed_chunks": self.committed_chunks,
+            "progress": self.progress.describe(),
+        }
+
+
+def invalidate_answer_caches(started_on: RAGResources):
+    """Clear the semantic cache of the live resources and of the ones a job started on.
+
+    After a reload during the job both may hold answers from before the change.
+    """
+    for cache in {started_on.semantic_cache, get_resources().semantic_cache} - {None}:
+        cache.invalidate()
+
+
+class IngestJobManager:
+    """Queue of ingest jobs persisted under ``directory`` and run by ``workers`` tasks"""
+
+    def __init__(self, directory: str, workers: int = 1, retention_seconds: float = 86400):
+        self.directory = directory
+        self.workers = workers
+        self.retention_seconds = retention_seconds
+        self.jobs: Dict[str, IngestJob] = {}
+        self.queue: "asyncio.Queue[IngestJob]" = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+
+    async def start(self):
+        """Re-enqueue unfinished jobs left by a previous process and start the workers"""
+        os.makedirs(self.directory, exist_ok=True)
+        for name in sorted(os.listdir(self.directory)):
+            job_dir = os.path.join(self.directory, name)
+            try:
+                job = IngestJob.load(job_dir)
+            except (OSError, ValueError, KeyError):
+                continue
+            if job.finished:
+                if (job.progress.finished_at or job.created_at) < time.time() - self.retention_seconds:
+                    shutil.rmtree(job_dir, ignore_errors=True)
+                continue
+            if job.lock():
+                logger.info("Resuming ingest job", job_id=job.id, source=job.progress.source,
+                            committed_chunks=job.committed_chunks)
+                job.status = "queued"
+                self.jobs[job.id] = job
+                self.queue.put_nowait(job)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Stop the workers; interrupted jobs stay "running" on disk and resume on the next start"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for job in self.jobs.values():
+            job.unlock()
+
+    async def submit(self, upload: BinaryIO, source: str, metadata: Dict[str, Any]) -> IngestJob:
+        """Spool ``upload`` to disk and queue it; returns once the job is durable"""
+        self._prune()
+        job_id = str(uuid.uuid4())
+        job = IngestJob(job_id, os.path.join(self.directory, job_id), source, metadata)
+        os.makedirs(job.directory)
+        job.lock()
+        await asyncio.to_thread(self._spool, upload, job.upload_path)
+        job.progress.total_bytes = os.path.getsize(job.upload_path)
+        job.save()
+        self.jobs[job_id] = job
+        self.queue.put_nowait(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        """A job by ID; jobs owned by another worker process are read from disk"""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job
+        job_dir = os.path.join(self.directory, os.path.basename(job_id))
+        try:
+            return IngestJob.load(job_dir)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def describe(self) -> Dict[str, Any]:
+        statuses: Dict[str, int] = {}
+        for job in self.jobs.values():
+            statuses[job.status] = statuses.get(job.status, 0) + 1
+        return {
+            "workers": self.workers,
+            "queued": self.queue.qsize(),
+            "jobs": statuses,
+            "running": [job.describe() for job in self.jobs.values() if job.status == "running"],
+        }
+
+    @staticmethod
+    def _spool(upload: BinaryIO, path: str):
+        upload.seek(0)
+        with open(path, "wb") as f:
+            shutil.copyfileobj(upload, f, 1024 * 1024)
+
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self.queue.task_done()
+
+    async def _run(self, job: IngestJob):
+        resources = get_resources()
+        job.status = "running"
+        job.attempts += 1
+        # Counters are per attempt; a resumed attempt counts earlier commits as unchanged
+        job.progress = IngestProgress(job.progress.source, job.progress.total_bytes)
+        committed_before = job.committed_chunks
+        job.save()
+
+        def on_commit(progress: IngestProgress):
+            job.committed_chunks = committed_before + progress.chunks
+            job.save()
+            # Every batch changes the corpus: drop answers cached before it and
+            # answers still being generated against the previous state
+            invalidate_answer_caches(resources)
+
+        try:
+            with open(job.upload_path, "rb") as f:
+                async def read(size: int) -> bytes:
+                    return await asyncio.to_thread(f.read, size)
+
+                await ingest_stream(read, job.metadata, job.progress, on_commit=on_commit)
+            job.status = "completed"
+            logger.info("Ingest job completed", job_id=job.id, **job.progress.describe())
+        except asyncio.CancelledError:
+            # Shutdown: leave the job "running" so the next start resumes it
+            raise
+        except Exception as e:
+            if get_resources() is not resources:
+                # A reload closed the resources this attempt started on: retry on the new ones
+                job.status = "queued"
+                logger.warning("Ingest job interrupted by a resource reload, resuming",
+                               job_id=job.id, error=str(e), **job.progress.describe())
+            else:
+                job.status = "failed"
+                job.error = str(e)
+                job.progress.finished_at = time.time()
+                logger.error("Ingest job failed", job_id=job.id, error=str(e), **job.progress.describe())
+        finally:
+            # Metadata updates and deletes of vanished chunks come after the last batch
+            if job.progress.chunks or job.progress.deleted or job.progress.updated:
+                invalidate_answer_caches(resources)
+        job.save()
+        if job.status == "queued":
+            self.queue.put_nowait(job)
+            return
+        job.unlock()
+        if job.status == "completed":
+            os.remove(job.upload_path)
+
+    def _prune(self):
+        """Forget finished jobs older than the retention period"""
+        cutoff = time.time() - self.retention_seconds
+        for job_id, job in list(self.jobs.items()):
+            if job.finished and (job.progress.finished_at or job.created_at) < cutoff:
+                del self.jobs[job_id]
+                shutil.rmtree(job.directory, ignore_errors=True)
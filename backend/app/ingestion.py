@@ -0,0 +1,419 @@
+"""
+Document ingestion.
+
+Chunks are embedded once and the same vectors are written to every
+configured store: the Supabase ``documents`` table and, when the local
+retriever backend is active, the in-process vector index. With hybrid
+retrieval on, the chunk texts are also added to the BM25 index.
+
+Uploads are streamed: the file is read and decoded incrementally, split
+as it arrives and stored in fixed-size batches, so peak memory depends on
+``INGEST_BATCH_SIZE`` and ``INGEST_READ_BYTES`` rather than the file size.
+Up to ``INGEST_EMBED_WORKERS`` batches are embedded concurrently on the
+ingest executor (ONNX releases the GIL) while the previous batch is being
+inserted; batches are still committed one at a time and in order.
+
+Every chunk carries a SHA-256 of its text in ``metadata["content_hash"]``.
+Re-ingesting a source only embeds chunks whose hash it does not already
+have; matching rows keep their embedding and original ``ingested_at``
+but take the rest of the new upload's metadata (e.g. tags), so an
+unchanged file rewrites nothing. Once the new chunks are stored the rows
+whose text no longer appears are deleted.
+"""
+
+import asyncio
+import codecs
+import hashlib
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+import structlog
+
+from .metrics import INGESTED_CHUNKS, INGEST_STAGE_SECONDS
+from .resources import RAGResources, get_resources, writable_resources
+
+try:
+    from langchain_core.documents import Document
+except ImportError:
+    from langchain.schema import Document
+
+logger = structlog.get_logger()
+
+
+def format_timestamp(moment: Optional[datetime] = None) -> str:
+    """UTC "YYYY-MM-DDTHH:MM:SSZ": fixed width, so text order is time order in SQL filters"""
+    moment = moment or datetime.now(timezone.utc)
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def store_documents(resources: RAGResources, docs: List[Document]) -> List[str]:
+    """Embed ``docs`` and insert them into all stores; returns the new row IDs.
+
+    Blocking (ONNX inference and Supabase inserts) - call from a worker thread.
+    """
+    if not docs:
+        return []
+    vectors, _ = embed_batch(resources, docs)
+    ids, _ = insert_batch(resources, docs, vectors)
+    return ids
+
+
+def chunk_hash(text: str) -> str:
+    """Content address of a chunk, stored as ``metadata["content_hash"]``"""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def existing_chunks(resources: RAGResources, source: str,
+                    page_size: int = 1000) -> Dict[str, List[Tuple[str, Optional[str]]]]:
+    """Blocking: content hash -> (ID, ingested_at) of the rows already stored for ``source``.
+
+    Rows ingested before hashes were recorded are hashed from their text.
+    """
+    chunks: Dict[str, List[Tuple[str, Optional[str]]]] = {}
+    if resources.supabase is not None:
+        table_name = resources.config["table_name"]
+        unhashed: List[Tuple[str, Optional[str]]] = []
+        offset = 0
+        while True:
+            # metadata @> {"source": ...} is served by the GIN index on metadata
+            rows = (resources.supabase.table(table_name)
+                    .select("id, content_hash:metadata->>content_hash, ingested_at:metadata->>ingested_at")
+                    .contains("metadata", {"source": source})
+                    .order("id")
+                    .range(offset, offset + page_size - 1)
+                    .execute()).data or []
+            for row in rows:
+                if row.get("content_hash"):
+                    chunks.setdefault(row["content_hash"], []).append((str(row["id"]), row.get("ingested_at")))
+                else:
+                    unhashed.append((str(row["id"]), row.get("ingested_at")))
+            if len(rows) < page_size:
+                break
+            offset += page_size
+        for start in range(0, len(unhashed), 200):
+            page = dict(unhashed[start:start + 200])
+            rows = (resources.supabase.table(table_name)
+                    .select("id, content")
+                    .in_("id", list(page))
+                    .execute()).data or []
+            for row in rows:
+                chunks.setdefault(chunk_hash(row.get("content") or ""), []).append(
+                    (str(row["id"]), page.get(str(row["id"]))))
+    elif resources.local_index is not None:
+        store = resources.local_index.store
+        for row in resources.local_index.source_rows(source):
+            metadata = store.metadata(row)
+            digest = metadata.get("content_hash") or chunk_hash(store.content(row))
+            chunks.setdefault(digest, []).append((store.id(row), metadata.get("ingested_at")))
+    return chunks
+
+
+def delete_chunks(resources: RAGResources, ids: List[str]) -> float:
+    """Blocking: remove rows from every store; returns the seconds taken"""
+    start = time.perf_counter()
+    if resources.supabase is not None:
+        for offset in range(0, len(ids), 200):
+            (resources.supabase.table(resources.config["table_name"])
+             .delete().in_("id", ids[offset:offset + 200]).execute())
+    if resources.local_index is not None:
+        resources.local_index.delete(ids)
+    if resources.lexical_index is not None:
+        resources.lexical_index.delete(ids)
+    return time.perf_counter() - start
+
+
+def kept_metadata(metadata: Dict[str, Any], digest: str, ingested_at: Optional[str]) -> Dict[str, Any]:
+    """Metadata of an unchanged chunk: the upload's, but its own hash and original ``ingested_at``"""
+    kept = {**metadata, "content_hash": digest}
+    if ingested_at:
+        kept["ingested_at"] = ingested_at
+    return kept
+
+
+def update_chunk_metadata(resources: RAGResources, ids: List[str], metadatas: List[Dict[str, Any]],
+                          metadata: Dict[str, Any]) -> Tuple[int, float]:
+    """Blocking: give existing rows the metadata of the current ingest.
+
+    ``metadatas`` are the rows' new metadata (see ``kept_metadata``);
+    Supabase is sent the upload's ``metadata`` and keeps each row's hash and
+    ``ingested_at`` itself. Only rows whose metadata differs are rewritten.
+    Returns the number of rows whose metadata changed and the seconds taken.
+    """
+    start = time.perf_counter()
+    updated = 0
+    if resources.supabase is not None:
+        for offset in range(0, len(ids), 500):
+            res = resources.supabase.rpc(resources.config["metadata_update_name"], {
+                "ids": ids[offset:offset + 500],
+                "new_metadata": metadata,
+            }).execute()
+            updated += res.data or 0
+    if resources.local_index is not None:
+        local_updated = resources.local_index.update_metadata(ids, metadatas)
+        if resources.supabase is None:
+            updated = local_updated
+    if resources.lexical_index is not None:
+        resources.lexical_index.update_metadata(ids, metadatas)
+    return updated, time.perf_counter() - start
+
+
+def write_live(write: Callable[..., Any], *args: Any) -> Any:
+    """Blocking: run a store write against the live resources, never during a rebuild"""
+    with writable_resources() as resources:
+        return write(resources, *args)
+
+
+def embed_batch(resources: RAGResources, docs: List[Document]) -> Tuple[List[List[float]], float]:
+    """Blocking: embed one batch; returns the vectors and the inference time in seconds"""
+    start = time.perf_counter()
+    vectors = resources.embeddings.embed_documents([doc.page_content for doc in docs])
+    return vectors, time.perf_counter() - start
+
+
+def insert_batch(resources: RAGResources, docs: List[Document],
+                 vectors: List[List[float]]) -> Tuple[List[str], float]:
+    """Blocking: write one embedded batch to every store; returns the row IDs and seconds taken"""
+    start = time.perf_counter()
+    ids = [str(uuid.uuid4()) for _ in docs]
+    texts = [doc.page_content for doc in docs]
+    if resources.doc_store is not None:
+        resources.doc_store.add_vectors(vectors, docs, ids)
+    if resources.local_index is not None:
+        resources.local_index.add(ids, texts, [doc.metadata for doc in docs], vectors)
+    if resources.lexical_index is not None:
+        resources.lexical_index.add(ids, texts, [doc.metadata for doc in docs])
+    return ids, time.perf_counter() - start
+
+
+class StreamingTextSplitter:
+    """``CharacterTextSplitter.split_text`` over text that arrives in pieces.
+
+    Produces the same chunks as splitting the whole text at once (same
+    separator / chunk_size / chunk_overlap merge rules) while holding only
+    the current chunk window and one unfinished paragraph. A paragraph
+    longer than ``max_split`` characters is cut there, which the one-shot
+    splitter would have emitted as a single oversized chunk.
+    """
+
+    def __init__(self, separator: str = "\n\n", chunk_size: int = 1000, chunk_overlap: int = 200,
+                 max_split: Optional[int] = None):
+        self.separator = separator
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.max_split = max_split or chunk_size * 8
+        self._pending = ""
+        self._current: List[str] = []
+        self._total = 0
+
+    def feed(self, text: str) -> List[str]:
+        """Add text; returns the chunks completed by it"""
+        self._pending += text
+        splits = self._pending.split(self.separator)
+        self._pending = splits.pop()
+        while len(self._pending) > self.max_split:
+            splits.append(self._pending[:self.max_split])
+            self._pending = self._pending[self.max_split:]
+        return [chunk for split in splits if split for chunk in self._merge(split)]
+
+    def finish(self) -> List[str]:
+        """Flush the trailing paragraph and the last chunk"""
+        chunks = self._merge(self._pending) if self._pending else []
+        self._pending = ""
+        last = self._join(self._current)
+        self._current, self._total = [], 0
+        return chunks + ([last] if last is not None else [])
+
+    def _merge(self, split: str) -> List[str]:
+        # Mirrors TextSplitter._merge_splits, one split at a time
+        chunks = []
+        separator_len = len(self.separator)
+        length = len(split)
+        if self._total + length + (separator_len if self._current else 0) > self.chunk_size:
+            if self._current:
+                chunk = self._join(self._current)
+                if chunk is not None:
+                    chunks.append(chunk)
+                while self._total > self.chunk_overlap or (
+                    self._total + length + (separator_len if self._current else 0) > self.chunk_size
+                    and self._total > 0
+                ):
+                    self._total -= len(self._current[0]) + (separator_len if len(self._current) > 1 else 0)
+                    self._current = self._current[1:]
+        self._current.append(split)
+        self._total += length + (separator_len if len(self._current) > 1 else 0)
+        return chunks
+
+    def _join(self, splits: List[str]) -> Optional[str]:
+        text = self.separator.join(splits).strip()
+        return text or None
+
+
+class IngestProgress:
+    """Counters for one ingest, updated as batches are committed"""
+
+    def __init__(self, source: str, total_bytes: Optional[int] = None):
+        self.source = source
+        self.total_bytes = total_bytes
+        self.bytes_read = 0
+        self.chunks = 0
+        self.batches = 0
+        # Chunks whose hash was already stored for the source, and stored rows that vanished
+        self.unchanged = 0
+        self.deleted = 0
+        # Unchanged chunks whose metadata (e.g. tags) was rewritten
+        self.updated = 0
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        # Summed per batch; with overlapping stages they can add up to more than the wall time
+        self.stage_seconds = {"lookup": 0.0, "split": 0.0, "embed": 0.0, "insert": 0.0, "update": 0.0,
+                              "delete": 0.0}
+
+    def record(self, stage: str, seconds: float):
+        self.stage_seconds[stage] += seconds
+        INGEST_STAGE_SECONDS.labels(stage=stage).observe(seconds)
+
+    def describe(self) -> Dict[str, Any]:
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        return {
+            "source": self.source,
+            "bytes_read": self.bytes_read,
+            "total_bytes": self.total_bytes,
+            "percent": round(100 * self.bytes_read / self.total_bytes, 1) if self.total_bytes else None,
+            "chunks": self.chunks,
+            "batches": self.batches,
+            "unchanged": self.unchanged,
+            "deleted": self.deleted,
+            "updated": self.updated,
+            "elapsed_ms": elapsed * 1000,
+            "chunks_per_second": self.chunks / elapsed if elapsed > 0 else 0.0,
+            "stage_ms": {stage: seconds * 1000 for stage, seconds in self.stage_seconds.items()},
+        }
+
+
+async def iter_decoded(read: Callable[[int], Awaitable[bytes]], read_size: int,
+                       progress: IngestProgress, encoding: str = "utf-8") -> AsyncIterator[str]:
+    """Read ``read_size`` bytes at a time and decode; multi-byte characters may span reads"""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    while True:
+        data = await read(read_size)
+        if not data:
+            break
+        progress.bytes_read += len(data)
+        yield decoder.decode(data)
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+
+async def ingest_stream(read: Callable[[int], Awaitable[bytes]], metadata: Dict[str, Any],
+                        progress: IngestProgress,
+                        on_commit: Optional[Callable[[IngestProgress], Any]] = None) -> IngestProgress:
+    """Split, embed and store an upload batch by batch as it is read.
+
+    Embedding of the next batches overlaps the insert of the current one;
+    at most ``INGEST_EMBED_WORKERS`` embedded batches plus one insert are in
+    flight, which keeps memory bounded. Chunks already stored for the source
+    (by an earlier ingest, or by an interrupted run of this one) are matched
+    by content hash and not embedded again. ``on_commit`` is called after
+    every batch.
+
+    The process-wide resources are looked up for every batch rather than
+    held for the whole upload, so after ``POST /api/resources/reload`` the
+    remaining batches use the new executor and indexes instead of the ones
+    being closed; writes wait while a reload is loading its indexes.
+    """
+    config = get_resources().config
+    start = time.perf_counter()
+    existing = await asyncio.to_thread(existing_chunks, get_resources(), metadata["source"])
+    progress.record("lookup", time.perf_counter() - start)
+    splitter = StreamingTextSplitter(chunk_size=config["ingest_chunk_size"],
+                                     chunk_overlap=config["ingest_chunk_overlap"])
+    loop = asyncio.get_running_loop()
+    embedding: Deque[Tuple[List[Document], asyncio.Future]] = deque()
+    inserting: Optional[asyncio.Future] = None
+    batch: List[Document] = []
+    kept_ids: List[str] = []
+    kept_metadatas: List[Dict[str, Any]] = []
+
+    def new_documents(chunks: List[str]) -> List[Document]:
+        docs = []
+        for chunk in chunks:
+            digest = chunk_hash(chunk)
+            rows = existing.get(digest)
+            if rows:
+                # Same text already stored for this source: keep that row and its embedding
+                row_id, ingested_at = rows.pop()
+                kept_ids.append(row_id)
+                kept_metadatas.append(kept_metadata(metadata, digest, ingested_at))
+                progress.unchanged += 1
+            else:
+                docs.append(Document(page_content=chunk, metadata={**metadata, "content_hash": digest}))
+        return docs
+
+    async def insert(docs: List[Document], vectors: List[List[float]]):
+        _, seconds = await asyncio.to_thread(write_live, insert_batch, docs, vectors)
+        progress.record("insert", seconds)
+        progress.chunks += len(docs)
+        progress.batches += 1
+        INGESTED_CHUNKS.inc(len(docs))
+        logger.info("Ingest batch stored", **progress.describe())
+        if on_commit is not None:
+            on_commit(progress)
+
+    async def commit_next():
+        nonlocal inserting
+        docs, future = embedding.popleft()
+        vectors, seconds = await future
+        progress.record("embed", seconds)
+        if inserting is not None:
+            # Shielded: cancelling the ingest must not abandon an insert whose rows
+            # are being written anyway, or its batch would go uncounted
+            await asyncio.shield(inserting)
+        inserting = asyncio.ensure_future(insert(docs, vectors))
+
+    async def submit(docs: List[Document]):
+        resources = get_resources()
+        embedding.append((docs, loop.run_in_executor(resources.ingest_executor, embed_batch, resources, docs)))
+        while len(embedding) > config["ingest_embed_workers"]:
+            await commit_next()
+
+    try:
+        async for text in iter_decoded(read, config["ingest_read_bytes"], progress):
+            start = time.perf_counter()
+            docs = new_documents(splitter.feed(text))
+            progress.record("split", time.perf_counter() - start)
+            for doc in docs:
+                batch.append(doc)
+                if len(batch) >= config["ingest_batch_size"]:
+                    await submit(batch)
+                    batch = []
+        batch.extend(new_documents(splitter.finish()))
+        if batch:
+            await submit(batch)
+        while embedding:
+            await commit_next()
+        if inserting is not None:
+            await asyncio.shield(inserting)
+        if kept_ids:
+            progress.updated, seconds = await asyncio.to_thread(
+                write_live, update_chunk_metadata, kept_ids, kept_metadatas, metadata)
+            progress.record("update", seconds)
+        # Only after every new chunk is stored, so the source is never missing
+        vanished = [row_id for rows in existing.values() for row_id, _ in rows]
+        if vanished:
+            progress.record("delete", await asyncio.to_thread(write_live, delete_chunks, vanished))
+            progress.deleted = len(vanished)
+    except BaseException:
+        for _, future in embedding:
+            future.cancel()
+        if inserting is not None:
+            # Never leave an insert running after the ingest has been reported as failed
+            await asyncio.gather(inserting, return_exceptions=True)
+        raise
+    progress.finished_at = time.time()
+    return progress
@@ -0,0 +1,194 @@
+"""
+In-process BM25 inverted index for hybrid retrieval.
+
+Dense bge-small vectors are weak on exact identifiers (error codes, product
+names, version strings); BM25 over the same chunks catches those. Postings
+are append-only ``array`` buffers per term, so ingesting a chunk costs one
+tokenization and a few appends, and a query only touches the postings of
+its own terms. Deleted rows are tombstoned and skipped at query time; a
+separate live document frequency per term keeps idf exact across deletes.
+
+The index is kept in sync with ingestion and rebuilt at startup from the
+local embedding store (or the Supabase ``documents`` table). Like the
+in-RAM local index it is per process: rows ingested through another worker
+appear after that worker's resources are reloaded.
+"""
+
+import math
+import re
+import threading
+from array import array
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import structlog
+
+from .local_index import filter_matches
+
+logger = structlog.get_logger()
+
+# Words, numbers and dotted/dashed identifiers such as "x-200" or "v1.2.3"
+TOKEN_PATTERN = re.compile(r"[a-z0-9_]+(?:[-./][a-z0-9_]+)*")
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by for from has have how i in is it its of on or "
+    "that the this to was were what when where which who why will with you your".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased terms; compound identifiers are indexed whole and by their parts"""
+    terms = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        terms.append(token)
+        if not token.isalnum():
+            terms.extend(part for part in re.split(r"[-./]", token) if part and part not in STOPWORDS)
+    return terms
+
+
+class BM25Index:
+    """Incremental Okapi BM25 over chunk texts"""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.RLock()
+        self._postings: Dict[str, tuple] = {}  # term -> (array of rows, array of term frequencies)
+        self._df: Dict[str, int] = {}  # term -> live rows containing it
+        self._ids: List[str] = []
+        self._row_by_id: Dict[str, int] = {}
+        self._contents: List[str] = []
+        self._metadatas: List[Dict[str, Any]] = []
+        self._lengths = array("f")
+        self._deleted = array("b")
+        self._live_rows = 0
+        self._live_length = 0.0
+
+    def __len__(self) -> int:
+        return self._live_rows
+
+    def add(self, ids: Sequence[str], contents: Sequence[str], metadatas: Sequence[Dict[str, Any]]):
+        with self._lock:
+            for row_id, content, metadata in zip(ids, contents, metadatas):
+                row = len(self._ids)
+                terms = Counter(tokenize(content))
+                postings = self._postings
+                df = self._df
+                for term, frequency in terms.items():
+                    df[term] = df.get(term, 0) + 1
+                    posting = postings.get(term)
+                    if posting is None:
+                        posting = postings[term] = (array("q"), array("f"))
+                    posting[0].append(row)
+                    posting[1].append(frequency)
+                length = sum(terms.values())
+                self._ids.append(str(row_id))
+                self._row_by_id[str(row_id)] = row
+                self._contents.append(content)
+                self._metadatas.append(dict(metadata or {}))
+                self._lengths.append(length)
+                self._deleted.append(0)
+                self._live_rows += 1
+                self._live_length += length
+
+    def delete(self, ids: Sequence[str]) -> int:
+        removed = 0
+        with self._lock:
+            for row_id in ids:
+                row = self._row_by_id.pop(str(row_id), None)
+                if row is None or self._deleted[row]:
+                    continue
+                self._deleted[row] = 1
+                for term in set(tokenize(self._contents[row])):
+                    self._df[term] -= 1
+                self._live_rows -= 1
+                self._live_length -= self._lengths[row]
+                removed += 1
+        return removed
+
+    def update_metadata(self, ids: Sequence[str], metadatas: Sequence[Dict[str, Any]]):
+        """Replace the metadata used by filters; the indexed text is unchanged"""
+        with self._lock:
+            for row_id, metadata in zip(ids, metadatas):
+                row = self._row_by_id.get(str(row_id))
+                if row is not None:
+                    self._metadatas[row] = dict(metadata or {})
+
+    def search(self, query: str, k: int, metadata_filter: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        """Top-k rows by BM25 score, in ``match_documents`` row shape plus ``bm25``"""
+        terms = set(tokenize(query))
+        with self._lock:
+            if not terms or self._live_rows == 0:
+                return []
+            size = len(self._ids)
+            lengths = np.frombuffer(self._lengths, dtype=np.float32, count=size)
+            norm = self.k1 * (1 - self.b + self.b * lengths / (self._live_length / self._live_rows))
+            scores = np.zeros(size, dtype=np.float32)
+            for term in terms:
+                posting = self._postings.get(term)
+                if posting is None:
+                    continue
+                rows = np.frombuffer(posting[0], dtype=np.int64, count=len(posting[0]))
+                frequencies = np.frombuffer(posting[1], dtype=np.float32, count=len(posting[1]))
+                df = self._df[term]
+                if df == 0:
+                    continue
+                idf = math.log(1 + (self._live_rows - df + 0.5) / (df + 0.5))
+                scores[rows] += idf * frequencies * (self.k1 + 1) / (frequencies + norm[rows])
+
+            deleted = np.frombuffer(self._deleted, dtype=np.int8, count=size).astype(bool)
+            scores[deleted] = 0
+            if metadata_filter:
+                for row in np.flatnonzero(scores):
+                    if not filter_matches(self._metadatas[row], metadata_filter):
+                        scores[row] = 0
+
+            matched = np.flatnonzero(scores > 0)
+            if len(matched) > k:
+                matched = matched[np.argpartition(-scores[matched], k - 1)[:k]]
+            matched = matched[np.argsort(-scores[matched])]
+            return [
+                {
+                    "id": self._ids[row],
+                    "content": self._contents[row],
+                    "metadata": self._metadatas[row],
+                    "bm25": float(scores[row]),
+                }
+                for row in matched
+            ]
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "rows": self._live_rows,
+            "deleted_rows": len(self._ids) - self._live_rows,
+            "terms": len(self._postings),
+            "k1": self.k1,
+            "b": self.b,
+        }
+
+    def load_from_store(self, store):
+        """Index every live row of a local index row store"""
+        deleted = store.deleted
+        live = [row for row in range(len(store)) if not deleted[row]]
+        self.add([store.id(row) for row in live], [store.content(row) for row in live],
+                 [store.metadata(row) for row in live])
+        logger.info("BM25 index built from local store", rows=len(self), terms=len(self._postings))
+
+    def load_from_supabase(self, client, table_name: str, page_size: int = 1000):
+        """Index every row of the documents table (text only, no embeddings)"""
+        offset = 0
+        while True:
+            res = (client.table(table_name)
+                   .select("id, content, metadata")
+                   .range(offset, offset + page_size - 1)
+                   .execute())
+            rows = res.data or []
+            self.add([str(row["id"]) for row in rows], [row.get("content") or "" for row in rows],
+                     [row.get("metadata") or {} for row in rows])
+            if len(rows) < page_size:
+                break
+            offset += page_size
+        logger.info("BM25 index built from Supabase", rows=len(self), terms=len(self._postings))
@@ -0,0 +1,471 @@
+"""
+In-process vector index.
+
+Mirrors the ``documents`` table into a contiguous matrix of normalized 384-d
+bge-small vectors and answers top-k cosine queries with a single vectorized
+matrix product, avoiding the PostgREST -> plpgsql ``match_documents``
+round-trip. For larger corpora an optional HNSW graph (``hnswlib``) is built
+on top of the same vectors, or the scan runs over compact int8 / product
+quantized codes and only the best candidates are rescored exactly.
+
+Rows live either in RAM (``InMemoryRows``) or in a memory-mapped
+``EmbeddingStore`` on disk, which workers share through the page cache and
+reopen in milliseconds. Quantization needs the on-disk store: the codes
+and their codebook are saved next to its rows, and only the shortlisted
+float32 rows are read back from the mapping. Rows are returned in the same shape as
+``match_documents`` so the pipeline does not care which backend answered.
+"""
+
+import json
+import os
+import threading
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import structlog
+
+try:
+    import hnswlib
+    HNSWLIB_AVAILABLE = True
+except ImportError:
+    HNSWLIB_AVAILABLE = False
+
+from .quantization import make_quantizer
+
+logger = structlog.get_logger()
+
+# Filter keys match_documents compares with ingested_at instead of by containment
+INGESTED_RANGE_KEYS = ("$ingested_after", "$ingested_before")
+
+
+def metadata_matches(metadata: Any, pattern: Any) -> bool:
+    """Python equivalent of Postgres ``metadata @> pattern`` (jsonb containment)"""
+    if isinstance(pattern, dict):
+        return isinstance(metadata, dict) and all(
+            key in metadata and metadata_matches(metadata[key], value)
+            for key, value in pattern.items()
+        )
+    if isinstance(pattern, list):
+        if not isinstance(metadata, list):
+            return False
+        return all(any(metadata_matches(item, wanted) for item in metadata) for wanted in pattern)
+    # jsonb true is not the number 1, although True == 1 in Python
+    if isinstance(metadata, bool) or isinstance(pattern, bool):
+        return metadata is pattern
+    return metadata == pattern
+
+
+def filter_matches(metadata: Any, metadata_filter: Dict[str, Any]) -> bool:
+    """Python equivalent of the ``match_documents`` filter: containment plus ingest date range
+
+    ``$ingested_after`` (inclusive) and ``$ingested_before`` (exclusive) are
+    compared against the ``ingested_at`` metadata timestamp; every other key
+    must be contained in the metadata.
+    """
+    ingested_at = metadata.get("ingested_at") if isinstance(metadata, dict) else None
+    if ingested_at is not None and not isinstance(ingested_at, str):
+        # ->> renders any other JSON value as its text
+        ingested_at = json.dumps(ingested_at)
+    after = metadata_filter.get("$ingested_after")
+    if after is not None and (ingested_at is None or ingested_at < after):
+        return False
+    before = metadata_filter.get("$ingested_before")
+    if before is not None and (ingested_at is None or ingested_at >= before):
+        return False
+    return metadata_matches(metadata, {key: value for key, value in metadata_filter.items()
+                                       if key not in INGESTED_RANGE_KEYS})
+
+
+def parse_embedding(value: Any) -> List[float]:
+    """pgvector columns arrive from PostgREST as ``"[0.1,0.2,...]"`` strings"""
+    return json.loads(value) if isinstance(value, str) else list(value)
+
+
+def normalize_rows(vectors: Any, dimension: int) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, dimension)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms > 0, norms, 1)
+
+
+class InMemoryRows:
+    """Growable in-RAM row storage with the same interface as ``EmbeddingStore``"""
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+        self._ids: List[str] = []
+        self._contents: List[str] = []
+        self._metadatas: List[Dict[str, Any]] = []
+        self._matrix = np.zeros((0, dimension), dtype=np.float32)
+        self._deleted = np.zeros(0, dtype=bool)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self._matrix[:self._size]
+
+    @property
+    def deleted(self) -> np.ndarray:
+        return self._deleted[:self._size]
+
+    def id(self, row: int) -> str:
+        return self._ids[row]
+
+    def ids(self) -> List[str]:
+        return list(self._ids)
+
+    def content(self, row: int) -> str:
+        return self._contents[row]
+
+    def metadata(self, row: int) -> Dict[str, Any]:
+        return self._metadatas[row]
+
+    @property
+    def generation(self) -> Optional[str]:
+        return None
+
+    def refresh(self) -> bool:
+        return False
+
+    def append(self, ids: Sequence[str], contents: Sequence[str],
+               metadatas: Sequence[Dict[str, Any]], vectors: np.ndarray):
+        # Geometric growth keeps incremental ingests amortized O(1) per row
+        needed = self._size + len(ids)
+        if needed > self._matrix.shape[0]:
+            capacity = max(needed, 2 * self._matrix.shape[0], 1024)
+            grown = np.zeros((capacity, self.dimension), dtype=np.float32)
+            grown[:self._size] = self._matrix[:self._size]
+            self._matrix = grown
+            deleted = np.zeros(capacity, dtype=bool)
+            deleted[:self._size] = self._deleted[:self._size]
+            self._deleted = deleted
+        self._matrix[self._size:needed] = vectors
+        self._size = needed
+        self._ids.extend(ids)
+        self._contents.extend(contents)
+        self._metadatas.extend(dict(m or {}) for m in metadatas)
+
+    def delete(self, ids: Sequence[str]) -> int:
+        wanted = set(ids)
+        removed = 0
+        for row, row_id in enumerate(self._ids):
+            if row_id in wanted and not self._deleted[row]:
+                self._deleted[row] = True
+                removed += 1
+        return removed
+
+    def update_metadata(self, ids: Sequence[str], metadatas: Sequence[Dict[str, Any]]) -> int:
+        wanted = dict(zip(ids, metadatas))
+        updated = 0
+        for row, row_id in enumerate(self._ids):
+            metadata = wanted.get(row_id)
+            if metadata is not None and not self._deleted[row] and self._metadatas[row] != metadata:
+                self._metadatas[row] = dict(metadata)
+                updated += 1
+        return updated
+
+    def describe(self) -> Dict[str, Any]:
+        return {"storage": "memory", "deleted_rows": int(self.deleted.sum())}
+
+
+class LocalVectorIndex:
+    """Exact (and optional HNSW) top-k cosine search over normalized vectors"""
+
+    def __init__(self, dimension: int = 384, store=None, use_hnsw: bool = False,
+                 hnsw_min_rows: int = 50000, hnsw_m: int = 16, hnsw_ef_construction: int = 200,
+                 hnsw_ef_search: int = 64, quantization: str = "none", quantize_min_rows: int = 1000,
+                 rerank_factor: int = 10, pq_subspaces: int = 48):
+        self.dimension = dimension
+        self.store = store if store is not None else InMemoryRows(dimension)
+        self._lock = threading.RLock()
+        # Decoded metadata of every row, built on the first filtered query
+        self._metadata_cache: Optional[List[Dict[str, Any]]] = None
+        # metadata["source"] -> rows; extended incrementally, rebuilt after a compaction
+        self._source_rows: Dict[Any, List[int]] = {}
+        self._source_rows_size = 0
+        self._source_rows_generation = None
+
+        self.use_hnsw = use_hnsw and HNSWLIB_AVAILABLE
+        self.hnsw_min_rows = hnsw_min_rows
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construction = hnsw_ef_construction
+        self.hnsw_ef_search = hnsw_ef_search
+        self._hnsw = None
+        self._hnsw_rows = 0
+        self._hnsw_generation = None
+        if use_hnsw and not HNSWLIB_AVAILABLE:
+            logger.warning("hnswlib not installed; local index will use exact search only")
+
+        # First-stage codes; the top ``k * rerank_factor`` are rescored in float32
+        self.quantizer = make_quantizer(quantization, dimension, pq_subspaces)
+        if self.quantizer is not None and isinstance(self.store, InMemoryRows):
+            # Codes next to an in-RAM float32 copy would only add memory
+            logger.warning("LOCAL_INDEX_QUANTIZATION needs LOCAL_INDEX_PATH; local index will use exact search")
+            self.quantizer = None
+        self.quantize_min_rows = quantize_min_rows
+        self.rerank_factor = rerank_factor
+        self._codes: Optional[np.ndarray] = None
+        self._codes_generation = None
+        self._update_hnsw()
+        self._update_codes()
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    @property
+    def vectors(self) -> np.ndarray:
+        return self.store.vectors
+
+    def add(self, ids: Sequence[str], contents: Sequence[str], metadatas: Sequence[Dict[str, Any]],
+            embeddings: Sequence[Sequence[float]]):
+        if not ids:
+            return
+        vectors = normalize_rows(embeddings, self.dimension)
+        with self._lock:
+            self.store.append(list(ids), list(contents), list(metadatas), vectors)
+            self._metadata_cache = None
+            self._update_hnsw()
+            self._update_codes()
+
+    def delete(self, ids: Sequence[str]) -> int:
+        with self._lock:
+            return self.store.delete(list(ids))
+
+    def update_metadata(self, ids: Sequence[str], metadatas: Sequence[Dict[str, Any]]) -> int:
+        """Replace the metadata of existing rows; returns how many changed"""
+        if not ids:
+            return 0
+        with self._lock:
+            updated = self.store.update_metadata(list(ids), list(metadatas))
+            if updated:
+                self._metadata_cache = None
+            return updated
+
+    def source_rows(self, source: str) -> List[int]:
+        """Live rows ingested from ``source``; only rows appended since the last call are parsed"""
+        self.refresh()
+        with self._lock:
+            if self.store.generation != self._source_rows_generation:
+                self._source_rows, self._source_rows_size = {}, 0
+                self._source_rows_generation = self.store.generation
+            for row in range(self._source_rows_size, len(self.store)):
+                self._source_rows.setdefault(self.store.metadata(row).get("source"), []).append(row)
+            self._source_rows_size = len(self.store)
+            deleted = self.store.deleted
+            return [row for row in self._source_rows.get(source, []) if not deleted[row]]
+
+    def refresh(self):
+        """Pick up rows appended or compacted by other processes sharing the store"""
+        with self._lock:
+            if self.store.refresh():
+                self._metadata_cache = None
+            # Also catches a compaction done through this same store object
+            self._update_hnsw()
+            self._update_codes()
+
+    def search(self, query_embedding: Sequence[float], k: int,
+               metadata_filter: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        return self.search_many([query_embedding], k, metadata_filter)[0]
+
+    def search_many(self, query_embeddings: Sequence[Sequence[float]], k: int,
+                    metadata_filter: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+        """Top-k rows per query, ordered by descending cosine similarity"""
+        queries = normalize_rows(query_embeddings, self.dimension)
+        self.refresh()
+        with self._lock:
+            if len(self.store) == 0:
+                return [[] for _ in range(len(queries))]
+            if self._hnsw is not None and not metadata_filter:
+                return self._search_hnsw(queries, k)
+            if self._codes is not None and not metadata_filter:
+                return self._search_quantized(queries, k)
+
+            deleted = self.store.deleted
+            candidates = None
+            if metadata_filter:
+                metadatas = self._all_metadata()
+                candidates = np.fromiter(
+                    (i for i, metadata in enumerate(metadatas)
+                     if not deleted[i] and filter_matches(metadata, metadata_filter)),
+                    dtype=np.int64,
+                )
+                if len(candidates) == 0:
+                    return [[] for _ in range(len(queries))]
+                scores = queries @ self.vectors[candidates].T
+            else:
+                scores = queries @ self.vectors.T
+                if deleted.any():
+                    scores[:, deleted] = -np.inf
+
+            results = []
+            for row_scores in scores:
+                top = self._top_k(row_scores, k)
+                rows = candidates[top] if candidates is not None else top
+                results.append([
+                    self._row(int(i), float(s)) for i, s in zip(rows, row_scores[top]) if np.isfinite(s)
+                ])
+            return results
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "rows": len(self.store),
+            "dimension": self.dimension,
+            "memory_bytes": int(self.vectors.nbytes),
+            "hnsw": self._hnsw is not None,
+            "quantization": self.quantizer.name if self._codes is not None else None,
+            "code_bytes": int(self._codes.nbytes) if self._codes is not None else 0,
+            **self.store.describe(),
+        }
+
+    def load_from_supabase(self, client, table_name: str, page_size: int = 1000):
+        """Mirror every row of the documents table into the index"""
+        quantizer, self.quantizer = self.quantizer, None
+        offset = 0
+        while True:
+            res = (client.table(table_name)
+                   .select("id, content, metadata, embedding")
+                   .range(offset, offset + page_size - 1)
+                   .execute())
+            rows = res.data or []
+            if rows:
+                self.add(
+                    [str(row["id"]) for row in rows],
+                    [row.get("content") or "" for row in rows],
+                    [row.get("metadata") or {} for row in rows],
+                    [parse_embedding(row["embedding"]) for row in rows],
+                )
+            if len(rows) < page_size:
+                break
+            offset += page_size
+        with self._lock:
+            # Train on the full corpus rather than the first page that crossed the threshold
+            self.quantizer = quantizer
+            self._update_codes()
+        logger.info("Local vector index loaded from Supabase", rows=len(self.store))
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+        if k >= len(scores):
+            return np.argsort(-scores)
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top])]
+
+    def _all_metadata(self) -> List[Dict[str, Any]]:
+        if self._metadata_cache is None or len(self._metadata_cache) != len(self.store):
+            self._metadata_cache = [self.store.metadata(i) for i in range(len(self.store))]
+        return self._metadata_cache
+
+    def _row(self, index: int, similarity: float) -> Dict[str, Any]:
+        return {
+            "id": self.store.id(index),
+            "content": self.store.content(index),
+            "metadata": self.store.metadata(index),
+            "similarity": similarity,
+        }
+
+    def _update_hnsw(self):
+        size = len(self.store)
+        if not self.use_hnsw or size < self.hnsw_min_rows:
+            self._hnsw = None
+            self._hnsw_rows = 0
+            return
+        if self._hnsw is None or self.store.generation != self._hnsw_generation:
+            # First build, or the store was compacted and row labels shifted
+            self._hnsw = hnswlib.Index(space="ip", dim=self.dimension)
+            self._hnsw.init_index(max_elements=max(2 * size, self.hnsw_min_rows),
+                                  ef_construction=self.hnsw_ef_construction, M=self.hnsw_m)
+            self._hnsw.set_ef(self.hnsw_ef_search)
+            self._hnsw_rows = 0
+            self._hnsw_generation = self.store.generation
+        if size > self._hnsw.get_max_elements():
+            self._hnsw.resize_index(2 * size)
+        if size > self._hnsw_rows:
+            self._hnsw.add_items(np.asarray(self.vectors[self._hnsw_rows:size], dtype=np.float32),
+                                 np.arange(self._hnsw_rows, size))
+            self._hnsw_rows = size
+
+    def _search_hnsw(self, queries: np.ndarray, k: int) -> List[List[Dict[str, Any]]]:
+        deleted = self.store.deleted
+        # Over-fetch so tombstoned rows can be skipped without losing results
+        fetch = min(len(self.store), k + int(deleted.sum()))
+        self._hnsw.set_ef(max(self.hnsw_ef_search, fetch))
+        labels, distances = self._hnsw.knn_query(queries, k=fetch)
+        # Inner-product space reports 1 - dot, i.e. cosine distance for unit vectors
+        return [
+            [self._row(int(i), float(1 - d)) for i, d in zip(row_labels, row_distances)
+             if not deleted[i]][:k]
+            for row_labels, row_distances in zip(labels, distances)
+        ]
+
+    def _update_codes(self):
+        size = len(self.store)
+        if self.quantizer is None or size == 0 or size < self.quantize_min_rows:
+            self._codes = None
+            return
+        if (self._codes is not None and self.store.generation == self._codes_generation
+                and len(self._codes) >= size):
+            return
+        # Codebook and codes are files of the store generation, shared by every worker
+        with self.store.writer_lock():
+            self.store.refresh()
+            size = len(self.store)
+            key = self.quantizer.key
+            params_path = self.store.sidecar_path(f"{key}.params.npy")
+            codes_path = self.store.sidecar_path(f"{key}.codes.bin")
+            row_bytes = self.quantizer.code_bytes()
+            codes = self._codes if self.store.generation == self._codes_generation else None
+            if codes is None:
+                codes = self._load_codebook(params_path, codes_path)
+            stored = os.path.getsize(codes_path) // row_bytes if os.path.exists(codes_path) else 0
+            if stored > len(codes):
+                # Rows encoded by another worker
+                tail = np.fromfile(codes_path, dtype=self.quantizer.code_dtype, offset=len(codes) * row_bytes,
+                                   count=(stored - len(codes)) * row_bytes)
+                codes = np.concatenate([codes, tail.reshape(-1, row_bytes)])
+            if size > len(codes):
+                tail = self.quantizer.encode(self.vectors[len(codes):size])
+                with open(codes_path, "ab") as codes_file:
+                    # A crash may have left a partial row behind
+                    codes_file.truncate(len(codes) * row_bytes)
+                    codes_file.write(tail.tobytes())
+                codes = np.concatenate([codes, tail])
+            self._codes = codes[:size]
+            self._codes_generation = self.store.generation
+
+    def _load_codebook(self, params_path: str, codes_path: str) -> np.ndarray:
+        """Load the saved codebook (or train and save one); returns the codes to extend"""
+        empty = np.zeros((0, self.quantizer.code_bytes()), dtype=self.quantizer.code_dtype)
+        try:
+            self.quantizer.set_params(np.load(params_path))
+            return empty
+        except (OSError, ValueError) as e:
+            if os.path.exists(params_path):
+                logger.warning(f"Discarding unreadable quantizer codebook: {e}")
+        # Train on live rows; later appends are encoded with the same codebook
+        live = np.flatnonzero(~self.store.deleted)
+        self.quantizer.fit(np.asarray(self.vectors[live], dtype=np.float32))
+        tmp_path = params_path + ".tmp.npy"
+        np.save(tmp_path, self.quantizer.get_params())
+        if os.path.exists(codes_path):
+            os.remove(codes_path)
+        os.replace(tmp_path, params_path)
+        logger.info("Local index quantizer trained", quantization=self.quantizer.name, rows=len(live))
+        return empty
+
+    def _search_quantized(self, queries: np.ndarray, k: int) -> List[List[Dict[str, Any]]]:
+        deleted = self.store.deleted
+        shortlist_size = min(len(self.store), k * self.rerank_factor)
+        results = []
+        for query in queries:
+            approx = self.quantizer.scores(self._codes, query)
+            if deleted.any():
+                approx[deleted] = -np.inf
+            # Sorted row order keeps the float32 gather sequential in the mmap
+            shortlist = np.sort(self._top_k(approx, shortlist_size))
+            shortlist = shortlist[np.isfinite(approx[shortlist])]
+            exact = np.asarray(self.vectors[shortlist], dtype=np.float32) @ query
+            top = self._top_k(exact, k)
+            results.append([self._row(int(shortlist[i]), float(exact[i])) for i in top])
+        return results
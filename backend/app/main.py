@@ -1,19 +1,25 @@
-from fastapi import FastAPI, UploadFile, File
+import asyncio
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, UploadFile, File, Form
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from prometheus_client import make_asgi_app
 from pydantic import BaseModel
-from langchain_community.vectorstores import SupabaseVectorStore
-from langchain_community.embeddings import FastEmbedEmbeddings
-from langchain_community.llms import Ollama
-from langchain.text_splitter import CharacterTextSplitter
-from langchain.chains import RetrievalQA
-from supabase import create_client, Client
 import os
 import time
 import json
 import uuid
-from typing import Dict, Any, Optional
+from datetime import datetime
+from typing import Dict, Any, List, Optional
 import structlog
 
+from .resources import get_resources, rebuild_resources, close_resources, close_after_grace
+from .pipeline import run_rag_query, run_rag_batch, stream_rag_query, source_summary
+from .admission import AdmissionRejected
+from .ingestion import format_timestamp
+from .ingest_jobs import IngestJobManager
+
 # LLM Observability imports
 try:
     from langsmith import Client as LangSmithClient
@@ -22,14 +28,6 @@ try:
 except ImportError:
     LANGSMITH_AVAILABLE = False
 
-# Import Document and PromptTemplate with fallbacks for compatibility
-try:
-    from langchain_core.documents import Document
-    from langchain_core.prompts import PromptTemplate
-except ImportError:
-    from langchain.schema import Document
-    from langchain.prompts import PromptTemplate
-
 # Setup structured logging
 logger = structlog.get_logger()
 
@@ -64,7 +62,9 @@ def create_trace_context(query: str, trace_id: Optional[str] = None) -> Dict[str
     }
 
 def log_rag_metrics(trace_context: Dict[str, Any], retrieval_docs: list, response: str, 
-                   response_time: float, token_count: Optional[int] = None):
+                   response_time: float, token_count: Optional[int] = None,
+                   time_to_first_token: Optional[float] = None,
+                   extra_metrics: Optional[Dict[str, Any]] = None):
     """Log comprehensive RAG metrics to observability platforms"""
     
     metrics = {
@@ -74,8 +74,11 @@ def log_rag_metrics(trace_context: Dict[str, Any], retrieval_docs: list, respons
         "retrieved_docs_count": len(retrieval_docs),
         "response_length": len(response),
         "token_count": token_count or estimate_tokens(response),
+        "time_to_first_token_ms": time_to_first_token * 1000 if time_to_first_token is not None else None,
         "timestamp": trace_context["timestamp"]
     }
+    if extra_metrics:
+        metrics.update(extra_metrics)
     
     # Log to LangSmith
     if "langsmith" in observability_clients:
@@ -96,7 +99,27 @@ def estimate_tokens(text: str) -> int:
 # Initialize observability on startup
 initialize_observability()
 
-app = FastAPI()
+# Strong references to fire-and-forget tasks so they are not garbage collected
+background_tasks = set()
+
+# Background ingest jobs; created in the lifespan, outlives resource reloads
+ingest_jobs: Optional[IngestJobManager] = None
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Build the shared RAG resources (and warm up the embedding model) once per process"""
+    global ingest_jobs
+    resources = await run_in_threadpool(rebuild_resources)
+    ingest_jobs = IngestJobManager(resources.config["ingest_jobs_path"],
+                                   workers=resources.config["ingest_job_workers"],
+                                   retention_seconds=resources.config["ingest_job_retention"])
+    # Picks up jobs interrupted by a previous shutdown or crash
+    await ingest_jobs.start()
+    yield
+    await ingest_jobs.stop()
+    await close_resources()
+
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -107,79 +130,194 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
+# Prometheus scrape endpoint (embedding batch sizes, queueing, latencies)
+app.mount("/metrics", make_asgi_app())
+
+class MetadataFilter(BaseModel):
+    source: Optional[str] = None                # Exact source filename
+    tags: Optional[List[str]] = None            # Chunk must carry all of these tags
+    ingested_after: Optional[datetime] = None   # Inclusive
+    ingested_before: Optional[datetime] = None  # Exclusive
+
+    def to_retriever_filter(self) -> Optional[Dict[str, Any]]:
+        """The ``filter`` jsonb understood by match_documents and the local indexes"""
+        metadata_filter: Dict[str, Any] = {}
+        if self.source is not None:
+            metadata_filter["source"] = self.source
+        if self.tags:
+            metadata_filter["tags"] = self.tags
+        if self.ingested_after is not None:
+            metadata_filter["$ingested_after"] = format_timestamp(self.ingested_after)
+        if self.ingested_before is not None:
+            metadata_filter["$ingested_before"] = format_timestamp(self.ingested_before)
+        return metadata_filter or None
+
 class Query(BaseModel):
     prompt: str
+    stream: bool = False  # Stream sources, tokens and metrics as Server-Sent Events
+    filter: Optional[MetadataFilter] = None  # Restrict retrieval to matching chunks
+    multi_query: Optional[bool] = None  # Retrieve with reformulations too (default: MULTI_QUERY_ENABLED)
+    variants: Optional[List[str]] = None  # Extra reformulations to retrieve with (implies multi_query)
+
+class BatchQuery(BaseModel):
+    prompts: List[str]
+    max_parallel: Optional[int] = None  # Concurrent generations (defaults to the admission limit)
+    filter: Optional[MetadataFilter] = None  # Applied to every prompt
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format one Server-Sent Events frame"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_prompt_events(events, first_event, trace_context: Dict[str, Any], start_time: float):
+    """Emit retrieved sources, then tokens as Ollama produces them, then a final metrics frame"""
+    async def all_events():
+        yield first_event
+        async for item in events:
+            yield item
+
+    try:
+        async for event, payload in all_events():
+            if event != "done":
+                yield sse_event(event, payload)
+                continue
+
+            retrieved_docs = payload["chunks"]
+            response_time = time.time() - start_time
+            time_to_first_token = payload["time_to_first_token"]
+            log_rag_metrics(trace_context, retrieved_docs, payload["response"], response_time,
+                            token_count=payload["llm"]["completion_tokens"],
+                            time_to_first_token=time_to_first_token,
+                            extra_metrics={
+                                "retrieval_time_ms": payload["retrieval_time_ms"],
+                                "generation_time_ms": payload["generation_time_ms"],
+                                "source_ids": [doc["id"] for doc in retrieved_docs],
+                                "queue_wait_ms": payload["queue_wait_ms"],
+                                "streamed": True,
+                                "cached": payload["cached"],
+                                "skipped_generation": payload.get("skipped_generation", False),
+                                "context": payload.get("context"),
+                                "variants": payload.get("variants"),
+                                "rerank": payload.get("rerank"),
+                                **payload["llm"]
+                            })
+            yield sse_event("metrics", {
+                "trace_id": trace_context["trace_id"],
+                "cached": payload["cached"],
+                "skipped_generation": payload.get("skipped_generation", False),
+                "response_time_ms": response_time * 1000,
+                "time_to_first_token_ms": time_to_first_token * 1000 if time_to_first_token is not None else None,
+                "retrieved_docs_count": len(retrieved_docs),
+                "prompt_tokens": prompt_token_count(payload),
+                "evaluated_tokens": evaluated_token_count(payload)
+            })
+    except Exception as e:
+        logger.error("RAG streaming query failed",
+                    trace_id=trace_context["trace_id"],
+                    error=str(e),
+                    response_time_ms=(time.time() - start_time) * 1000)
+        yield sse_event("error", {
+            "error": f"Failed to process query: {str(e)}",
+            "trace_id": trace_context["trace_id"]
+        })
+    finally:
+        # Release the generation slot even if the client disconnected mid-stream
+        await events.aclose()
+
+def prompt_token_count(result: Dict[str, Any]) -> Optional[int]:
+    """Size of the prompt sent to Ollama, as counted by the prompt builder"""
+    return (result.get("context") or {}).get("prompt_tokens")
+
+def evaluated_token_count(result: Dict[str, Any]) -> Optional[int]:
+    """Prompt tokens Ollama evaluated (prompt_eval_count); excludes a reused KV prefix"""
+    return result["llm"].get("evaluated_tokens")
+
+def admission_rejected_response(e: AdmissionRejected, trace_context: Dict[str, Any], start_time: float):
+    """Fast 429/503 with Retry-After when the generation queue cannot take the request"""
+    logger.warning("RAG query rejected by admission control",
+                   trace_id=trace_context["trace_id"],
+                   reason=e.reason,
+                   status_code=e.status_code,
+                   retry_after=e.retry_after,
+                   response_time_ms=(time.time() - start_time) * 1000)
+    return JSONResponse(
+        status_code=e.status_code,
+        content={"error": e.reason, "trace_id": trace_context["trace_id"], "retry_after": e.retry_after},
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+@app.post("/api/prompt/stream")
+async def prompt_stream(query: Query):
+    """Streaming variant of /api/prompt (equivalent to sending "stream": true)"""
+    query.stream = True
+    return await prompt(query)
 
 @app.post("/api/prompt")
-def prompt(query: Query):
+async def prompt(query: Query):
     # Create trace context for observability
     trace_context = create_trace_context(query.prompt)
     start_time = time.time()
     
     try:
-        # Initialize Supabase client
-        supabase_url = os.environ.get("SUPABASE_URL")
-        supabase_key = os.environ.get("SUPABASE_ANON_KEY")
-        
-        if not supabase_url or not supabase_key:
+        resources = get_resources()
+        if not resources.retrieval_ready:
             return {"error": "Supabase credentials not configured. Please check your .env file."}
-        
-        supabase: Client = create_client(supabase_url, supabase_key)
-        embeddings = FastEmbedEmbeddings(model_name="BAAI/bge-small-en-v1.5")  # Faster, smaller model
-
-        # Initialize Supabase vector store
-        doc_store = SupabaseVectorStore(
-            client=supabase,
-            embedding=embeddings,
-            table_name="documents",
-            query_name="match_documents"
-        )
-
-        # Setup LLM with observability callbacks
-        llm = Ollama(
-            base_url=os.environ.get("OLLAMA_URL", "http://ollama:11434"), 
-            model="llama3.2:1b",
-            temperature=0.7,
-            num_predict=256,  # Limit response length for faster generation
-            num_ctx=2048,     # Reduced context size for speed
-        )
-
-        template = """
-        You are a helpful AI assistant. You will answer the question based on the context provided.
-
-        {context}
-
-        Question: {question}
-        """
-
-        prompt_template = PromptTemplate(
-            template=template, input_variables=["context", "question"]
-        )
-
-        qa = RetrievalQA.from_chain_type(
-            llm=llm,
-            chain_type="stuff",
-            retriever=doc_store.as_retriever(search_kwargs={"k": 3}),  # Limit to 3 most relevant chunks
-            chain_type_kwargs={"prompt": prompt_template}
-        )
-        
-        # Get retrieval docs for logging
-        retriever = doc_store.as_retriever(search_kwargs={"k": 3})
-        retrieved_docs = retriever.get_relevant_documents(query.prompt)
-        
-        response = qa.run(query.prompt)
+
+        # Pushed down to match_documents / the local index, so non-matching chunks are never scanned
+        retriever_filter = query.filter.to_retriever_filter() if query.filter else None
+
+        if query.stream:
+            # Prime the stream so retrieval and admission happen before the 200 is sent
+            events = stream_rag_query(resources, query.prompt, retriever_filter,
+                                      query.multi_query, query.variants)
+            first_event = await events.__anext__()
+            return StreamingResponse(
+                stream_prompt_events(events, first_event, trace_context, start_time),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+
+        # Embed and retrieve once; the same chunks feed the prompt and the metrics
+        result = await run_rag_query(resources, query.prompt, retriever_filter,
+                                     query.multi_query, query.variants)
+        retrieved_docs = result["chunks"]
+        response = result["response"]
         response_time = time.time() - start_time
         
         # Log comprehensive metrics to observability platforms
-        log_rag_metrics(trace_context, retrieved_docs, response, response_time)
+        log_rag_metrics(trace_context, retrieved_docs, response, response_time,
+                        token_count=result["llm"]["completion_tokens"],
+                        extra_metrics={
+                            "retrieval_time_ms": result["retrieval_time_ms"],
+                            "generation_time_ms": result["generation_time_ms"],
+                            "queue_wait_ms": result["queue_wait_ms"],
+                            "source_ids": [doc["id"] for doc in retrieved_docs],
+                            "filter": retriever_filter,
+                            "top_similarity": max((doc["similarity"] for doc in retrieved_docs), default=None),
+                            "cached": result["cached"],
+                            "coalesced": result["coalesced"],
+                            "skipped_generation": result.get("skipped_generation", False),
+                            "context": result.get("context"),
+                            "variants": result.get("variants"),
+                            "rerank": result.get("rerank"),
+                            **result["llm"]
+                        })
         
         return {
             "response": response,
             "trace_id": trace_context["trace_id"],
             "response_time_ms": response_time * 1000,
-            "retrieved_docs_count": len(retrieved_docs)
+            "retrieved_docs_count": len(retrieved_docs),
+            "sources": source_summary(retrieved_docs),
+            "prompt_tokens": prompt_token_count(result),
+            "evaluated_tokens": evaluated_token_count(result),
+            "cached": result["cached"],
+            "coalesced": result["coalesced"],
+            "skipped_generation": result.get("skipped_generation", False),
+            "variants": result.get("variants")
         }
         
+    except AdmissionRejected as e:
+        return admission_rejected_response(e, trace_context, start_time)
     except Exception as e:
         error_time = time.time() - start_time
         logger.error("RAG query failed", 
@@ -188,61 +326,110 @@ def prompt(query: Query):
                     response_time_ms=error_time * 1000)
         return {"error": f"Failed to process query: {str(e)}"}
 
+async def batch_result_lines(resources, batch: BatchQuery, trace_context: Dict[str, Any],
+                             start_time: float, max_parallel: int):
+    """NDJSON lines, one per prompt in completion order, then a summary line"""
+    errors = 0
+    emitted = 0
+    try:
+        retriever_filter = batch.filter.to_retriever_filter() if batch.filter else None
+        async for index, result in run_rag_batch(resources, batch.prompts, max_parallel, retriever_filter):
+            item = {"index": index, "prompt": batch.prompts[index]}
+            if "error" in result:
+                errors += 1
+                item["error"] = f"Failed to process query: {result['error']}"
+            else:
+                item.update({
+                    "response": result["response"],
+                    "sources": source_summary(result["chunks"]),
+                    "retrieval_time_ms": result["retrieval_time_ms"],
+                    "generation_time_ms": result["generation_time_ms"],
+                    "prompt_tokens": prompt_token_count(result),
+                    "evaluated_tokens": evaluated_token_count(result),
+                    "cached": result["cached"],
+                    "coalesced": result["coalesced"],
+                    "skipped_generation": result.get("skipped_generation", False)
+                })
+                log_rag_metrics(
+                    create_trace_context(batch.prompts[index]), result["chunks"], result["response"],
+                    time.time() - start_time, token_count=result["llm"]["completion_tokens"],
+                    extra_metrics={"batch_trace_id": trace_context["trace_id"], "cached": result["cached"]}
+                )
+            emitted += 1
+            yield json.dumps(item) + "\n"
+    except Exception as e:
+        # Items already streamed keep their own outcome; only the rest failed
+        errors += len(batch.prompts) - emitted
+        logger.error("RAG batch query failed", trace_id=trace_context["trace_id"], error=str(e))
+        yield json.dumps({"error": f"Failed to process batch: {str(e)}"}) + "\n"
+
+    total_time = time.time() - start_time
+    logger.info("RAG batch completed",
+                trace_id=trace_context["trace_id"],
+                prompts=len(batch.prompts),
+                errors=errors,
+                max_parallel=max_parallel,
+                response_time_ms=total_time * 1000)
+    yield json.dumps({
+        "done": True,
+        "trace_id": trace_context["trace_id"],
+        "count": len(batch.prompts),
+        "errors": errors,
+        "response_time_ms": total_time * 1000
+    }) + "\n"
+
+@app.post("/api/prompt/batch")
+async def prompt_batch(batch: BatchQuery):
+    """Answer many prompts in one call, streaming per-item results as NDJSON as they complete"""
+    trace_context = create_trace_context(f"batch_{len(batch.prompts)}_prompts")
+    start_time = time.time()
+
+    resources = get_resources()
+    if not resources.retrieval_ready:
+        return {"error": "Supabase credentials not configured. Please check your .env file."}
+    if len(batch.prompts) > resources.config["batch_max_prompts"]:
+        return JSONResponse(status_code=413, content={
+            "error": f"Batch too large: at most {resources.config['batch_max_prompts']} prompts per request"
+        })
+
+    max_parallel = max(1, min(batch.max_parallel or resources.config["generation_max_concurrency"],
+                              resources.config["generation_max_concurrency"]))
+    return StreamingResponse(
+        batch_result_lines(resources, batch, trace_context, start_time, max_parallel),
+        media_type="application/x-ndjson"
+    )
+
 @app.post("/api/ingest")
-async def ingest_file(file: UploadFile = File(...)):
-    """Ingest a file with observability tracking"""
+async def ingest_file(file: UploadFile = File(...), tags: Optional[str] = Form(None)):
+    """Queue a file for background ingestion; poll GET /api/ingest/{job_id} for progress"""
     trace_context = create_trace_context(f"ingest_file_{file.filename}")
     start_time = time.time()
     
     try:
-        # Initialize Supabase client
-        supabase_url = os.environ.get("SUPABASE_URL")
-        supabase_key = os.environ.get("SUPABASE_ANON_KEY")
-        
-        if not supabase_url or not supabase_key:
+        resources = get_resources()
+        if not resources.retrieval_ready:
             return {"error": "Supabase credentials not configured"}
 
-        supabase: Client = create_client(supabase_url, supabase_key)
-        embeddings = FastEmbedEmbeddings(model_name="BAAI/bge-small-en-v1.5")
-
-        # Read file content
-        content = await file.read()
-        text = content.decode('utf-8')
-        
-        # Smart chunking
-        text_splitter = CharacterTextSplitter(
-            separator="\n\n",
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
-        )
-        
-        texts = text_splitter.split_text(text)
-        docs = [Document(page_content=t, metadata={"source": file.filename}) for t in texts]
+        # source / tags / ingested_at are what MetadataFilter queries on
+        metadata = {"source": file.filename, "ingested_at": format_timestamp()}
+        if tags:
+            metadata["tags"] = [tag.strip() for tag in tags.split(",") if tag.strip()]
         
-        # Initialize vector store and add documents
-        doc_store = SupabaseVectorStore(
-            client=supabase,
-            embedding=embeddings,
-            table_name="documents",
-            query_name="match_documents"
-        )
+        # Spool the upload to the job directory; a worker reads, splits, embeds
+        # and stores it batch by batch (bounded memory, resumable)
+        job = await ingest_jobs.submit(file.file, file.filename, metadata)
         
-        doc_store.add_documents(docs)
-        
-        processing_time = time.time() - start_time
-        
-        # Log ingestion metrics
-        logger.info("File ingestion completed",
+        logger.info("File ingestion queued",
                    trace_id=trace_context["trace_id"],
+                   job_id=job.id,
                    filename=file.filename,
-                   chunks_created=len(docs),
-                   processing_time_ms=processing_time * 1000)
+                   processing_time_ms=(time.time() - start_time) * 1000)
         
         return {
-            "message": f"Successfully ingested {file.filename}",
-            "chunks_created": len(docs),
-            "processing_time_ms": processing_time * 1000,
+            "message": f"Queued {file.filename} for ingestion",
+            "job_id": job.id,
+            "status": job.status,
+            "status_url": f"/api/ingest/{job.id}",
             "trace_id": trace_context["trace_id"]
         }
         
@@ -255,6 +442,34 @@ async def ingest_file(file: UploadFile = File(...)):
                     processing_time_ms=error_time * 1000)
         return {"error": f"Failed to ingest file: {str(e)}"}
 
+@app.get("/api/ingest/{job_id}")
+async def ingest_status(job_id: str):
+    """Status, progress (chunks, bytes, throughput, stage timings) and error of an ingest job"""
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"Unknown ingest job: {job_id}"})
+    return job.describe()
+
+@app.post("/api/resources/reload")
+async def reload_resources():
+    """Rebuild the shared clients after a configuration change"""
+    start_time = time.time()
+    try:
+        previous = get_resources()
+        resources = await run_in_threadpool(rebuild_resources)
+        # Let in-flight requests finish with the old clients before closing them
+        task = asyncio.create_task(close_after_grace(previous))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+        return {
+            "message": "RAG resources rebuilt",
+            "rebuild_time_ms": (time.time() - start_time) * 1000,
+            "resources": resources.describe()
+        }
+    except Exception as e:
+        logger.error("Resource rebuild failed", error=str(e))
+        return {"error": f"Failed to rebuild resources: {str(e)}"}
+
 @app.get("/")
 def read_root():
     return {"status": "RAG Backend Running", "observability": {
@@ -264,8 +479,12 @@ def read_root():
 @app.get("/status")
 def detailed_status():
     """Detailed status endpoint for debugging"""
+    resources = get_resources()
     return {
         "backend": "running",
+        "resources": resources.describe(),
+        "semantic_cache": resources.semantic_cache.describe() if resources.semantic_cache else {"enabled": False},
+        "ingest_jobs": ingest_jobs.describe() if ingest_jobs is not None else None,
         "observability": {
             "langsmith": "langsmith" in observability_clients,
             "langsmith_available": LANGSMITH_AVAILABLE,
@@ -0,0 +1,80 @@
+"""
+Prometheus metrics for the RAG backend, served at ``/metrics``.
+
+Metrics are module-level so every resource rebuild reports into the same
+series; the in-process counters shown under ``/status`` stay on the objects
+that own them.
+"""
+
+from prometheus_client import Counter, Gauge, Histogram
+
+EMBED_BATCH_SIZE = Histogram(
+    "rag_embed_batch_size",
+    "Number of queries embedded per micro-batched ONNX inference",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+
+EMBED_BATCH_WAIT_SECONDS = Histogram(
+    "rag_embed_batch_wait_seconds",
+    "Time the first query of a micro-batch waited for the batch to close",
+    buckets=(0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05),
+)
+
+EMBED_BATCH_INFERENCE_SECONDS = Histogram(
+    "rag_embed_batch_inference_seconds",
+    "Duration of one batched query-embedding inference",
+)
+
+GENERATION_QUEUE_DEPTH = Gauge(
+    "rag_generation_queue_depth",
+    "Requests waiting for an Ollama generation slot",
+)
+
+GENERATION_IN_FLIGHT = Gauge(
+    "rag_generation_in_flight",
+    "Requests currently generating with Ollama",
+)
+
+GENERATION_QUEUE_WAIT_SECONDS = Histogram(
+    "rag_generation_queue_wait_seconds",
+    "Time admitted requests spent waiting for a generation slot",
+    buckets=(0.001, 0.01, 0.1, 0.5, 1, 2.5, 5, 10, 30),
+)
+
+GENERATION_REJECTIONS = Counter(
+    "rag_generation_rejections_total",
+    "Requests turned away by admission control",
+    ["reason"],
+)
+
+COALESCED_REQUESTS = Counter(
+    "rag_coalesced_requests_total",
+    "Requests that joined an identical in-flight pipeline execution",
+)
+
+GENERATION_SKIPPED = Counter(
+    "rag_generation_skipped_total",
+    "Queries answered without calling Ollama because nothing was retrieved or no chunk cleared the similarity floor",
+)
+
+RERANK_SECONDS = Histogram(
+    "rag_rerank_seconds",
+    "Cross-encoder reranking latency per request, including budget fallbacks",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.15, 0.25, 0.5, 1),
+)
+
+RERANK_BUDGET_EXCEEDED = Counter(
+    "rag_rerank_budget_exceeded_total",
+    "Rerank calls that ran out of time budget and kept the retrieval order",
+)
+
+INGESTED_CHUNKS = Counter(
+    "rag_ingested_chunks_total",
+    "Chunks embedded and stored by /api/ingest",
+)
+
+INGEST_STAGE_SECONDS = Histogram(
+    "rag_ingest_stage_seconds",
+    "Ingest time by stage (lookup, split, embed, insert, update, delete)",
+    ["stage"],
+)
@@ -0,0 +1,603 @@
+"""
+Single-retrieval RAG pipeline.
+
+The query is embedded once and retrieved once (``match_documents`` or the
+in-process index, depending on ``RETRIEVER_BACKEND``); the chunks are
+packed into the prompt within a token budget (overlap and near-duplicates
+removed) and the ones actually used are returned to the caller (with their
+IDs and similarity scores) for metrics and the response payload.
+
+Every stage is async: embedding runs on the resources' embedding executor,
+retrieval and generation go over pooled keep-alive HTTP connections.
+
+With ``HYBRID_RETRIEVAL`` on, dense candidates are fused with BM25 matches
+from the in-process lexical index using reciprocal rank fusion, so exact
+identifiers make the top-k without raising k. Multi-query mode embeds
+several reformulations of the question in one batch, searches them
+concurrently and fuses the rankings the same way. With ``RERANK_ENABLED``,
+``RERANK_CANDIDATES`` are retrieved and a cross-encoder picks the final k
+within a per-request time budget (falling back to the retrieval order).
+
+When the semantic cache is enabled, the query embedding is first checked
+against previously answered questions and a hit skips retrieval and Ollama.
+If nothing is retrieved (e.g. a filter matches no documents) or no chunk
+clears ``SIMILARITY_FLOOR``, the canned no-context answer is returned
+without calling Ollama. Generation runs inside an admission-control slot, which may raise
+``AdmissionRejected`` when Ollama is saturated. Concurrent identical
+requests are coalesced into a single execution.
+"""
+
+import asyncio
+import re
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+import httpx
+import structlog
+
+from .embeddings import normalize_query
+from .lexical_index import tokenize
+from .metrics import GENERATION_SKIPPED
+from .resources import RAGResources
+
+logger = structlog.get_logger()
+
+
+async def retrieve(resources: RAGResources, question: str, k: Optional[int] = None,
+                   metadata_filter: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Embed the question once and fetch the top-k chunks"""
+    query_embedding = await resources.aembed_query(question)
+    return await retrieve_for_question(resources, question, query_embedding, k, metadata_filter)
+
+
+async def retrieve_by_vector(resources: RAGResources, query_embedding: List[float],
+                             k: Optional[int] = None,
+                             metadata_filter: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Fetch the top-k chunks for an already-computed query embedding"""
+    config = resources.config
+    if resources.local_index is not None:
+        # numpy releases the GIL during the scan, so a worker thread keeps the loop free
+        rows = await asyncio.to_thread(
+            resources.local_index.search, query_embedding, k or config["retrieval_k"], metadata_filter
+        )
+        return to_chunks(rows)
+
+    rows = await resources.supabase_rpc.rpc(
+        config["query_name"],
+        {
+            "query_embedding": query_embedding,
+            "match_count": k or config["retrieval_k"],
+            "filter": metadata_filter or {},
+        },
+    )
+
+    return to_chunks(rows)
+
+
+async def retrieve_many_by_vector(resources: RAGResources, query_embeddings: List[List[float]],
+                                  k: Optional[int] = None,
+                                  metadata_filter: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+    """Fetch top-k chunks for several query embeddings.
+
+    The local index scores all queries with one matrix product. Supabase
+    uses the ``match_documents_batch`` function (one round-trip for all
+    queries) when the database has it, otherwise fans out concurrent
+    ``match_documents`` calls.
+    """
+    config = resources.config
+    if not query_embeddings:
+        return []
+
+    if resources.local_index is not None:
+        groups = await asyncio.to_thread(
+            resources.local_index.search_many, query_embeddings, k or config["retrieval_k"], metadata_filter
+        )
+        return [to_chunks(group) for group in groups]
+
+    if resources.batch_rpc_available:
+        try:
+            rows = await resources.supabase_rpc.rpc(
+                config["batch_query_name"],
+                {
+                    "query_embeddings": query_embeddings,
+                    "match_count": k or config["retrieval_k"],
+                    "filter": metadata_filter or {},
+                },
+            )
+            grouped: List[List[Dict[str, Any]]] = [[] for _ in query_embeddings]
+            for row in rows:
+                grouped[row["query_index"]].append(row)
+            return [to_chunks(group) for group in grouped]
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code != 404:
+                raise
+            # Older database without the batch function; stop trying
+            resources.batch_rpc_available = False
+            logger.warning("match_documents_batch not found, falling back to per-query retrieval")
+
+    return list(await asyncio.gather(
+        *(retrieve_by_vector(resources, embedding, k, metadata_filter) for embedding in query_embeddings)
+    ))
+
+
+async def retrieve_for_question(resources: RAGResources, question: str, query_embedding: List[float],
+                                k: Optional[int] = None,
+                                metadata_filter: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Dense retrieval, fused with BM25 matches when hybrid retrieval is enabled"""
+    config = resources.config
+    if resources.lexical_index is None:
+        return await retrieve_by_vector(resources, query_embedding, k, metadata_filter)
+
+    candidates = max(k or config["retrieval_k"], config["hybrid_candidates"])
+    dense, lexical = await asyncio.gather(
+        retrieve_by_vector(resources, query_embedding, candidates, metadata_filter),
+        asyncio.to_thread(resources.lexical_index.search, question, candidates, metadata_filter),
+    )
+    return reciprocal_rank_fusion(dense, lexical, k or config["retrieval_k"], config["rrf_k"])
+
+
+async def retrieve_many_for_questions(resources: RAGResources, questions: List[str],
+                                      query_embeddings: List[List[float]], k: Optional[int] = None,
+                                      metadata_filter: Optional[Dict[str, Any]] = None) -> List[List[Dict[str, Any]]]:
+    """Batched ``retrieve_for_question``: one dense round-trip, BM25 per question"""
+    config = resources.config
+    if resources.lexical_index is None:
+        return await retrieve_many_by_vector(resources, query_embeddings, k, metadata_filter)
+
+    candidates = max(k or config["retrieval_k"], config["hybrid_candidates"])
+    dense_lists = await retrieve_many_by_vector(resources, query_embeddings, candidates, metadata_filter)
+    lexical_lists = await asyncio.to_thread(
+        lambda: [resources.lexical_index.search(question, candidates, metadata_filter) for question in questions]
+    )
+    return [
+        reciprocal_rank_fusion(dense, lexical, k or config["retrieval_k"], config["rrf_k"])
+        for dense, lexical in zip(dense_lists, lexical_lists)
+    ]
+
+
+def query_variants(resources: RAGResources, question: str,
+                   extra: Optional[List[str]] = None) -> List[str]:
+    """The question first, then caller-supplied and rule-based reformulations.
+
+    Rule-based variants are a keyword-only form (no stopwords or question
+    words, which dilute the embedding of a vague question) and the parts of
+    a compound question. No LLM call: generating rewrites would cost more
+    than the retrieval it improves.
+    """
+    candidates = [question, *(extra or [])]
+    keywords = " ".join(dict.fromkeys(tokenize(question)))
+    candidates.append(keywords)
+    parts = re.split(r"\?|;|\band\b|\balso\b", question)
+    candidates.extend(part for part in parts if len(part.split()) >= 3)
+
+    variants, seen = [], set()
+    for candidate in candidates:
+        key = normalize_query(candidate).lower()
+        if key and key not in seen:
+            seen.add(key)
+            variants.append(candidate.strip())
+    return variants[:resources.config["multi_query_max_variants"]]
+
+
+async def embed_variants(resources: RAGResources, queries: List[str]) -> List[List[float]]:
+    """One embedding per query; several variants share a single batched inference"""
+    if len(queries) == 1:
+        return [await resources.aembed_query(queries[0])]
+    return await resources.aembed_queries(queries)
+
+
+async def retrieve_variants(resources: RAGResources, queries: List[str], query_embeddings: List[List[float]],
+                            k: Optional[int] = None, metadata_filter: Optional[Dict[str, Any]] = None
+                            ) -> Tuple[List[Dict[str, Any]], Optional[List[Dict[str, Any]]]]:
+    """Retrieve for every variant concurrently and fuse; returns (chunks, per-variant timings)"""
+    config = resources.config
+    if len(queries) == 1:
+        return await retrieve_for_question(resources, queries[0], query_embeddings[0], k, metadata_filter), None
+
+    candidates = max(k or config["retrieval_k"], config["multi_query_candidates"])
+
+    async def timed(query: str, query_embedding: List[float]):
+        start = time.time()
+        chunks = await retrieve_for_question(resources, query, query_embedding, candidates, metadata_filter)
+        return chunks, {"query": query, "retrieval_ms": (time.time() - start) * 1000, "results": len(chunks)}
+
+    outcomes = await asyncio.gather(*(timed(q, e) for q, e in zip(queries, query_embeddings)))
+    fused = fuse_rankings([chunks for chunks, _ in outcomes], k or config["retrieval_k"], config["rrf_k"])
+    return fused, [timing for _, timing in outcomes]
+
+
+def candidate_count(resources: RAGResources) -> Optional[int]:
+    """How many chunks to retrieve: over-fetch for the reranker, else ``retrieval_k``"""
+    if resources.reranker is None:
+        return None
+    return max(resources.config["retrieval_k"], resources.config["rerank_candidates"])
+
+
+async def rerank_chunks(resources: RAGResources, question: str, chunks: List[Dict[str, Any]]
+                        ) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """Cross-encoder top ``retrieval_k`` of the candidates; returns (chunks, rerank stats)"""
+    if resources.reranker is None:
+        return chunks, None
+    return await resources.reranker.rerank(question, chunks, resources.config["retrieval_k"])
+
+
+def fuse_rankings(rankings: List[List[Dict[str, Any]]], k: int, rrf_k: int = 60) -> List[Dict[str, Any]]:
+    """Reciprocal rank fusion over any number of chunk lists, deduplicated by chunk ID"""
+    fused: Dict[Any, Dict[str, Any]] = {}
+    for ranking in rankings:
+        for rank, chunk in enumerate(ranking, start=1):
+            entry = fused.get(chunk["id"])
+            if entry is None:
+                entry = fused[chunk["id"]] = {**chunk, "rrf_score": 0.0}
+            else:
+                entry["similarity"] = max(entry["similarity"], chunk["similarity"])
+            entry["rrf_score"] += 1 / (rrf_k + rank)
+    return sorted(fused.values(), key=lambda chunk: chunk["rrf_score"], reverse=True)[:k]
+
+
+def reciprocal_rank_fusion(dense: List[Dict[str, Any]], lexical: List[Dict[str, Any]], k: int,
+                           rrf_k: int = 60) -> List[Dict[str, Any]]:
+    """Fuse two rankings by sum of 1 / (rrf_k + rank); scores on different scales never mix"""
+    fused: Dict[Any, Dict[str, Any]] = {}
+    for rank, chunk in enumerate(dense, start=1):
+        fused[chunk["id"]] = {**chunk, "bm25": None, "rrf_score": 1 / (rrf_k + rank)}
+    for rank, row in enumerate(lexical, start=1):
+        # Lexical-only hits have no cosine score; 0.0 matches to_chunks' default
+        entry = fused.setdefault(row["id"], {**to_chunks([row])[0], "rrf_score": 0.0})
+        entry["bm25"] = row["bm25"]
+        entry["rrf_score"] += 1 / (rrf_k + rank)
+    return sorted(fused.values(), key=lambda chunk: chunk["rrf_score"], reverse=True)[:k]
+
+
+def to_chunks(rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "id": row.get("id"),
+            "content": row.get("content", ""),
+            "metadata": row.get("metadata") or {},
+            "similarity": row.get("similarity", 0.0),
+        }
+        for row in rows
+        if row.get("content")
+    ]
+
+
+def build_prompt(resources: RAGResources, question: str, chunks: List[Dict[str, Any]]
+                 ) -> Tuple[str, List[Dict[str, Any]], Dict[str, Any]]:
+    """Fill the template with as much de-duplicated context as the token budget allows.
+
+    Returns the prompt, the chunks actually used (with overlap removed) and
+    context stats including the counted prompt tokens.
+    """
+    config = resources.config
+    builder = resources.context_builder
+    scaffold_tokens = builder.counter.count(resources.prompt_template.format(context="", question=question))
+    # Never let the prompt crowd out the generation budget inside num_ctx
+    window_budget = config["num_ctx"] - config["num_predict"] - scaffold_tokens
+    context, used, stats = builder.build(chunks, max(0, min(builder.budget, window_budget)))
+    stats["prompt_tokens"] = scaffold_tokens + stats["context_tokens"]
+    return resources.prompt_template.format(context=context, question=question), used, stats
+
+
+def source_summary(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Compact per-chunk view for API responses and traces"""
+    return [
+        {
+            "id": chunk["id"],
+            "similarity": chunk["similarity"],
+            "source": chunk["metadata"].get("source"),
+        }
+        for chunk in chunks
+    ]
+
+
+def llm_stats(final_chunk: Dict[str, Any]) -> Dict[str, Any]:
+    """Token counts and durations (converted to ms) from Ollama's final response object"""
+    return {
+        # Prompt tokens Ollama actually prefilled; lower than the prompt when its KV prefix was reused
+        "evaluated_tokens": final_chunk.get("prompt_eval_count"),
+        "completion_tokens": final_chunk.get("eval_count"),
+        "prompt_eval_ms": final_chunk.get("prompt_eval_duration", 0) / 1e6,
+        "eval_ms": final_chunk.get("eval_duration", 0) / 1e6,
+        "load_ms": final_chunk.get("load_duration", 0) / 1e6,
+    }
+
+
+def cacheable_payload(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Strip chunk text from a result before it goes into the semantic cache"""
+    return {
+        "response": result["response"],
+        "chunks": [{**chunk, "content": ""} for chunk in result["chunks"]],
+        "llm": result["llm"],
+        "context": result["context"],
+    }
+
+
+def cached_result(cached: Dict[str, Any], retrieval_time: float) -> Dict[str, Any]:
+    return {
+        **cached,
+        "retrieval_time_ms": retrieval_time * 1000,
+        "generation_time_ms": 0.0,
+        "queue_wait_ms": 0.0,
+        "cached": True,
+        "coalesced": False,
+    }
+
+
+def lacks_relevant_context(resources: RAGResources, chunks: List[Dict[str, Any]]) -> bool:
+    """True when nothing was retrieved, or no chunk's cosine similarity reaches the floor"""
+    if not chunks:
+        return True
+    floor = resources.config["similarity_floor"]
+    return floor > 0 and max(chunk["similarity"] for chunk in chunks) < floor
+
+
+def no_context_result(resources: RAGResources, chunks: List[Dict[str, Any]],
+                      retrieval_time: float) -> Dict[str, Any]:
+    """Fast answer for a query nothing in the corpus is relevant to; Ollama is not called"""
+    GENERATION_SKIPPED.inc()
+    return {
+        "response": resources.config["no_context_response"],
+        "chunks": chunks,
+        "retrieval_time_ms": retrieval_time * 1000,
+        "generation_time_ms": 0.0,
+        "queue_wait_ms": 0.0,
+        "llm": llm_stats({}),
+        "context": None,
+        "cached": False,
+        "coalesced": False,
+        "skipped_generation": True,
+    }
+
+
+async def generate_answer(resources: RAGResources, question: str, query_embedding: List[float],
+                          chunks: List[Dict[str, Any]], retrieval_time: float,
+                          corpus_version: Optional[int] = None,
+                          metadata_filter: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Generate from already-retrieved chunks inside an admission slot, and cache the answer"""
+    prompt, chunks, context_stats = build_prompt(resources, question, chunks)
+    async with resources.admission.slot() as queue_wait:
+        generation_start = time.time()
+        result = await resources.llm.generate(prompt)
+        generation_time = time.time() - generation_start
+
+    output = {
+        "response": result.get("response", ""),
+        "chunks": chunks,
+        "retrieval_time_ms": retrieval_time * 1000,
+        "generation_time_ms": generation_time * 1000,
+        "queue_wait_ms": queue_wait * 1000,
+        "llm": llm_stats(result),
+        "context": context_stats,
+        "cached": False,
+        "coalesced": False,
+    }
+    cache = answer_cache(resources, metadata_filter)
+    if cache is not None:
+        cache.store(query_embedding, question, cacheable_payload(output), corpus_version)
+    return output
+
+
+def answer_cache(resources: RAGResources, metadata_filter: Optional[Dict[str, Any]] = None):
+    """The semantic cache, unless the query is filtered.
+
+    Cached answers are keyed by question embedding only, so a filtered query
+    must neither reuse an answer drawn from other sources nor store one.
+    """
+    return None if metadata_filter else resources.semantic_cache
+
+
+def request_key(resources: RAGResources, question: str, **params: Any) -> Tuple:
+    """Coalescing key: normalized prompt plus everything that shapes the answer"""
+    config = resources.config
+    return (
+        normalize_query(question),
+        config["retrieval_k"],
+        config["llm_model"],
+        config["temperature"],
+        config["num_predict"],
+        config["num_ctx"],
+        tuple(sorted((name, repr(value)) for name, value in params.items())),
+    )
+
+
+def resolve_queries(resources: RAGResources, question: str, multi_query: Optional[bool] = None,
+                    variants: Optional[List[str]] = None) -> List[str]:
+    """``[question]``, or all variants when multi-query is on (per request or by config)"""
+    if multi_query is None:
+        multi_query = resources.config["multi_query_enabled"]
+    if multi_query or variants:
+        return query_variants(resources, question, variants)
+    return [question]
+
+
+async def run_rag_query(resources: RAGResources, question: str,
+                        metadata_filter: Optional[Dict[str, Any]] = None, multi_query: Optional[bool] = None,
+                        variants: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Retrieve once, generate once, and report what was used.
+
+    ``metadata_filter`` is pushed down to the retriever (``metadata @> filter`` plus
+    the ``$ingested_after`` / ``$ingested_before`` range). With multi-query,
+    every variant is retrieved concurrently and ``variants`` in the result
+    carries per-variant timings. Identical concurrent calls share a single
+    execution; followers get the leader's result with ``coalesced: True``.
+    """
+    queries = resolve_queries(resources, question, multi_query, variants)
+    return await resources.single_flight.do(
+        request_key(resources, question, metadata_filter=metadata_filter, queries=queries),
+        lambda: _run_rag_query(resources, question, metadata_filter, queries),
+    )
+
+
+async def _run_rag_query(resources: RAGResources, question: str,
+                         metadata_filter: Optional[Dict[str, Any]] = None,
+                         queries: Optional[List[str]] = None) -> Dict[str, Any]:
+    retrieval_start = time.time()
+    queries = queries or [question]
+    query_embeddings = await embed_variants(resources, queries)
+    query_embedding = query_embeddings[0]
+    cache = answer_cache(resources, metadata_filter)
+    corpus_version = cache.corpus_version if cache is not None else None
+    if cache is not None:
+        cached = cache.lookup(query_embedding)
+        if cached is not None:
+            return cached_result(cached, time.time() - retrieval_start)
+
+    chunks, variant_timings = await retrieve_variants(resources, queries, query_embeddings,
+                                                      candidate_count(resources), metadata_filter)
+    chunks, rerank_stats = await rerank_chunks(resources, question, chunks)
+    if lacks_relevant_context(resources, chunks):
+        result = no_context_result(resources, chunks, time.time() - retrieval_start)
+    else:
+        result = await generate_answer(resources, question, query_embedding, chunks,
+                                       time.time() - retrieval_start, corpus_version, metadata_filter)
+    result["variants"] = variant_timings
+    result["rerank"] = rerank_stats
+    return result
+
+
+async def run_rag_batch(resources: RAGResources, questions: List[str], max_parallel: int,
+                        metadata_filter: Optional[Dict[str, Any]] = None) -> AsyncIterator[Tuple[int, Dict[str, Any]]]:
+    """Answer many questions, yielding ``(index, result)`` as each one completes.
+
+    All questions are embedded in one batch and retrieved in one round-trip
+    where possible; reranking and generation run with at most ``max_parallel``
+    in flight (generation still passes through admission control). A prompt
+    repeated within the batch is answered once and its copies get the same
+    result with ``coalesced: True``. A failed item yields a result with an
+    ``error`` key instead of aborting the batch.
+    """
+    start_time = time.time()
+    cache = answer_cache(resources, metadata_filter)
+    corpus_version = cache.corpus_version if cache is not None else None
+    query_embeddings = await resources.aembed_queries(questions)
+
+    # Repeated prompts are answered once: single-flight alone would miss a copy
+    # that only reaches the semaphore after the first one has finished
+    keys = [request_key(resources, question, metadata_filter=metadata_filter, queries=[question])
+            for question in questions]
+    copies: Dict[int, List[int]] = {}
+    first_by_key: Dict[Tuple, int] = {}
+    for index, key in enumerate(keys):
+        copies.setdefault(first_by_key.setdefault(key, index), []).append(index)
+
+    def fan_out(index: int, result: Dict[str, Any]) -> List[Tuple[int, Dict[str, Any]]]:
+        return [(copy, result if copy == index else {**result, "coalesced": True}) for copy in copies[index]]
+
+    pending: List[int] = []
+    for index in copies:
+        cached = cache.lookup(query_embeddings[index]) if cache is not None else None
+        if cached is not None:
+            for item in fan_out(index, cached_result(cached, time.time() - start_time)):
+                yield item
+        else:
+            pending.append(index)
+    if not pending:
+        return
+
+    chunk_lists = await retrieve_many_for_questions(resources, [questions[i] for i in pending],
+                                                    [query_embeddings[i] for i in pending],
+                                                    candidate_count(resources), metadata_filter)
+    retrieval_time = time.time() - start_time
+
+    semaphore = asyncio.Semaphore(max_parallel)
+
+    async def answer(index: int, chunks: List[Dict[str, Any]]) -> Tuple[int, Dict[str, Any]]:
+        async with semaphore:
+            # Reranking shares the slot: its budget clock starts before the pool picks the job up
+            chunks, _ = await rerank_chunks(resources, questions[index], chunks)
+            if lacks_relevant_context(resources, chunks):
+                return index, no_context_result(resources, chunks, retrieval_time)
+            try:
+                # Coalesces with identical live /api/prompt calls
+                return index, await resources.single_flight.do(
+                    keys[index],
+                    lambda: generate_answer(resources, questions[index], query_embeddings[index],
+                                            chunks, retrieval_time, corpus_version, metadata_filter),
+                )
+            except Exception as e:
+                return index, {"error": str(e), "chunks": chunks}
+
+    tasks = [asyncio.ensure_future(answer(index, chunks)) for index, chunks in zip(pending, chunk_lists)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            for item in fan_out(*await next_done):
+                yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def stream_rag_query(resources: RAGResources, question: str,
+                           metadata_filter: Optional[Dict[str, Any]] = None, multi_query: Optional[bool] = None,
+                           variants: Optional[List[str]] = None) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """Yield ("sources", ...), then ("token", ...) per generated token, then ("done", ...)
+
+    The final "done" payload carries the full response, the retrieved chunks
+    and stage timings, including time-to-first-token. The generation slot is
+    acquired before "sources" is yielded, so callers can prime the generator
+    to surface ``AdmissionRejected`` before committing to a streamed response.
+    """
+    start_time = time.time()
+    queries = resolve_queries(resources, question, multi_query, variants)
+    query_embeddings = await embed_variants(resources, queries)
+    query_embedding = query_embeddings[0]
+    cache = answer_cache(resources, metadata_filter)
+    corpus_version = cache.corpus_version if cache is not None else None
+    if cache is not None:
+        cached = cache.lookup(query_embedding)
+        if cached is not None:
+            result = cached_result(cached, time.time() - start_time)
+            yield "sources", {"sources": source_summary(result["chunks"]), "cached": True}
+            yield "token", {"token": result["response"]}
+            yield "done", {**result, "time_to_first_token": time.time() - start_time}
+            return
+
+    chunks, variant_timings = await retrieve_variants(resources, queries, query_embeddings,
+                                                      candidate_count(resources), metadata_filter)
+    chunks, rerank_stats = await rerank_chunks(resources, question, chunks)
+    retrieval_time = time.time() - start_time
+    if lacks_relevant_context(resources, chunks):
+        result = {**no_context_result(resources, chunks, retrieval_time),
+                  "variants": variant_timings, "rerank": rerank_stats}
+        yield "sources", {"sources": source_summary(chunks), "skipped_generation": True}
+        yield "token", {"token": result["response"]}
+        yield "done", {**result, "time_to_first_token": time.time() - start_time}
+        return
+    prompt, chunks, context_stats = build_prompt(resources, question, chunks)
+
+    async with resources.admission.slot() as queue_wait:
+        yield "sources", {"sources": source_summary(chunks)}
+
+        generation_start = time.time()
+        time_to_first_token = None
+        parts = []
+        final_chunk: Dict[str, Any] = {}
+        async for chunk in resources.llm.stream(prompt):
+            token = chunk.get("response", "")
+            if token:
+                if time_to_first_token is None:
+                    time_to_first_token = time.time() - start_time
+                parts.append(token)
+                yield "token", {"token": token}
+            if chunk.get("done"):
+                final_chunk = chunk
+        generation_time = time.time() - generation_start
+
+    output = {
+        "response": "".join(parts),
+        "chunks": chunks,
+        "retrieval_time_ms": retrieval_time * 1000,
+        "generation_time_ms": generation_time * 1000,
+        "queue_wait_ms": queue_wait * 1000,
+        "time_to_first_token": time_to_first_token,
+        "llm": llm_stats(final_chunk),
+        "context": context_stats,
+        "variants": variant_timings,
+        "rerank": rerank_stats,
+        "cached": False,
+        "coalesced": False,
+    }
+    if cache is not None:
+        cache.store(query_embedding, question, cacheable_payload(output), corpus_version)
+    yield "done", output
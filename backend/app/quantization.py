@@ -0,0 +1,154 @@
+"""
+Compressed vector codes for first-stage search in the local index.
+
+``ScalarQuantizer`` stores each dimension as int8 (4x smaller than float32);
+``ProductQuantizer`` splits vectors into subspaces and stores one uint8
+centroid ID per subspace (32x smaller for 384-d / 48 subspaces). Both
+produce approximate inner-product scores; the local index rescores the best
+candidates exactly against the float32 vectors of its memory-mapped store,
+so only those rows of the full-precision matrix are paged in.
+"""
+
+from typing import Optional
+
+import numpy as np
+
+# Rows gathered per block so PQ lookups never materialize an (N, subspaces) float matrix
+SCORE_BLOCK_ROWS = 16384
+
+
+class ScalarQuantizer:
+    """Symmetric per-dimension int8 quantization"""
+
+    name = "int8"
+    key = "int8"
+    code_dtype = np.dtype(np.int8)
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+        self.scale: Optional[np.ndarray] = None
+
+    @property
+    def trained(self) -> bool:
+        return self.scale is not None
+
+    def get_params(self) -> np.ndarray:
+        return self.scale
+
+    def set_params(self, params: np.ndarray):
+        if params.shape != (self.dimension,):
+            raise ValueError(f"int8 scale has shape {params.shape}, expected ({self.dimension},)")
+        self.scale = params.astype(np.float32)
+
+    def fit(self, vectors: np.ndarray):
+        peak = np.abs(np.asarray(vectors, dtype=np.float32)).max(axis=0)
+        self.scale = np.where(peak > 0, peak, 1.0).astype(np.float32) / 127.0
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        codes = np.rint(np.asarray(vectors, dtype=np.float32) / self.scale)
+        return np.clip(codes, -127, 127).astype(np.int8)
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        # codes * scale ~= vector, so fold the scale into the query once
+        scaled_query = (query * self.scale).astype(np.float32)
+        # einsum casts int8 -> float32 in small internal buffers instead of a full copy
+        return np.einsum("ij,j->i", codes, scaled_query)
+
+    def code_bytes(self) -> int:
+        return self.dimension
+
+
+class ProductQuantizer:
+    """Product quantization with 256 centroids per subspace (uint8 codes)"""
+
+    name = "pq"
+    code_dtype = np.dtype(np.uint8)
+
+    def __init__(self, dimension: int, subspaces: int = 48, iterations: int = 10,
+                 training_sample: int = 10000, seed: int = 0):
+        if dimension % subspaces:
+            raise ValueError(f"dimension {dimension} is not divisible by {subspaces} subspaces")
+        self.dimension = dimension
+        self.subspaces = subspaces
+        self.sub_dim = dimension // subspaces
+        self.iterations = iterations
+        self.training_sample = training_sample
+        self.seed = seed
+        self.codebooks: Optional[np.ndarray] = None  # (subspaces, 256, sub_dim)
+
+    @property
+    def key(self) -> str:
+        return f"pq{self.subspaces}"
+
+    @property
+    def trained(self) -> bool:
+        return self.codebooks is not None
+
+    def get_params(self) -> np.ndarray:
+        return self.codebooks
+
+    def set_params(self, params: np.ndarray):
+        expected = (self.subspaces, 256, self.sub_dim)
+        if params.shape != expected:
+            raise ValueError(f"PQ codebooks have shape {params.shape}, expected {expected}")
+        self.codebooks = params.astype(np.float32)
+
+    def fit(self, vectors: np.ndarray):
+        rng = np.random.default_rng(self.seed)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) > self.training_sample:
+            vectors = vectors[rng.choice(len(vectors), self.training_sample, replace=False)]
+        centroids = min(256, len(vectors))
+        codebooks = np.zeros((self.subspaces, 256, self.sub_dim), dtype=np.float32)
+        for m in range(self.subspaces):
+            sub = vectors[:, m * self.sub_dim:(m + 1) * self.sub_dim]
+            codebooks[m, :centroids] = self._kmeans(sub, centroids, rng)
+        self.codebooks = codebooks
+
+    def encode(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.asarray(vectors, dtype=np.float32)
+        codes = np.empty((len(vectors), self.subspaces), dtype=np.uint8)
+        for m in range(self.subspaces):
+            sub = vectors[:, m * self.sub_dim:(m + 1) * self.sub_dim]
+            codes[:, m] = self._nearest(sub, self.codebooks[m])
+        return codes
+
+    def scores(self, codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+        # Asymmetric distance computation: query . centroid per subspace, then sum lookups
+        lookup = np.einsum("msd,md->ms", self.codebooks,
+                           np.asarray(query, dtype=np.float32).reshape(self.subspaces, self.sub_dim))
+        flat_lookup = lookup.astype(np.float32).ravel()
+        offsets = (np.arange(self.subspaces) * 256).astype(np.intp)
+        out = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCORE_BLOCK_ROWS):
+            block = codes[start:start + SCORE_BLOCK_ROWS]
+            out[start:start + len(block)] = flat_lookup.take(block + offsets).sum(axis=1)
+        return out
+
+    def code_bytes(self) -> int:
+        return self.subspaces
+
+    def _kmeans(self, data: np.ndarray, k: int, rng: np.random.Generator) -> np.ndarray:
+        centroids = data[rng.choice(len(data), k, replace=False)].copy()
+        for _ in range(self.iterations):
+            assignment = self._nearest(data, centroids)
+            sums = np.stack([np.bincount(assignment, weights=data[:, d], minlength=k)
+                             for d in range(data.shape[1])], axis=1)
+            counts = np.bincount(assignment, minlength=k)[:, None]
+            centroids = np.where(counts > 0, sums / np.maximum(counts, 1), centroids)
+        return centroids
+
+    @staticmethod
+    def _nearest(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        # argmin ||x - c||^2 == argmax (x.c - ||c||^2 / 2)
+        return np.argmax(data @ centroids.T - 0.5 * (centroids ** 2).sum(axis=1), axis=1)
+
+
+def make_quantizer(kind: str, dimension: int, pq_subspaces: int = 48):
+    if kind == "int8":
+        return ScalarQuantizer(dimension)
+    if kind == "pq":
+        return ProductQuantizer(dimension, subspaces=pq_subspaces)
+    if kind in ("", "none"):
+        return None
+    raise ValueError(f"Unknown quantization: {kind}")
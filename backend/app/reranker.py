@@ -0,0 +1,107 @@
+"""
+Cross-encoder reranking of retrieved candidates.
+
+The retriever over-fetches ``RERANK_CANDIDATES`` chunks by vector (or
+hybrid) order and a FastEmbed ONNX cross-encoder scores each (question,
+chunk) pair in batches on a dedicated CPU thread. Scoring runs against a
+hard per-request budget: batches stop once the deadline passes and the
+request falls back to the retriever's order, so a slow or saturated CPU
+costs at most ``RERANK_BUDGET_MS``.
+"""
+
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+import structlog
+
+from .metrics import RERANK_BUDGET_EXCEEDED, RERANK_SECONDS
+
+try:
+    from fastembed.rerank.cross_encoder import TextCrossEncoder
+    CROSS_ENCODER_AVAILABLE = True
+except ImportError:
+    CROSS_ENCODER_AVAILABLE = False
+
+logger = structlog.get_logger()
+
+
+class RerankBudgetExceeded(Exception):
+    pass
+
+
+def consume_result(future: asyncio.Future):
+    """Done-callback for an abandoned scoring call; retrieving a late failure keeps
+    asyncio from logging it as never retrieved"""
+    if not future.cancelled():
+        future.exception()
+
+
+class CrossEncoderReranker:
+    """Batched ONNX cross-encoder with a per-request latency budget"""
+
+    def __init__(self, model_name: str, batch_size: int = 16, budget_ms: float = 150.0,
+                 workers: int = 1):
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.budget_ms = budget_ms
+        self.model = TextCrossEncoder(model_name=model_name)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="rerank")
+        self.stats = {"calls": 0, "budget_exceeded": 0, "errors": 0}
+
+    def score(self, query: str, texts: List[str], deadline: Optional[float] = None) -> List[float]:
+        """Blocking: relevance score per text, giving up between batches past ``deadline``"""
+        scores: List[float] = []
+        for start in range(0, len(texts), self.batch_size):
+            if deadline is not None and time.monotonic() > deadline:
+                raise RerankBudgetExceeded()
+            batch = texts[start:start + self.batch_size]
+            scores.extend(self.model.rerank(query, batch, batch_size=len(batch)))
+        return scores
+
+    def warm_up(self):
+        self.score("warm-up", ["warm-up"])
+
+    async def rerank(self, query: str, chunks: List[Dict[str, Any]], k: int
+                     ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """Top-k chunks by cross-encoder score, or the first k in retrieval order on timeout/error"""
+        if len(chunks) <= 1:
+            return chunks[:k], {"candidates": len(chunks), "rerank_ms": 0.0, "fallback": None}
+
+        self.stats["calls"] += 1
+        start = time.monotonic()
+        deadline = start + self.budget_ms / 1000
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.executor, self.score, query,
+                                      [chunk["content"] for chunk in chunks], deadline)
+        fallback = None
+        try:
+            # The executor thread also stops at the deadline, between batches
+            scores = await asyncio.wait_for(asyncio.shield(future), timeout=self.budget_ms / 1000)
+        except (asyncio.TimeoutError, RerankBudgetExceeded):
+            if not future.done():
+                # Still scoring its current batch; nobody awaits it any more
+                future.add_done_callback(consume_result)
+            fallback = "budget_exceeded"
+            self.stats["budget_exceeded"] += 1
+            RERANK_BUDGET_EXCEEDED.inc()
+        except Exception as e:
+            fallback = "error"
+            self.stats["errors"] += 1
+            logger.warning(f"Reranking failed, keeping retrieval order: {e}")
+        elapsed = time.monotonic() - start
+        RERANK_SECONDS.observe(elapsed)
+
+        info = {"candidates": len(chunks), "rerank_ms": elapsed * 1000, "fallback": fallback}
+        if fallback is not None:
+            return chunks[:k], info
+        ranked = sorted(zip(scores, chunks), key=lambda pair: pair[0], reverse=True)[:k]
+        return [{**chunk, "rerank_score": float(score)} for score, chunk in ranked], info
+
+    def describe(self) -> Dict[str, Any]:
+        return {"model": self.model_name, "budget_ms": self.budget_ms,
+                "batch_size": self.batch_size, **self.stats}
+
+    def close(self):
+        self.executor.shutdown(wait=False)
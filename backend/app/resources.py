@@ -0,0 +1,438 @@
+"""
+Process-wide RAG resources.
+
+The embedding model, Supabase client, vector store, LLM client and prompt
+template are expensive to construct (the FastEmbed ONNX session alone takes
+seconds), so they are built once in the FastAPI lifespan and shared by every
+request.
+Call ``rebuild_resources()`` after changing configuration to swap in a fresh
+set without restarting the process.
+"""
+
+import asyncio
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+import structlog
+from langchain_community.vectorstores import SupabaseVectorStore
+from langchain_community.embeddings import FastEmbedEmbeddings
+from supabase import create_client, Client
+
+from .admission import AdmissionController
+from .clients import OllamaClient, SupabaseRPC
+from .context import ContextBuilder, TokenCounter
+from .embeddings import CachedEmbeddings, BatchingEmbedder
+from .embedding_cache import DiskEmbeddingCache
+from .embedding_store import EmbeddingStore
+from .lexical_index import BM25Index
+from .local_index import LocalVectorIndex
+from .reranker import CROSS_ENCODER_AVAILABLE, CrossEncoderReranker
+from .semantic_cache import SemanticCache
+from .singleflight import SingleFlight
+
+try:
+    from langchain_core.prompts import PromptTemplate
+except ImportError:
+    from langchain.prompts import PromptTemplate
+
+logger = structlog.get_logger()
+
+# Byte-identical across requests and processes: Ollama reuses the KV cache for
+# the longest common token prefix, so the instructions (and the context, when
+# the same chunks come back) are only prefilled once per slot. Anything that
+# varies per request must stay after this prefix.
+PROMPT_PREFIX = "You are a helpful AI assistant. You will answer the question based on the context provided.\n\n"
+
+PROMPT_TEMPLATE = PROMPT_PREFIX + "{context}\n\nQuestion: {question}\n"
+
+
+def load_config() -> Dict[str, Any]:
+    """Read RAG configuration from environment variables"""
+    return {
+        "supabase_url": os.environ.get("SUPABASE_URL"),
+        "supabase_key": os.environ.get("SUPABASE_ANON_KEY"),
+        "table_name": os.environ.get("SUPABASE_TABLE", "documents"),
+        "query_name": os.environ.get("SUPABASE_QUERY_NAME", "match_documents"),
+        "batch_query_name": os.environ.get("SUPABASE_BATCH_QUERY_NAME", "match_documents_batch"),
+        "metadata_update_name": os.environ.get("SUPABASE_METADATA_UPDATE_NAME", "set_document_metadata"),
+        "embedding_model": os.environ.get("EMBEDDING_MODEL", "BAAI/bge-small-en-v1.5"),
+        "query_embedding_cache_size": int(os.environ.get("QUERY_EMBEDDING_CACHE_SIZE", "4096")),
+        # Persistent SQLite cache of document (chunk) embeddings, keyed by model + text
+        "embedding_cache_path": os.environ.get("EMBEDDING_CACHE_PATH") or None,
+        "embedding_cache_max_mb": float(os.environ.get("EMBEDDING_CACHE_MAX_MB", "512")),
+        "embed_batching_enabled": os.environ.get("EMBED_BATCHING_ENABLED", "true").lower() == "true",
+        "embed_batch_max_size": int(os.environ.get("EMBED_BATCH_MAX_SIZE", "32")),
+        "embed_batch_max_wait_ms": float(os.environ.get("EMBED_BATCH_MAX_WAIT_MS", "5")),
+        "ollama_url": os.environ.get("OLLAMA_URL", "http://ollama:11434"),
+        "llm_model": os.environ.get("OLLAMA_MODEL", "llama3.2:1b"),
+        "temperature": float(os.environ.get("LLM_TEMPERATURE", "0.7")),
+        "num_predict": int(os.environ.get("LLM_NUM_PREDICT", "256")),  # Limit response length for faster generation
+        "num_ctx": int(os.environ.get("LLM_NUM_CTX", "2048")),          # Reduced context size for speed
+        # Keep the model (and its prompt KV cache) resident between requests; "-1" = forever
+        "ollama_keep_alive": os.environ.get("OLLAMA_KEEP_ALIVE", "30m"),
+        "ollama_warm_up": os.environ.get("OLLAMA_WARM_UP", "true").lower() == "true",
+        "retrieval_k": int(os.environ.get("RETRIEVAL_K", "3")),         # Limit to 3 most relevant chunks
+        # Multi-query: retrieve with several reformulations concurrently and fuse them
+        "multi_query_enabled": os.environ.get("MULTI_QUERY_ENABLED", "false").lower() == "true",
+        "multi_query_max_variants": int(os.environ.get("MULTI_QUERY_MAX_VARIANTS", "4")),
+        "multi_query_candidates": int(os.environ.get("MULTI_QUERY_CANDIDATES", "10")),
+        # Cross-encoder reranking of RERANK_CANDIDATES down to retrieval_k, within a time budget
+        "rerank_enabled": os.environ.get("RERANK_ENABLED", "false").lower() == "true",
+        "rerank_model": os.environ.get("RERANK_MODEL", "Xenova/ms-marco-MiniLM-L-6-v2"),
+        "rerank_candidates": int(os.environ.get("RERANK_CANDIDATES", "20")),
+        "rerank_budget_ms": float(os.environ.get("RERANK_BUDGET_MS", "150")),
+        "rerank_batch_size": int(os.environ.get("RERANK_BATCH_SIZE", "16")),
+        # Skip generation when the best chunk's cosine similarity is below this (0 = off)
+        "similarity_floor": float(os.environ.get("SIMILARITY_FLOOR", "0")),
+        "no_context_response": os.environ.get(
+            "NO_CONTEXT_RESPONSE",
+            "I couldn't find anything relevant to your question in the ingested documents."),
+        # Context packing: tokens counted with the LLM's tokenizer (HF repo ID or tokenizer.json)
+        "context_tokenizer": os.environ.get("CONTEXT_TOKENIZER", "unsloth/Llama-3.2-1B-Instruct"),
+        "context_token_budget": int(os.environ.get("CONTEXT_TOKEN_BUDGET", "1024")),
+        "context_duplicate_threshold": float(os.environ.get("CONTEXT_DUPLICATE_THRESHOLD", "0.9")),
+        "warm_up": os.environ.get("RAG_WARM_UP", "true").lower() == "true",
+        # Async query path
+        "embed_workers": int(os.environ.get("EMBED_WORKERS", "2")),
+        "http_max_connections": int(os.environ.get("HTTP_MAX_CONNECTIONS", "200")),
+        "http_max_keepalive": int(os.environ.get("HTTP_MAX_KEEPALIVE", "50")),
+        "http_keepalive_expiry": float(os.environ.get("HTTP_KEEPALIVE_EXPIRY", "60")),
+        "supabase_timeout": float(os.environ.get("SUPABASE_TIMEOUT", "10")),
+        "ollama_timeout": float(os.environ.get("OLLAMA_TIMEOUT", "120")),
+        "reload_grace_seconds": float(os.environ.get("RELOAD_GRACE_SECONDS", "30")),
+        "batch_max_prompts": int(os.environ.get("BATCH_MAX_PROMPTS", "500")),
+        # Streaming ingestion: upload read size, chunks stored per batch, splitter settings
+        "ingest_read_bytes": int(os.environ.get("INGEST_READ_BYTES", str(1024 * 1024))),
+        "ingest_batch_size": int(os.environ.get("INGEST_BATCH_SIZE", "64")),
+        "ingest_embed_workers": int(os.environ.get("INGEST_EMBED_WORKERS", "2")),
+        # Background ingest jobs: spooled uploads + resumable state, concurrent jobs, retention
+        "ingest_jobs_path": os.environ.get("INGEST_JOBS_PATH") or os.path.join(tempfile.gettempdir(), "rag_ingest_jobs"),
+        "ingest_job_workers": int(os.environ.get("INGEST_JOB_WORKERS", "1")),
+        "ingest_job_retention": float(os.environ.get("INGEST_JOB_RETENTION", "86400")),
+        "ingest_chunk_size": int(os.environ.get("INGEST_CHUNK_SIZE", "1000")),
+        "ingest_chunk_overlap": int(os.environ.get("INGEST_CHUNK_OVERLAP", "200")),
+        # Retrieval backend: "supabase" (match_documents RPC) or "local" (in-process index)
+        "retriever_backend": os.environ.get("RETRIEVER_BACKEND", "supabase").lower(),
+        "embedding_dimension": int(os.environ.get("EMBEDDING_DIMENSION", "384")),
+        "local_index_path": os.environ.get("LOCAL_INDEX_PATH") or None,
+        "local_index_dtype": os.environ.get("LOCAL_INDEX_DTYPE", "float32"),
+        "local_index_hnsw": os.environ.get("LOCAL_INDEX_HNSW", "false").lower() == "true",
+        "local_index_hnsw_min_rows": int(os.environ.get("LOCAL_INDEX_HNSW_MIN_ROWS", "50000")),
+        "local_index_hnsw_m": int(os.environ.get("LOCAL_INDEX_HNSW_M", "16")),
+        "local_index_hnsw_ef_construction": int(os.environ.get("LOCAL_INDEX_HNSW_EF_CONSTRUCTION", "200")),
+        "local_index_hnsw_ef_search": int(os.environ.get("LOCAL_INDEX_HNSW_EF_SEARCH", "64")),
+        # Hybrid retrieval: BM25 + dense candidates fused with reciprocal rank fusion
+        "hybrid_retrieval": os.environ.get("HYBRID_RETRIEVAL", "false").lower() == "true",
+        "hybrid_candidates": int(os.environ.get("HYBRID_CANDIDATES", "20")),
+        "rrf_k": int(os.environ.get("RRF_K", "60")),
+        "bm25_k1": float(os.environ.get("BM25_K1", "1.2")),
+        "bm25_b": float(os.environ.get("BM25_B", "0.75")),
+        "local_index_quantization": os.environ.get("LOCAL_INDEX_QUANTIZATION", "none").lower(),
+        "local_index_quantize_min_rows": int(os.environ.get("LOCAL_INDEX_QUANTIZE_MIN_ROWS", "1000")),
+        "local_index_rerank_factor": int(os.environ.get("LOCAL_INDEX_RERANK_FACTOR", "10")),
+        "local_index_pq_subspaces": int(os.environ.get("LOCAL_INDEX_PQ_SUBSPACES", "48")),
+        # Admission control for Ollama generation
+        "generation_max_concurrency": int(os.environ.get("GENERATION_MAX_CONCURRENCY", "2")),
+        "generation_max_queue": int(os.environ.get("GENERATION_MAX_QUEUE", "32")),
+        "generation_queue_timeout": float(os.environ.get("GENERATION_QUEUE_TIMEOUT", "30")),
+        # Semantic answer cache
+        "semantic_cache_enabled": os.environ.get("SEMANTIC_CACHE_ENABLED", "false").lower() == "true",
+        "semantic_cache_threshold": float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.95")),
+        "semantic_cache_max_entries": int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", "1000")),
+        "semantic_cache_ttl": float(os.environ.get("SEMANTIC_CACHE_TTL", "3600")),
+        "semantic_cache_max_mb": float(os.environ.get("SEMANTIC_CACHE_MAX_MB", "32")),
+        "semantic_cache_path": os.environ.get("SEMANTIC_CACHE_PATH") or None,
+    }
+
+
+class RAGResources:
+    """Long-lived clients shared by the prompt and ingest endpoints"""
+
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+        self.built_at = time.time()
+        self.warm_up_ms: Optional[float] = None
+
+        self.embedding_cache: Optional[DiskEmbeddingCache] = None
+        if config["embedding_cache_path"]:
+            self.embedding_cache = DiskEmbeddingCache(
+                config["embedding_cache_path"],
+                model_name=config["embedding_model"],
+                dimension=config["embedding_dimension"],
+                max_mb=config["embedding_cache_max_mb"],
+            )
+        self.embeddings = CachedEmbeddings(
+            FastEmbedEmbeddings(model_name=config["embedding_model"]),
+            max_entries=config["query_embedding_cache_size"],
+            disk_cache=self.embedding_cache,
+        )
+        # ONNX inference is CPU-bound, so it runs on a dedicated pool rather
+        # than Starlette's shared threadpool or the event loop.
+        self.embed_executor = ThreadPoolExecutor(
+            max_workers=config["embed_workers"], thread_name_prefix="embed"
+        )
+        # Ingest batches get their own pool so a large upload never queues
+        # ahead of query embeddings on embed_executor
+        self.ingest_executor = ThreadPoolExecutor(
+            max_workers=config["ingest_embed_workers"], thread_name_prefix="ingest-embed"
+        )
+        self.embed_batcher: Optional[BatchingEmbedder] = None
+        if config["embed_batching_enabled"]:
+            self.embed_batcher = BatchingEmbedder(
+                self.embeddings,
+                self.embed_executor,
+                max_batch_size=config["embed_batch_max_size"],
+                max_wait_ms=config["embed_batch_max_wait_ms"],
+            )
+
+        self.llm = OllamaClient(config)
+        self.single_flight = SingleFlight()
+        self.admission = AdmissionController(
+            max_concurrency=config["generation_max_concurrency"],
+            max_queue=config["generation_max_queue"],
+            queue_timeout=config["generation_queue_timeout"],
+        )
+
+        self.prompt_template = PromptTemplate(
+            template=PROMPT_TEMPLATE, input_variables=["context", "question"]
+        )
+
+        self.context_builder = ContextBuilder(
+            TokenCounter(config["context_tokenizer"]),
+            budget=config["context_token_budget"],
+            duplicate_threshold=config["context_duplicate_threshold"],
+        )
+
+        self.reranker: Optional[CrossEncoderReranker] = None
+        if config["rerank_enabled"]:
+            if CROSS_ENCODER_AVAILABLE:
+                self.reranker = CrossEncoderReranker(
+                    config["rerank_model"],
+                    batch_size=config["rerank_batch_size"],
+                    budget_ms=config["rerank_budget_ms"],
+                )
+            else:
+                logger.warning("RERANK_ENABLED is set but fastembed has no TextCrossEncoder; reranking disabled")
+
+        self.semantic_cache: Optional[SemanticCache] = None
+        if config["semantic_cache_enabled"]:
+            self.semantic_cache = SemanticCache(
+                threshold=config["semantic_cache_threshold"],
+                max_entries=config["semantic_cache_max_entries"],
+                ttl_seconds=config["semantic_cache_ttl"],
+                max_memory_bytes=int(config["semantic_cache_max_mb"] * 1024 * 1024),
+                persist_path=config["semantic_cache_path"],
+            )
+
+        # Supabase is optional at startup so the process can still boot (and
+        # report a useful error per request) when credentials are missing.
+        self.supabase: Optional[Client] = None
+        self.supabase_rpc: Optional[SupabaseRPC] = None
+        # Flipped off if the database predates match_documents_batch
+        self.batch_rpc_available = True
+        self.doc_store: Optional[SupabaseVectorStore] = None
+        if config["supabase_url"] and config["supabase_key"]:
+            self.supabase = create_client(config["supabase_url"], config["supabase_key"])
+            self.supabase_rpc = SupabaseRPC(config)
+            self.doc_store = SupabaseVectorStore(
+                client=self.supabase,
+                embedding=self.embeddings,
+                table_name=config["table_name"],
+                query_name=config["query_name"],
+            )
+
+        self.local_index: Optional[LocalVectorIndex] = None
+        if config["retriever_backend"] == "local":
+            # With a path, vectors live in a shared mmap store that opens in
+            # milliseconds; otherwise they are mirrored into RAM on every start.
+            store = None
+            if config["local_index_path"]:
+                store = EmbeddingStore(config["local_index_path"],
+                                       dimension=config["embedding_dimension"],
+                                       dtype=config["local_index_dtype"])
+            self.local_index = LocalVectorIndex(
+                dimension=config["embedding_dimension"],
+                store=store,
+                use_hnsw=config["local_index_hnsw"],
+                hnsw_min_rows=config["local_index_hnsw_min_rows"],
+                hnsw_m=config["local_index_hnsw_m"],
+                hnsw_ef_construction=config["local_index_hnsw_ef_construction"],
+                hnsw_ef_search=config["local_index_hnsw_ef_search"],
+                quantization=config["local_index_quantization"],
+                quantize_min_rows=config["local_index_quantize_min_rows"],
+                rerank_factor=config["local_index_rerank_factor"],
+                pq_subspaces=config["local_index_pq_subspaces"],
+            )
+            if self.supabase is not None and len(self.local_index) == 0:
+                self.local_index.load_from_supabase(self.supabase, config["table_name"])
+
+        self.lexical_index: Optional[BM25Index] = None
+        if config["hybrid_retrieval"]:
+            self.lexical_index = BM25Index(k1=config["bm25_k1"], b=config["bm25_b"])
+            if self.local_index is not None:
+                self.lexical_index.load_from_store(self.local_index.store)
+            elif self.supabase is not None:
+                self.lexical_index.load_from_supabase(self.supabase, config["table_name"])
+
+    @property
+    def supabase_configured(self) -> bool:
+        return self.doc_store is not None
+
+    @property
+    def retrieval_ready(self) -> bool:
+        """Queries can be answered: Supabase is configured or the local index is in use"""
+        return self.supabase_configured or self.local_index is not None
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Embed a query on the embedding executor without blocking the event loop"""
+        if self.embed_batcher is not None:
+            return await self.embed_batcher.embed(text)
+        # Cache hits are answered inline, without an executor hop
+        cached = self.embeddings.lookup(text)
+        if cached is not None:
+            return cached
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.embed_executor, self.embeddings.embed_query, text)
+
+    async def aembed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed several queries with a single batched inference"""
+        if self.embed_batcher is not None:
+            return await self.embed_batcher.embed_many(texts)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.embed_executor, self.embeddings.embed_queries, texts)
+
+    async def aclose(self):
+        """Close pooled HTTP connections and the embedding executor"""
+        if self.semantic_cache is not None:
+            try:
+                self.semantic_cache.save()
+            except Exception as e:
+                logger.warning(f"Failed to save semantic cache: {e}")
+        await self.llm.aclose()
+        if self.supabase_rpc is not None:
+            await self.supabase_rpc.aclose()
+        self.embed_executor.shutdown(wait=False)
+        self.ingest_executor.shutdown(wait=False)
+        if self.embedding_cache is not None:
+            self.embedding_cache.close()
+        if self.reranker is not None:
+            self.reranker.close()
+
+    def warm_up(self):
+        """Run one inference so the ONNX session is hot before the first request"""
+        start_time = time.time()
+        try:
+            self.embeddings.base.embed_query("warm-up")
+            self.warm_up_ms = (time.time() - start_time) * 1000
+            logger.info("Embedding model warmed up",
+                        model=self.config["embedding_model"],
+                        warm_up_ms=self.warm_up_ms)
+        except Exception as e:
+            logger.warning(f"Embedding warm-up failed: {e}")
+
+        if self.reranker is not None:
+            try:
+                self.reranker.warm_up()
+            except Exception as e:
+                logger.warning(f"Reranker warm-up failed: {e}")
+
+        if self.config["ollama_warm_up"]:
+            # Load the model and prefill the shared prompt prefix before the first request
+            start_time = time.time()
+            try:
+                self.llm.warm_up(PROMPT_PREFIX)
+                logger.info("Ollama model warmed up", model=self.config["llm_model"],
+                            warm_up_ms=(time.time() - start_time) * 1000)
+            except Exception as e:
+                logger.warning(f"Ollama warm-up failed: {e}")
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "built_at": self.built_at,
+            "embedding_model": self.config["embedding_model"],
+            "llm_model": self.config["llm_model"],
+            "supabase_configured": self.supabase_configured,
+            "retriever_backend": self.config["retriever_backend"],
+            "local_index": self.local_index.describe() if self.local_index is not None else None,
+            "lexical_index": self.lexical_index.describe() if self.lexical_index is not None else None,
+            "context_builder": self.context_builder.describe(),
+            "reranker": self.reranker.describe() if self.reranker is not None else None,
+            "warm_up_ms": self.warm_up_ms,
+            "query_embedding_cache": self.embeddings.describe(),
+            "embedding_cache": self.embedding_cache.describe() if self.embedding_cache is not None else None,
+            "embed_batching": self.embed_batcher.describe() if self.embed_batcher else {"enabled": False},
+            "admission": self.admission.describe(),
+            "coalescing": self.single_flight.describe(),
+        }
+
+
+_resources: Optional[RAGResources] = None
+_resources_lock = threading.Lock()
+# Held by index writers and across a rebuild, so no write lands in indexes being replaced
+_index_write_lock = threading.Lock()
+
+
+def build_resources(config: Optional[Dict[str, Any]] = None) -> RAGResources:
+    """Construct a fresh resource set (and warm it up if configured)"""
+    config = config or load_config()
+    start_time = time.time()
+    resources = RAGResources(config)
+    if config["warm_up"]:
+        resources.warm_up()
+    logger.info("RAG resources built",
+                build_time_ms=(time.time() - start_time) * 1000,
+                **resources.describe())
+    return resources
+
+
+def get_resources() -> RAGResources:
+    """Return the process-wide resources, building them on first use"""
+    global _resources
+    if _resources is None:
+        with _resources_lock:
+            if _resources is None:
+                _resources = build_resources()
+    return _resources
+
+
+def rebuild_resources(config: Optional[Dict[str, Any]] = None) -> RAGResources:
+    """Rebuild resources from (new) configuration and swap them in atomically.
+
+    In-flight requests keep the instance they already hold; new requests
+    pick up the replacement once it is fully built and warmed up. Index
+    writes (``writable_resources``) wait for the swap, so the new indexes,
+    loaded during the build, miss none of them.
+    """
+    global _resources
+    with _index_write_lock:
+        resources = build_resources(config)
+        with _resources_lock:
+            _resources = resources
+    return resources
+
+
+@contextmanager
+def writable_resources() -> Iterator[RAGResources]:
+    """The live resources, guaranteed not to be swapped out while the block writes to them"""
+    with _index_write_lock:
+        yield get_resources()
+
+
+async def close_resources():
+    """Drop the process-wide resources and close their connections (used on shutdown)"""
+    global _resources
+    with _resources_lock:
+        resources, _resources = _resources, None
+    if resources is not None:
+        await resources.aclose()
+
+
+async def close_after_grace(resources: RAGResources):
+    """Close a replaced resource set once in-flight requests have had time to finish"""
+    await asyncio.sleep(resources.config["reload_grace_seconds"])
+    await resources.aclose()
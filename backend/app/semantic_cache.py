@@ -0,0 +1,215 @@
+"""
+Semantic answer cache.
+
+Answers are keyed on the (normalized) bge-small query embedding. A lookup
+returns the cached answer of the closest previous query when its cosine
+similarity clears the configured threshold and the corpus has not changed
+since the answer was generated, so paraphrased repeat questions skip Ollama
+entirely.
+
+Entries are evicted least-recently-used first once either the entry count or
+the memory budget is exceeded, and expire after a TTL. Ingest jobs call
+``invalidate()`` after every batch they commit; each call bumps the corpus
+version, so an answer whose generation spanned a batch is not stored.
+"""
+
+import json
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+import structlog
+
+logger = structlog.get_logger()
+
+
+def _normalize(vector: Sequence[float]) -> np.ndarray:
+    array = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(array)
+    return array / norm if norm > 0 else array
+
+
+class SemanticCache:
+    """In-process LRU/TTL cache of answers keyed by query embedding"""
+
+    def __init__(self, threshold: float = 0.95, max_entries: int = 1000,
+                 ttl_seconds: float = 3600, max_memory_bytes: int = 32 * 1024 * 1024,
+                 persist_path: Optional[str] = None):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_bytes = max_memory_bytes
+        self.persist_path = persist_path
+
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self._next_key = 0
+        self._memory_bytes = 0
+        self._corpus_version = 0
+        self._lock = threading.Lock()
+
+        # Stacked embeddings of all entries, rebuilt lazily after changes
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_keys: List[int] = []
+
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "expirations": 0,
+            "invalidations": 0,
+        }
+
+        if persist_path:
+            self.load()
+
+    def lookup(self, query_embedding: Sequence[float]) -> Optional[Dict[str, Any]]:
+        """Return the cached payload for a near-identical query, or None"""
+        query = _normalize(query_embedding)
+        with self._lock:
+            self._expire()
+            if not self._entries:
+                self.stats["misses"] += 1
+                return None
+
+            matrix = self._stacked()
+            scores = matrix @ query
+            best = int(np.argmax(scores))
+            similarity = float(scores[best])
+            if similarity < self.threshold:
+                self.stats["misses"] += 1
+                return None
+
+            key = self._matrix_keys[best]
+            entry = self._entries[key]
+            self._entries.move_to_end(key)
+            entry["hits"] += 1
+            self.stats["hits"] += 1
+            return {
+                **entry["payload"],
+                "cache": {
+                    "similarity": similarity,
+                    "cached_question": entry["question"],
+                    "age_seconds": time.time() - entry["created_at"],
+                },
+            }
+
+    @property
+    def corpus_version(self) -> int:
+        return self._corpus_version
+
+    def store(self, query_embedding: Sequence[float], question: str, payload: Dict[str, Any],
+              corpus_version: Optional[int] = None):
+        """Cache a generated answer.
+
+        ``corpus_version`` should be read before retrieval; if documents were
+        ingested while the answer was being generated it is silently dropped.
+        """
+        embedding = _normalize(query_embedding)
+        size = embedding.nbytes + len(question) + len(json.dumps(payload, default=str))
+        if size > self.max_memory_bytes:
+            return
+
+        with self._lock:
+            if corpus_version is not None and corpus_version != self._corpus_version:
+                return
+            key = self._next_key
+            self._next_key += 1
+            self._entries[key] = {
+                "embedding": embedding,
+                "question": question,
+                "payload": payload,
+                "created_at": time.time(),
+                "size": size,
+                "hits": 0,
+            }
+            self._memory_bytes += size
+            self._matrix = None
+            self._evict()
+
+    def invalidate(self):
+        """Drop every entry; called when the corpus changes"""
+        with self._lock:
+            self._entries.clear()
+            self._memory_bytes = 0
+            self._matrix = None
+            self._corpus_version += 1
+            self.stats["invalidations"] += 1
+
+    def describe(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "memory_bytes": self._memory_bytes,
+                "max_memory_bytes": self.max_memory_bytes,
+                "threshold": self.threshold,
+                "corpus_version": self._corpus_version,
+            }
+
+    def save(self):
+        """Persist entries to ``persist_path`` (if configured)"""
+        if not self.persist_path:
+            return
+        with self._lock:
+            state = {
+                "corpus_version": self._corpus_version,
+                "entries": list(self._entries.values()),
+            }
+        tmp_path = f"{self.persist_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, self.persist_path)
+        logger.info("Semantic cache saved", path=self.persist_path, entries=len(state["entries"]))
+
+    def load(self):
+        if not self.persist_path or not os.path.exists(self.persist_path):
+            return
+        try:
+            with open(self.persist_path, "rb") as f:
+                state = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Failed to load semantic cache: {e}")
+            return
+
+        with self._lock:
+            self._corpus_version = state.get("corpus_version", 0)
+            for entry in state.get("entries", []):
+                self._entries[self._next_key] = entry
+                self._next_key += 1
+                self._memory_bytes += entry["size"]
+            self._matrix = None
+            self._expire()
+            self._evict()
+        logger.info("Semantic cache loaded", path=self.persist_path, entries=len(self._entries))
+
+    def _stacked(self) -> np.ndarray:
+        if self._matrix is None:
+            self._matrix_keys = list(self._entries.keys())
+            self._matrix = np.stack([self._entries[k]["embedding"] for k in self._matrix_keys])
+        return self._matrix
+
+    def _remove(self, key: int):
+        entry = self._entries.pop(key)
+        self._memory_bytes -= entry["size"]
+        self._matrix = None
+
+    def _expire(self):
+        if not self.ttl_seconds:
+            return
+        cutoff = time.time() - self.ttl_seconds
+        expired = [key for key, entry in self._entries.items() if entry["created_at"] < cutoff]
+        for key in expired:
+            self._remove(key)
+        self.stats["expirations"] += len(expired)
+
+    def _evict(self):
+        while self._entries and (len(self._entries) > self.max_entries
+                                 or self._memory_bytes > self.max_memory_bytes):
+            self._remove(next(iter(self._entries)))
+            self.stats["evictions"] += 1
@@ -0,0 +1,44 @@
+"""
+Request coalescing ("single-flight") for the query pipeline.
+
+Concurrent identical requests - same normalized prompt and same retrieval /
+generation parameters - share one embed -> retrieve -> generate execution
+and all receive its result. The shared work runs in its own task, so a
+caller disconnecting does not cancel it for the others.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from .metrics import COALESCED_REQUESTS
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls that share a key"""
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, asyncio.Task] = {}
+        self.stats = {"executions": 0, "coalesced": 0}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Dict[str, Any]]]) -> Dict[str, Any]:
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+            COALESCED_REQUESTS.inc()
+            result = await asyncio.shield(task)
+            return {**result, "coalesced": True}
+
+        task = asyncio.ensure_future(fn())
+        self._in_flight[key] = task
+        task.add_done_callback(lambda done: self._finished(key, done))
+        self.stats["executions"] += 1
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Task):
+        self._in_flight.pop(key, None)
+        # Mark the exception as retrieved even if every caller went away
+        if not task.cancelled():
+            task.exception()
+
+    def describe(self) -> Dict[str, Any]:
+        return {**self.stats, "in_flight": len(self._in_flight)}
@@ -0,0 +1,191 @@
+"""
+Prefill time with and without prompt-prefix (KV cache) reuse.
+
+Sends the same stream of RAG prompts to an Ollama-compatible server in
+three modes:
+
+    cold            keep_alive=0: the model is unloaded after every request
+    warm, no reuse  model kept loaded, but the question comes first, so no
+                    two prompts share a prefix
+    warm, stable    model kept loaded, byte-identical instructions + context
+                    prefix (the app's PROMPT_TEMPLATE); only the differing
+                    tail is prefilled
+
+By default a local stand-in server is started that mimics Ollama's
+behaviour (model load on first use / after keep_alive expiry, per-slot KV
+cache reused for the longest common token prefix, Ollama's timing fields).
+Point ``--url`` at a real Ollama to measure the actual model.
+
+Usage (from backend/)::
+
+    python -m benchmarks.prefix_cache_benchmark
+    python -m benchmarks.prefix_cache_benchmark --url http://localhost:11434 --model llama3.2:1b
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import re
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+from app.clients import OllamaClient
+from app.resources import PROMPT_TEMPLATE
+
+TOKEN_PATTERN = re.compile(r"\s+|\w+|[^\w\s]")
+
+
+class StandInState:
+    """Model residency and per-slot token caches of the stand-in server"""
+
+    def __init__(self, slots: int, prefill_ms_per_token: float, load_ms: float):
+        self.slots: List[List[str]] = [[] for _ in range(slots)]
+        self.last_used = [0.0] * slots
+        self.prefill_ms_per_token = prefill_ms_per_token
+        self.load_ms = load_ms
+        self.loaded_until = 0.0
+        self.lock = threading.Lock()
+
+    def generate(self, prompt: str, keep_alive: Any) -> Dict[str, Any]:
+        tokens = TOKEN_PATTERN.findall(prompt)
+        with self.lock:
+            load_ms = 0.0
+            if time.time() > self.loaded_until:
+                load_ms = self.load_ms
+                self.slots = [[] for _ in self.slots]
+            # Like Ollama's runner: reuse the KV of the slot sharing the longest prefix;
+            # if continuing there would discard its cached tail, copy the prefix into
+            # the least recently used slot instead
+            best, reused = 0, 0
+            for index, cached in enumerate(self.slots):
+                shared = 0
+                for a, b in zip(cached, tokens):
+                    if a != b:
+                        break
+                    shared += 1
+                if shared > reused:
+                    best, reused = index, shared
+            if reused < len(self.slots[best]):
+                best = min(range(len(self.slots)), key=lambda index: self.last_used[index])
+            self.slots[best] = tokens
+            self.last_used[best] = time.time()
+            evaluated = len(tokens) - reused
+            prefill_ms = evaluated * self.prefill_ms_per_token
+            self.loaded_until = time.time() + keep_alive_seconds(keep_alive)
+        time.sleep((load_ms + prefill_ms) / 1000)
+        return {
+            "response": "ok",
+            "done": True,
+            "prompt_eval_count": evaluated,
+            "prompt_eval_duration": int(prefill_ms * 1e6),
+            "load_duration": int(load_ms * 1e6),
+            "eval_count": 1,
+            "eval_duration": 0,
+        }
+
+
+def keep_alive_seconds(value: Any) -> float:
+    if isinstance(value, (int, float)):
+        return float("inf") if value < 0 else float(value)
+    units = {"s": 1, "m": 60, "h": 3600}
+    return float(value[:-1]) * units[value[-1]]
+
+
+def start_stand_in(state: StandInState) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            payload = json.dumps(state.generate(body["prompt"], body.get("keep_alive", "5m"))).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def workload(queries: int, topics: int, seed: int) -> List[Dict[str, str]]:
+    """Questions over a few topics; same-topic questions retrieve the same chunks"""
+    rng = random.Random(seed)
+    contexts = [
+        "\n\n".join(f"Topic {t} section {s}: " + " ".join(f"fact{t}_{s}_{w}" for w in range(60))
+                    for s in range(3))
+        for t in range(topics)
+    ]
+    return [{"context": contexts[rng.randrange(topics)], "question": f"What does item {i} say?"}
+            for i in range(queries)]
+
+
+def render(item: Dict[str, str], stable: bool) -> str:
+    if stable:
+        return PROMPT_TEMPLATE.format(**item)
+    return (f"Question: {item['question']}\n\n"
+            + PROMPT_TEMPLATE.replace("Question: {question}\n", "").format(context=item["context"]))
+
+
+async def run_mode(url: str, model: str, items: List[Dict[str, str]], keep_alive: str,
+                   stable: bool) -> Dict[str, float]:
+    client = OllamaClient({
+        "llm_model": model, "temperature": 0.0, "num_predict": 1, "num_ctx": 2048,
+        "ollama_keep_alive": keep_alive, "ollama_timeout": 300.0, "ollama_url": url,
+        "http_max_connections": 4, "http_max_keepalive": 4, "http_keepalive_expiry": 30.0,
+    })
+    prefill, load, evaluated = [], [], []
+    try:
+        for item in items:
+            result = await client.generate(render(item, stable))
+            prefill.append(result.get("prompt_eval_duration", 0) / 1e6)
+            load.append(result.get("load_duration", 0) / 1e6)
+            evaluated.append(result.get("prompt_eval_count", 0))
+    finally:
+        await client.aclose()
+    return {
+        "prefill_ms_mean": statistics.mean(prefill),
+        "prefill_ms_p50": statistics.median(prefill),
+        "load_ms_mean": statistics.mean(load),
+        "prompt_tokens_evaluated_mean": statistics.mean(evaluated),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="real Ollama URL (default: start a local stand-in)")
+    parser.add_argument("--model", default="llama3.2:1b")
+    parser.add_argument("--queries", type=int, default=40)
+    parser.add_argument("--topics", type=int, default=4)
+    parser.add_argument("--slots", type=int, default=4, help="stand-in parallel slots (OLLAMA_NUM_PARALLEL)")
+    parser.add_argument("--prefill-ms-per-token", type=float, default=0.5)
+    parser.add_argument("--load-ms", type=float, default=800.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server: Optional[ThreadingHTTPServer] = None
+    url = args.url
+    if url is None:
+        server = start_stand_in(StandInState(args.slots, args.prefill_ms_per_token, args.load_ms))
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    items = workload(args.queries, args.topics, args.seed)
+    modes = [("cold", "0", True), ("warm, no reuse", "30m", False), ("warm, stable", "30m", True)]
+    print(f"server={url} queries={len(items)} topics={args.topics}")
+    print(f"{'mode':<16}{'prefill ms':>12}{'p50':>8}{'load ms':>10}{'tokens evaluated':>18}")
+    for name, keep_alive, stable in modes:
+        stats = asyncio.run(run_mode(url, args.model, items, keep_alive, stable))
+        print(f"{name:<16}{stats['prefill_ms_mean']:>12.1f}{stats['prefill_ms_p50']:>8.1f}"
+              f"{stats['load_ms_mean']:>10.1f}{stats['prompt_tokens_evaluated_mean']:>18.1f}")
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Recall / memory / latency of quantized first-stage search vs exact search.
+
+Builds the local index with each quantization setting over the same vectors
+(each in its own memory-mapped store under a temporary directory, as
+quantization requires) and compares its top-k against exact float32 search.
+Uses a synthetic clustered corpus by default, or the vectors of an existing
+embedding store.
+
+"code MB" stays resident in RAM; "f32 MB/q" is how much of the mapped
+float32 matrix a query reads (all of it for exact search, only the
+shortlist for quantized search). While the whole matrix fits in the page
+cache, the exact BLAS scan is usually the fastest; quantization pays off
+once it does not.
+
+Usage (from backend/)::
+
+    python -m benchmarks.quantization_benchmark
+    python -m benchmarks.quantization_benchmark --rows 200000 --rerank-factors 2,5,10
+    python -m benchmarks.quantization_benchmark --store /app/data/embeddings
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import structlog
+
+from app.embedding_store import EmbeddingStore
+from app.local_index import LocalVectorIndex, normalize_rows
+
+
+def synthetic_corpus(rows: int, dimension: int, clusters: int, rng: np.random.Generator) -> np.ndarray:
+    # Sentence embeddings are clustered by topic, not uniform on the sphere
+    centers = rng.standard_normal((clusters, dimension)).astype(np.float32)
+    assignment = rng.integers(0, clusters, rows)
+    vectors = centers[assignment] + 0.6 * rng.standard_normal((rows, dimension)).astype(np.float32)
+    return normalize_rows(vectors, dimension)
+
+
+def build_index(vectors: np.ndarray, quantization: str, rerank_factor: int, path: str) -> LocalVectorIndex:
+    store = EmbeddingStore(os.path.join(path, quantization), dimension=vectors.shape[1])
+    index = LocalVectorIndex(dimension=vectors.shape[1], store=store, quantization=quantization,
+                             quantize_min_rows=0, rerank_factor=rerank_factor)
+    ids = [str(i) for i in range(len(vectors))]
+    index.add(ids, [""] * len(ids), [{}] * len(ids), vectors)
+    return index
+
+
+def run(index: LocalVectorIndex, queries: np.ndarray, k: int):
+    start = time.perf_counter()
+    results = [[int(row["id"]) for row in index.search(query, k)] for query in queries]
+    elapsed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    return results, elapsed_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--rerank-factors", default="1,5,10")
+    parser.add_argument("--methods", default="int8,pq")
+    parser.add_argument("--store", help="use the vectors of an existing embedding store")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    structlog.configure(wrapper_class=structlog.make_filtering_bound_logger(30))
+    rng = np.random.default_rng(args.seed)
+    if args.store:
+        store = EmbeddingStore(args.store)
+        vectors = np.asarray(store.vectors[~store.deleted], dtype=np.float32)
+    else:
+        vectors = synthetic_corpus(args.rows, args.dimension, args.clusters, rng)
+    # Queries are perturbed corpus rows, like paraphrases of indexed text
+    picks = vectors[rng.integers(0, len(vectors), args.queries)]
+    queries = normalize_rows(picks + 0.05 * rng.standard_normal(picks.shape).astype(np.float32),
+                             vectors.shape[1])
+
+    workdir = tempfile.TemporaryDirectory()
+    exact = build_index(vectors, "none", 1, workdir.name)
+    truth, exact_ms = run(exact, queries, args.k)
+    row_mb = vectors.shape[1] * 4 / 2**20
+    print(f"rows={len(vectors)} dim={vectors.shape[1]} queries={len(queries)} k={args.k}")
+    print(f"{'method':<8}{'rerank':>8}{'code MB':>10}{'f32 MB/q':>10}{'ms/query':>10}{'recall@k':>10}")
+    print(f"{'exact':<8}{'-':>8}{'-':>10}{len(vectors) * row_mb:>10.1f}{exact_ms:>10.2f}{1.0:>10.3f}")
+
+    for method in args.methods.split(","):
+        start = time.perf_counter()
+        index = build_index(vectors, method, 1, workdir.name)
+        build_s = time.perf_counter() - start
+        for factor in (int(f) for f in args.rerank_factors.split(",")):
+            index.rerank_factor = factor
+            found, ms = run(index, queries, args.k)
+            recall = np.mean([len(set(f) & set(t)) / len(t) for f, t in zip(found, truth)])
+            code_mb = index.describe()["code_bytes"] / 2**20
+            read_mb = min(len(vectors), args.k * factor) * row_mb
+            print(f"{method:<8}{factor:>8}{code_mb:>10.1f}{read_mb:>10.2f}{ms:>10.2f}{recall:>10.3f}")
+        print(f"  ({method} training + encoding: {build_s:.1f}s)")
+    workdir.cleanup()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Shared fixtures: an offline resource set (local index in a temporary
+embedding store, deterministic fake embeddings, no Supabase / Ollama /
+tokenizer downloads).
+"""
+
+import asyncio
+import hashlib
+
+import numpy as np
+import pytest
+from langchain_core.embeddings import Embeddings
+
+import app.resources as resources_module
+
+
+class FakeEmbeddings(Embeddings):
+    """Unit vectors derived from the text hash; counts documents embedded"""
+
+    embedded_texts = 0
+
+    def __init__(self, model_name=None, **kwargs):
+        self.model_name = model_name
+
+    @staticmethod
+    def vector(text: str):
+        rng = np.random.default_rng(int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16))
+        vector = rng.standard_normal(384)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_documents(self, texts):
+        FakeEmbeddings.embedded_texts += len(texts)
+        return [self.vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self.vector(text)
+
+
+class FakeLLM:
+    """Stands in for ``OllamaClient``; records every prompt it is asked to answer"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.prompts = []
+
+    async def generate(self, prompt, options=None):
+        self.prompts.append(prompt)
+        await asyncio.sleep(self.delay)
+        return {"response": f"answer {len(self.prompts)}", "prompt_eval_count": 10, "eval_count": 3}
+
+    async def stream(self, prompt, options=None):
+        result = await self.generate(prompt, options)
+        for token in result["response"].split(" "):
+            yield {"response": token, "done": False}
+        yield {"response": "", "done": True, **result}
+
+    async def aclose(self):
+        pass
+
+
+def index_texts(resources, texts, metadatas=None):
+    """Add chunks (with fake embeddings) straight to the local index; returns their IDs"""
+    ids = [f"chunk{len(resources.local_index) + i}" for i in range(len(texts))]
+    metadatas = metadatas or [{"source": "doc.txt"} for _ in texts]
+    resources.local_index.add(ids, texts, metadatas, np.array([FakeEmbeddings.vector(text) for text in texts]))
+    return ids
+
+
+@pytest.fixture
+def rag_env(tmp_path, monkeypatch):
+    """Environment for an offline resource set; returns the temporary directory"""
+    settings = {
+        "SUPABASE_URL": "",
+        "SUPABASE_ANON_KEY": "",
+        "RETRIEVER_BACKEND": "local",
+        "LOCAL_INDEX_PATH": str(tmp_path / "embeddings"),
+        "INGEST_JOBS_PATH": str(tmp_path / "jobs"),
+        "INGEST_BATCH_SIZE": "8",
+        "INGEST_READ_BYTES": "4096",
+        "CONTEXT_TOKENIZER": "",
+        "OLLAMA_WARM_UP": "false",
+        "RAG_WARM_UP": "false",
+        "SEMANTIC_CACHE_ENABLED": "false",
+        "RELOAD_GRACE_SECONDS": "0",
+    }
+    for name, value in settings.items():
+        monkeypatch.setenv(name, value)
+    for name in ("EMBEDDING_CACHE_PATH", "SEMANTIC_CACHE_PATH"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setattr(resources_module, "FastEmbedEmbeddings", FakeEmbeddings)
+    FakeEmbeddings.embedded_texts = 0
+    yield tmp_path
+    resources_module._resources = None
+
+
+@pytest.fixture
+def rag_resources(rag_env):
+    """The process-wide resources, built from ``rag_env``"""
+    resources = resources_module.rebuild_resources()
+    yield resources
+    resources.ingest_executor.shutdown(wait=True)
+    resources.embed_executor.shutdown(wait=True)
+
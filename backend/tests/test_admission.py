@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.main as main
+from app.admission import AdmissionController, AdmissionRejected
+
+
+def test_queue_full_is_rejected_with_429():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1, max_queue=0, queue_timeout=5)
+        async with controller.slot():
+            with pytest.raises(AdmissionRejected) as rejected:
+                async with controller.slot():
+                    pass
+        return controller, rejected.value
+
+    controller, rejected = asyncio.run(scenario())
+    assert rejected.status_code == 429
+    assert rejected.retry_after >= 1
+    assert controller.stats["rejected_queue_full"] == 1
+
+
+def test_queue_timeout_is_rejected_with_503():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1, max_queue=4, queue_timeout=0.05)
+        async with controller.slot():
+            with pytest.raises(AdmissionRejected) as rejected:
+                async with controller.slot():
+                    pass
+        # The timed-out waiter left the queue; the freed slot is admitted at once
+        async with controller.slot() as queue_wait:
+            assert queue_wait < 0.05
+        return controller, rejected.value
+
+    controller, rejected = asyncio.run(scenario())
+    assert rejected.status_code == 503
+    assert controller.stats["rejected_timeout"] == 1
+    assert controller.describe()["queue_depth"] == 0
+
+
+def test_waiting_request_is_admitted_when_a_slot_frees():
+    async def scenario():
+        controller = AdmissionController(max_concurrency=1, max_queue=4, queue_timeout=5)
+
+        async def hold():
+            async with controller.slot():
+                await asyncio.sleep(0.05)
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0)
+        async with controller.slot() as queue_wait:
+            pass
+        await holder
+        return controller, queue_wait
+
+    controller, queue_wait = asyncio.run(scenario())
+    assert queue_wait > 0
+    assert controller.stats == {"admitted": 2, "queued": 1, "rejected_queue_full": 0, "rejected_timeout": 0}
+
+
+@pytest.mark.parametrize("status_code", [429, 503])
+def test_prompt_endpoint_maps_rejections_to_status_and_retry_after(rag_env, monkeypatch, status_code):
+    async def rejected(*args, **kwargs):
+        raise AdmissionRejected("Generation queue is full", status_code, 7)
+
+    monkeypatch.setattr(main, "run_rag_query", rejected)
+    with TestClient(main.app) as client:
+        response = client.post("/api/prompt", json={"prompt": "what is in the docs?"})
+    assert response.status_code == status_code
+    assert response.headers["Retry-After"] == "7"
+    assert response.json()["retry_after"] == 7
@@ -0,0 +1,43 @@
+import json
+
+from fastapi.testclient import TestClient
+
+import app.main as main
+from app.pipeline import run_rag_batch
+from app.resources import get_resources
+
+from conftest import FakeLLM, index_texts
+
+
+def post_batch(client, prompts):
+    response = client.post("/api/prompt/batch", json={"prompts": prompts, "max_parallel": 2})
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_batch_streams_one_line_per_prompt_and_a_summary(rag_env):
+    with TestClient(main.app) as client:
+        get_resources().llm = FakeLLM()
+        index_texts(get_resources(), [f"document {i}" for i in range(5)])
+        lines = post_batch(client, ["a?", "b?", "c?"])
+
+    items, summary = lines[:-1], lines[-1]
+    assert sorted(item["index"] for item in items) == [0, 1, 2]
+    assert all("response" in item for item in items)
+    assert (summary["done"], summary["count"], summary["errors"]) == (True, 3, 0)
+
+
+def test_a_failure_mid_stream_counts_only_the_prompts_not_yet_emitted(rag_env, monkeypatch):
+    async def failing_after_first(*args, **kwargs):
+        async for item in run_rag_batch(*args, **kwargs):
+            yield item
+            raise RuntimeError("retriever went away")
+
+    monkeypatch.setattr(main, "run_rag_batch", failing_after_first)
+    with TestClient(main.app) as client:
+        get_resources().llm = FakeLLM()
+        index_texts(get_resources(), [f"document {i}" for i in range(5)])
+        lines = post_batch(client, ["a?", "b?", "c?", "d?"])
+
+    assert "response" in lines[0]
+    assert lines[1] == {"error": "Failed to process batch: retriever went away"}
+    assert (lines[2]["count"], lines[2]["errors"]) == (4, 3)
@@ -0,0 +1,85 @@
+from app.context import ContextBuilder, TokenCounter, strip_overlap
+
+
+def words(start: int, stop: int) -> str:
+    return " ".join(f"word{i}" for i in range(start, stop))
+
+
+def chunk(chunk_id: str, content: str):
+    return {"id": chunk_id, "content": content, "metadata": {}, "similarity": 0.5}
+
+
+def builder(budget: int = 10000, **kwargs) -> ContextBuilder:
+    return ContextBuilder(TokenCounter(), budget, **kwargs)
+
+
+# Two neighbouring splitter chunks: the last 20 words of one open the next
+EARLIER = words(0, 60)
+LATER = words(40, 100)
+SHARED = words(40, 60)
+
+
+def test_strip_overlap_in_both_document_orders():
+    # Selected chunk precedes the candidate: the candidate loses its head
+    assert strip_overlap(EARLIER, LATER, 40, 400) == words(60, 100)
+    # Selected chunk follows the candidate: the candidate loses its tail
+    assert strip_overlap(LATER, EARLIER, 40, 400) == words(0, 40)
+    # Unrelated text, or an overlap shorter than min_overlap, is left alone
+    assert strip_overlap(EARLIER, words(200, 260), 40, 400) == words(200, 260)
+    assert strip_overlap(words(0, 5), words(3, 10), 40, 400) == words(3, 10)
+
+
+def test_overlap_beyond_max_overlap_is_not_stripped():
+    assert strip_overlap(EARLIER, LATER, 40, len(SHARED) - 1) == LATER
+    assert strip_overlap(EARLIER, LATER, 40, len(SHARED) + 1) == words(60, 100)
+
+
+def test_context_holds_the_shared_text_once_in_either_retrieval_order():
+    for ranked in ([chunk("a", EARLIER), chunk("b", LATER)], [chunk("b", LATER), chunk("a", EARLIER)]):
+        context, used, stats = builder().build(ranked)
+        assert context.count(SHARED) == 1
+        assert [c["id"] for c in used] == [c["id"] for c in ranked]
+        assert stats["overlap_chars_removed"] == len(SHARED) + 1
+        assert sorted(context.split()) == sorted(words(0, 100).split())
+
+
+def test_exact_and_near_duplicates_are_dropped():
+    near_duplicate = words(0, 59) + " changed"
+    context, used, stats = builder().build([
+        chunk("a", EARLIER), chunk("copy", EARLIER), chunk("near", near_duplicate), chunk("other", words(500, 520)),
+    ])
+    assert [c["id"] for c in used] == ["a", "other"]
+    assert stats["duplicates_dropped"] == 2
+    assert context == EARLIER + "\n\n" + words(500, 520)
+
+
+def test_chunk_crossing_the_budget_is_truncated_and_later_ones_dropped():
+    counter = TokenCounter()
+    first, second, third = words(0, 50), words(100, 200), words(300, 400)
+    budget = counter.count(first) + counter.count("\n\n") + 60
+    context, used, stats = builder(budget, min_chunk_tokens=32).build(
+        [chunk("a", first), chunk("b", second), chunk("c", third)])
+
+    assert [c["id"] for c in used] == ["a", "b"]
+    assert used[0]["content"] == first
+    assert second.startswith(used[1]["content"]) and len(used[1]["content"]) < len(second)
+    # Cut on a word boundary
+    assert used[1]["content"].split()[-1] in second.split()
+    assert stats["truncated"] and stats["budget_dropped"] == 1
+    assert counter.count(context) <= stats["context_tokens"] <= budget
+
+
+def test_truncation_never_exceeds_the_token_count():
+    counter = TokenCounter()
+    for max_tokens in range(1, 100):
+        for text in ("x" * 1000, words(0, 200)):
+            assert counter.count(counter.truncate(text, max_tokens)) <= max_tokens
+
+
+def test_remainder_below_min_chunk_tokens_is_not_used():
+    counter = TokenCounter()
+    first = words(0, 50)
+    budget = counter.count(first) + counter.count("\n\n") + 10
+    _, used, stats = builder(budget, min_chunk_tokens=32).build([chunk("a", first), chunk("b", words(100, 200))])
+    assert [c["id"] for c in used] == ["a"]
+    assert (stats["truncated"], stats["budget_dropped"]) == (False, 1)
@@ -0,0 +1,54 @@
+import numpy as np
+
+from app.embedding_cache import DiskEmbeddingCache
+from app.embeddings import CachedEmbeddings
+
+from conftest import FakeEmbeddings
+
+
+def test_get_many_reports_hits_and_misses(tmp_path):
+    cache = DiskEmbeddingCache(str(tmp_path / "cache.sqlite"), "model-a", dimension=384)
+    cache.put_many(["alpha", "beta"], [FakeEmbeddings.vector("alpha"), FakeEmbeddings.vector("beta")])
+
+    vectors = cache.get_many(["alpha", "gamma", "beta"])
+    assert vectors[1] is None
+    np.testing.assert_allclose(vectors[0], FakeEmbeddings.vector("alpha"), rtol=1e-6)
+    np.testing.assert_allclose(vectors[2], FakeEmbeddings.vector("beta"), rtol=1e-6)
+    assert cache.describe()["hits"] == 2
+    assert cache.describe()["misses"] == 1
+
+
+def test_entries_are_isolated_by_model(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    DiskEmbeddingCache(path, "model-a", dimension=384).put_many(["alpha"], [FakeEmbeddings.vector("alpha")])
+
+    assert DiskEmbeddingCache(path, "model-b", dimension=384).get_many(["alpha"]) == [None]
+    # A vector of another dimension under the same key is treated as a miss
+    assert DiskEmbeddingCache(path, "model-a", dimension=8).get_many(["alpha"]) == [None]
+
+
+def test_cache_survives_reopen_and_skips_inference(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    FakeEmbeddings.embedded_texts = 0
+    first = CachedEmbeddings(FakeEmbeddings(), disk_cache=DiskEmbeddingCache(path, "model-a"))
+    expected = first.embed_documents(["alpha", "beta", "alpha"])
+    assert FakeEmbeddings.embedded_texts == 2
+    first.disk_cache.close()
+
+    # A new process: only the text not seen before is embedded
+    restarted = CachedEmbeddings(FakeEmbeddings(), disk_cache=DiskEmbeddingCache(path, "model-a"))
+    vectors = restarted.embed_documents(["beta", "gamma", "alpha"])
+    assert FakeEmbeddings.embedded_texts == 3
+    np.testing.assert_allclose(vectors, [expected[1], FakeEmbeddings.vector("gamma"), expected[0]], rtol=1e-6)
+    assert restarted.disk_cache.describe()["entries"] == 3
+
+
+def test_entries_beyond_the_size_limit_are_evicted(tmp_path):
+    # Room for ~10 vectors of 8 floats
+    cache = DiskEmbeddingCache(str(tmp_path / "cache.sqlite"), "model-a", dimension=8,
+                               max_mb=10 * (8 * 4 + 96) / (1024 * 1024))
+    texts = [f"text {i}" for i in range(12)]
+    cache.put_many(texts, np.ones((12, 8)))
+
+    assert cache.describe()["entries"] <= cache.max_entries
+    assert cache.stats["evictions"] > 0
@@ -0,0 +1,143 @@
+import os
+
+import numpy as np
+
+from app.embedding_store import EmbeddingStore, main as store_cli
+from app.local_index import LocalVectorIndex, normalize_rows
+
+
+def rows(count: int, dimension: int = 8, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    ids = [f"id{i}" for i in range(count)]
+    contents = [f"chunk {i}" for i in range(count)]
+    metadatas = [{"source": f"s{i % 2}.txt"} for i in range(count)]
+    return ids, contents, metadatas, normalize_rows(rng.standard_normal((count, dimension)), dimension)
+
+
+def live_ids(store: EmbeddingStore):
+    return [store.id(row) for row in range(len(store)) if not store.deleted[row]]
+
+
+def test_append_survives_reopen(tmp_path):
+    ids, contents, metadatas, vectors = rows(10)
+    EmbeddingStore(str(tmp_path), dimension=8).append(ids, contents, metadatas, vectors)
+
+    store = EmbeddingStore(str(tmp_path), dimension=8)
+    assert len(store) == 10
+    assert store.ids() == ids
+    assert store.content(3) == "chunk 3"
+    assert store.metadata(3) == {"source": "s1.txt"}
+    np.testing.assert_allclose(store.vectors, vectors, rtol=1e-6)
+
+
+def test_delete_tombstones_rows_and_other_handles_see_it(tmp_path):
+    writer = EmbeddingStore(str(tmp_path), dimension=8)
+    reader = EmbeddingStore(str(tmp_path), dimension=8)
+    writer.append(*rows(6))
+
+    assert writer.delete(["id1", "id4", "missing"]) == 2
+    assert writer.delete(["id1"]) == 0
+    assert reader.refresh()
+    assert live_ids(reader) == ["id0", "id2", "id3", "id5"]
+    assert reader.describe()["deleted_rows"] == 2
+
+
+def test_compact_drops_deleted_rows_in_a_new_generation(tmp_path):
+    store = EmbeddingStore(str(tmp_path), dimension=8)
+    ids, contents, metadatas, vectors = rows(6)
+    store.append(ids, contents, metadatas, vectors)
+    store.delete(["id0", "id3"])
+    old_generation = store.generation
+
+    assert store.compact() == {"rows_before": 6, "rows_after": 4}
+    assert store.generation != old_generation
+    assert not os.path.exists(os.path.join(str(tmp_path), old_generation))
+    assert store.ids() == ["id1", "id2", "id4", "id5"]
+    assert not store.deleted.any()
+    assert [store.content(row) for row in range(4)] == ["chunk 1", "chunk 2", "chunk 4", "chunk 5"]
+    np.testing.assert_allclose(store.vectors, vectors[[1, 2, 4, 5]], rtol=1e-6)
+
+    # Appends after a compaction land in the new generation
+    store.append(["id6"], ["chunk 6"], [{}], vectors[:1])
+    assert EmbeddingStore(str(tmp_path), dimension=8).ids()[-1] == "id6"
+
+
+def test_local_index_skips_deleted_rows_and_follows_compaction(tmp_path):
+    index = LocalVectorIndex(dimension=8, store=EmbeddingStore(str(tmp_path), dimension=8))
+    ids, contents, metadatas, vectors = rows(20)
+    index.add(ids, contents, metadatas, vectors)
+
+    assert index.search(vectors[5], 1)[0]["id"] == "id5"
+    index.delete(["id5"])
+    assert "id5" not in [row["id"] for row in index.search(vectors[5], 20)]
+
+    # Compaction by another handle (e.g. the CLI) is picked up on the next search
+    EmbeddingStore(str(tmp_path), dimension=8).compact()
+    assert index.search(vectors[7], 1)[0]["id"] == "id7"
+    assert len(index) == 19
+
+
+def test_compact_cli(tmp_path, capsys):
+    store = EmbeddingStore(str(tmp_path), dimension=8)
+    store.append(*rows(3))
+    store.delete(["id2"])
+
+    assert store_cli(["compact", str(tmp_path)]) == 0
+    assert '"rows_after": 2' in capsys.readouterr().out
+    assert store_cli(["compact", str(tmp_path / "missing")]) == 1
+
+
+def live_row(store: EmbeddingStore, row_id: str) -> int:
+    rows = [row for row in range(len(store)) if store.id(row) == row_id and not store.deleted[row]]
+    assert len(rows) == 1
+    return rows[0]
+
+
+def test_update_metadata_appends_changed_rows_and_tombstones_the_old_ones(tmp_path):
+    store = EmbeddingStore(str(tmp_path), dimension=8)
+    ids, contents, metadatas, vectors = rows(4)
+    store.append(ids, contents, metadatas, vectors)
+    index_before = (tmp_path / store.generation / "index.bin").read_bytes()
+
+    updated = store.update_metadata(["id0", "id1"], [{"source": "s0.txt"}, {"source": "s1.txt", "tags": ["a"]}])
+    assert updated == 1
+    # Committed index entries keep their offset/length; only the deleted flag of id1 flipped
+    index_after = (tmp_path / store.generation / "index.bin").read_bytes()
+    assert len(index_after) == 5 * len(index_before) // 4
+    assert live_ids(store) == ["id0", "id2", "id3", "id1"]
+
+    reopened = EmbeddingStore(str(tmp_path), dimension=8)
+    row = live_row(reopened, "id1")
+    assert reopened.metadata(row) == {"source": "s1.txt", "tags": ["a"]}
+    assert reopened.content(row) == "chunk 1"
+    np.testing.assert_allclose(reopened.vectors[row], vectors[1], rtol=1e-6)
+    assert store.compact() == {"rows_before": 5, "rows_after": 4}
+    assert store.metadata(live_row(store, "id1")) == {"source": "s1.txt", "tags": ["a"]}
+
+
+def test_readers_see_metadata_updates_after_refresh(tmp_path):
+    writer = EmbeddingStore(str(tmp_path), dimension=8)
+    writer.append(*rows(3))
+    reader = EmbeddingStore(str(tmp_path), dimension=8)
+    old_row = live_row(reader, "id2")
+
+    writer.update_metadata(["id2"], [{"source": "new.txt"}])
+    # The reader's existing mapping still decodes the old record
+    assert reader.metadata(old_row) == {"source": "s0.txt"}
+    assert reader.refresh()
+    assert reader.metadata(live_row(reader, "id2")) == {"source": "new.txt"}
+
+
+def test_source_rows_follows_appends_deletes_and_compaction(tmp_path):
+    index = LocalVectorIndex(dimension=8, store=EmbeddingStore(str(tmp_path), dimension=8))
+    ids, contents, metadatas, vectors = rows(6)
+    index.add(ids[:4], contents[:4], metadatas[:4], vectors[:4])
+    assert index.source_rows("s0.txt") == [0, 2]
+
+    index.add(ids[4:], contents[4:], metadatas[4:], vectors[4:])
+    index.delete(["id2"])
+    assert index.source_rows("s0.txt") == [0, 4]
+    assert index.source_rows("missing.txt") == []
+
+    index.store.compact()
+    assert [index.store.id(row) for row in index.source_rows("s0.txt")] == ["id0", "id4"]
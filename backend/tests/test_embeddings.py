@@ -0,0 +1,134 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from app.embeddings import BatchingEmbedder, CachedEmbeddings
+
+from conftest import FakeEmbeddings
+
+
+class CountingEmbeddings(FakeEmbeddings):
+    def __init__(self):
+        super().__init__()
+        self.queries = []
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return super().embed_query(text)
+
+
+def test_repeated_queries_hit_the_lru_after_normalization():
+    base = CountingEmbeddings()
+    embeddings = CachedEmbeddings(base, max_entries=8)
+
+    first = embeddings.embed_query("what is  rag?")
+    assert embeddings.lookup("what is rag?") is not None
+    again = embeddings.embed_query("  what is rag? ")
+    np.testing.assert_allclose(again, first, rtol=1e-6)
+    assert base.queries == ["what is rag?"]
+    assert (embeddings.stats["hits"], embeddings.stats["misses"]) == (2, 1)
+    assert embeddings.describe()["memory_bytes"] == 384 * 4
+
+
+def test_least_recently_used_query_is_evicted():
+    embeddings = CachedEmbeddings(CountingEmbeddings(), max_entries=2)
+    embeddings.embed_query("a")
+    embeddings.embed_query("b")
+    embeddings.embed_query("a")
+    embeddings.embed_query("c")
+
+    assert embeddings.lookup("b") is None
+    assert embeddings.lookup("a") is not None and embeddings.lookup("c") is not None
+    assert embeddings.stats["evictions"] == 1
+
+
+def test_zero_entries_disables_the_cache():
+    base = CountingEmbeddings()
+    embeddings = CachedEmbeddings(base, max_entries=0)
+    embeddings.embed_query("a")
+    embeddings.embed_query("a")
+    assert base.queries == ["a", "a"]
+    assert embeddings.describe()["entries"] == 0
+
+
+def test_embed_queries_embeds_each_distinct_miss_once():
+    base = CountingEmbeddings()
+    embeddings = CachedEmbeddings(base)
+    embeddings.embed_query("known")
+
+    vectors = embeddings.embed_queries(["new", "known", "new ", "other"])
+    assert base.queries == ["known", "new", "other"]
+    np.testing.assert_allclose(vectors[0], vectors[2], rtol=1e-6)
+    np.testing.assert_allclose(vectors[1], FakeEmbeddings.vector("known"), rtol=1e-6)
+
+
+class RecordingCache(CachedEmbeddings):
+    """Records the texts of every batched inference"""
+
+    def __init__(self, base, **kwargs):
+        super().__init__(base, **kwargs)
+        self.batches = []
+
+    def embed_queries(self, texts):
+        self.batches.append(list(texts))
+        return super().embed_queries(texts)
+
+
+def run_batching(texts, **kwargs):
+    embeddings = RecordingCache(CountingEmbeddings())
+
+    async def scenario():
+        with ThreadPoolExecutor(2) as executor:
+            batcher = BatchingEmbedder(embeddings, executor, **kwargs)
+            vectors = await asyncio.gather(*(batcher.embed(text) for text in texts))
+            return batcher, vectors
+
+    batcher, vectors = asyncio.run(scenario())
+    return embeddings, batcher, vectors
+
+
+def test_concurrent_queries_are_embedded_as_one_batch():
+    texts = [f"question {i}" for i in range(5)]
+    embeddings, batcher, vectors = run_batching(texts, max_batch_size=32, max_wait_ms=20)
+
+    assert embeddings.batches == [texts]
+    assert batcher.describe()["batch_size_histogram"] == {5: 1}
+    for text, vector in zip(texts, vectors):
+        np.testing.assert_allclose(vector, FakeEmbeddings.vector(text), rtol=1e-6)
+
+
+def test_a_full_batch_is_flushed_without_waiting():
+    # Full batches go out at once instead of waiting for the 10 s timer
+    embeddings, batcher, _ = run_batching([f"q{i}" for i in range(4)], max_batch_size=2, max_wait_ms=10000)
+    assert [len(batch) for batch in embeddings.batches] == [2, 2]
+    assert batcher.stats["requests"] == 4
+
+
+def test_cached_queries_skip_the_batch():
+    embeddings = RecordingCache(CountingEmbeddings())
+    embeddings.embed_query("known")
+
+    async def scenario():
+        with ThreadPoolExecutor(1) as executor:
+            batcher = BatchingEmbedder(embeddings, executor, max_wait_ms=5)
+            await batcher.embed_many(["known", "new"])
+            return batcher
+
+    batcher = asyncio.run(scenario())
+    assert embeddings.batches == [["new"]]
+    assert batcher.stats["requests"] == 1
+
+
+def test_an_inference_error_reaches_every_request_in_the_batch():
+    class Failing(CountingEmbeddings):
+        def embed_query(self, text):
+            raise RuntimeError("onnx failed")
+
+    async def scenario():
+        with ThreadPoolExecutor(1) as executor:
+            batcher = BatchingEmbedder(CachedEmbeddings(Failing()), executor, max_wait_ms=5)
+            return await asyncio.gather(batcher.embed("a"), batcher.embed("b"), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert [str(result) for result in results] == ["onnx failed", "onnx failed"]
@@ -0,0 +1,148 @@
+import asyncio
+import io
+import json
+import os
+import threading
+
+import app.ingestion as ingestion
+from app.ingest_jobs import IngestJobManager
+from app.resources import close_after_grace, get_resources, rebuild_resources
+from app.semantic_cache import SemanticCache
+
+from conftest import FakeEmbeddings
+
+
+def document(paragraphs: int = 200) -> str:
+    return "\n\n".join(f"paragraph {i} " + "lorem ipsum dolor sit amet " * (5 + i % 20)
+                       for i in range(paragraphs))
+
+
+def expected_chunks(text: str):
+    splitter = ingestion.StreamingTextSplitter(chunk_size=1000, chunk_overlap=200)
+    return splitter.feed(text) + splitter.finish()
+
+
+def live_contents(source: str = "doc.txt"):
+    index = get_resources().local_index
+    return sorted(index.store.content(row) for row in index.source_rows(source))
+
+
+def gate_embedding(monkeypatch, after_batches: int) -> threading.Event:
+    """Block every embedding batch after the first ``after_batches`` until the event is set"""
+    gate = threading.Event()
+    calls = [0]
+    embed_batch = ingestion.embed_batch
+
+    def gated(resources, docs):
+        calls[0] += 1
+        if calls[0] > after_batches:
+            gate.wait(10)
+        return embed_batch(resources, docs)
+
+    monkeypatch.setattr(ingestion, "embed_batch", gated)
+    return gate
+
+
+async def wait_until(condition, timeout: float = 10):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "timed out"
+        await asyncio.sleep(0.01)
+
+
+def test_interrupted_job_resumes_after_last_committed_batch(rag_resources, monkeypatch):
+    jobs_path = rag_resources.config["ingest_jobs_path"]
+    text = document()
+    gate = gate_embedding(monkeypatch, after_batches=3)
+
+    async def interrupted():
+        manager = IngestJobManager(jobs_path)
+        await manager.start()
+        job = await manager.submit(io.BytesIO(text.encode()), "doc.txt", {"source": "doc.txt"})
+        await wait_until(lambda: job.committed_chunks > 0)
+        # Shutdown while later batches are still embedding
+        await manager.stop()
+        return job.id, job.committed_chunks
+
+    job_id, committed_first = asyncio.run(interrupted())
+    gate.set()
+    with open(os.path.join(jobs_path, job_id, "job.json")) as f:
+        state = json.load(f)
+    assert state["status"] == "running"
+    assert state["committed_chunks"] == committed_first
+    # A batch whose insert was in flight at shutdown finished and was counted
+    stored_first = len(live_contents())
+    assert stored_first == committed_first
+
+    async def resumed():
+        manager = IngestJobManager(jobs_path)
+        await manager.start()
+        job = manager.get(job_id)
+        await wait_until(lambda: job.finished)
+        await manager.stop()
+        return job
+
+    job = asyncio.run(resumed())
+    chunks = expected_chunks(text)
+    assert job.status == "completed"
+    assert job.attempts == 2
+    # The resumed attempt matched the chunks stored before the restart by hash
+    assert job.progress.unchanged == stored_first
+    assert job.progress.chunks == len(chunks) - stored_first
+    assert job.committed_chunks == len(chunks)
+    assert live_contents() == sorted(chunks)
+    assert not os.path.exists(job.upload_path)
+
+
+def test_job_survives_a_resource_reload(rag_resources, monkeypatch):
+    text = document()
+    gate = gate_embedding(monkeypatch, after_batches=2)
+
+    async def scenario():
+        manager = IngestJobManager(rag_resources.config["ingest_jobs_path"])
+        await manager.start()
+        job = await manager.submit(io.BytesIO(text.encode()), "doc.txt", {"source": "doc.txt"})
+        await wait_until(lambda: job.committed_chunks > 0)
+        previous = get_resources()
+        await asyncio.to_thread(rebuild_resources)
+        # Grace period of 0: the executor the job started on is shut down now
+        await close_after_grace(previous)
+        gate.set()
+        await wait_until(lambda: job.finished)
+        await manager.stop()
+        return job
+
+    job = asyncio.run(scenario())
+    chunks = expected_chunks(text)
+    assert job.status == "completed", job.error
+    assert job.committed_chunks == len(chunks)
+    # Every batch is in the indexes of the live resources, none only in the discarded ones
+    assert get_resources() is not rag_resources
+    assert live_contents() == sorted(chunks)
+    get_resources().ingest_executor.shutdown(wait=True)
+
+
+def test_answer_cache_is_invalidated_after_every_committed_batch(rag_resources, monkeypatch):
+    cache = rag_resources.semantic_cache = SemanticCache()
+    question = FakeEmbeddings.vector("what is in the docs?")
+    gate = gate_embedding(monkeypatch, after_batches=2)
+
+    async def scenario():
+        cache.store(question, "what is in the docs?", {"response": "before the ingest"})
+        manager = IngestJobManager(rag_resources.config["ingest_jobs_path"])
+        await manager.start()
+        job = await manager.submit(io.BytesIO(document().encode()), "doc.txt", {"source": "doc.txt"})
+        await wait_until(lambda: job.committed_chunks > 0)
+        # Mid-ingest: the old answer is gone, and one generated now is dropped by the next batch
+        assert cache.lookup(question) is None
+        version = cache.corpus_version
+        gate.set()
+        await wait_until(lambda: job.finished)
+        await manager.stop()
+        cache.store(question, "what is in the docs?", {"response": "half-ingested"}, corpus_version=version)
+        return job
+
+    job = asyncio.run(scenario())
+    assert job.status == "completed"
+    assert cache.lookup(question) is None
+    assert cache.stats["invalidations"] >= job.progress.batches
@@ -0,0 +1,116 @@
+import asyncio
+import io
+import itertools
+import time
+
+import numpy as np
+from fastapi.testclient import TestClient
+
+import app.main as main
+from app.ingestion import IngestProgress, StreamingTextSplitter, ingest_stream
+from app.local_index import normalize_rows
+
+from conftest import FakeEmbeddings
+
+
+def document(paragraphs, words: int = 30) -> str:
+    return "\n\n".join(f"paragraph {i} " + "lorem ipsum " * words for i in paragraphs)
+
+
+def split(text: str):
+    splitter = StreamingTextSplitter(chunk_size=1000, chunk_overlap=200)
+    return splitter.feed(text) + splitter.finish()
+
+
+def ingest(text: str, source: str = "doc.txt", **metadata) -> IngestProgress:
+    data = io.BytesIO(text.encode())
+
+    async def read(size: int) -> bytes:
+        return data.read(size)
+
+    progress = IngestProgress(source, len(data.getvalue()))
+    return asyncio.run(ingest_stream(read, {"source": source, **metadata}, progress))
+
+
+def live_rows(resources, source: str = "doc.txt"):
+    store = resources.local_index.store
+    return [(store.content(row), store.metadata(row)) for row in resources.local_index.source_rows(source)]
+
+
+def test_reingesting_unchanged_text_embeds_nothing(rag_resources):
+    text = document(range(40))
+    first = ingest(text)
+    embedded = FakeEmbeddings.embedded_texts
+    assert first.chunks == len(split(text)) > 1
+
+    second = ingest(text)
+    assert (second.chunks, second.unchanged, second.deleted) == (0, first.chunks, 0)
+    assert FakeEmbeddings.embedded_texts == embedded
+    assert len(live_rows(rag_resources)) == first.chunks
+
+
+def test_edited_text_stores_only_new_chunks_and_drops_vanished_ones(rag_resources):
+    ingest(document(range(40)))
+    ingest(document(range(5)), source="other.txt")
+    embedded = FakeEmbeddings.embedded_texts
+
+    edited = document([*range(20), *range(100, 110), *range(30, 40)])
+    progress = ingest(edited)
+    chunks = split(edited)
+    assert 0 < progress.chunks < len(chunks)
+    assert progress.unchanged + progress.chunks == len(chunks)
+    assert progress.deleted > 0
+    assert FakeEmbeddings.embedded_texts - embedded == progress.chunks
+    assert sorted(content for content, _ in live_rows(rag_resources)) == sorted(chunks)
+    # Other sources are untouched
+    assert len(live_rows(rag_resources, "other.txt")) == len(split(document(range(5))))
+
+
+def test_new_metadata_is_applied_to_unchanged_chunks(rag_resources):
+    text = document(range(20))
+    first = ingest(text, tags=["draft"], ingested_at="2026-01-01T00:00:00Z")
+    progress = ingest(text, tags=["final"], ingested_at="2026-02-01T00:00:00Z")
+
+    assert (progress.chunks, progress.updated) == (0, first.chunks)
+    for _, metadata in live_rows(rag_resources):
+        assert metadata["tags"] == ["final"] and metadata["content_hash"]
+        # The text has not changed since it was first ingested
+        assert metadata["ingested_at"] == "2026-01-01T00:00:00Z"
+    # A later upload of the same file only differs in ingested_at: nothing is rewritten
+    assert ingest(text, tags=["final"], ingested_at="2026-03-01T00:00:00Z").updated == 0
+
+
+def test_rows_without_a_stored_hash_are_matched_by_content(rag_resources):
+    chunks = split(document(range(20)))
+    vectors = normalize_rows(np.array([FakeEmbeddings.vector(chunk) for chunk in chunks]), 384)
+    rag_resources.local_index.add([f"legacy{i}" for i in range(len(chunks))], chunks,
+                                  [{"source": "doc.txt"}] * len(chunks), vectors)
+
+    progress = ingest(document(range(20)))
+    assert (progress.chunks, progress.unchanged, progress.deleted) == (0, len(chunks), 0)
+    assert FakeEmbeddings.embedded_texts == 0
+
+
+def test_reuploading_an_unchanged_file_through_the_api_rewrites_nothing(rag_env, monkeypatch):
+    # Every upload gets its own ingested_at, even within the same second
+    timestamps = (f"2026-01-01T00:00:{second:02d}Z" for second in itertools.count())
+    monkeypatch.setattr(main, "format_timestamp", lambda: next(timestamps))
+    text = document(range(40))
+
+    def upload(client):
+        job = client.post("/api/ingest", files={"file": ("doc.txt", text.encode())},
+                          data={"tags": "faq"}).json()
+        deadline = time.monotonic() + 10
+        while True:
+            status = client.get(job["status_url"]).json()
+            if status["status"] in ("completed", "failed") or time.monotonic() > deadline:
+                return status
+            time.sleep(0.01)
+
+    with TestClient(main.app) as client:
+        first = upload(client)
+        second = upload(client)
+    assert first["status"] == second["status"] == "completed"
+    progress = second["progress"]
+    assert (progress["chunks"], progress["unchanged"], progress["updated"], progress["deleted"]) == (
+        0, first["progress"]["chunks"], 0, 0)
@@ -0,0 +1,68 @@
+import math
+
+import pytest
+
+from app.lexical_index import BM25Index, tokenize
+
+
+def test_identifiers_are_indexed_whole_and_by_their_parts():
+    assert tokenize("What is error E-1042 in v1.2.3?") == ["error", "e-1042", "e", "1042", "v1.2.3", "v1", "2", "3"]
+
+
+def test_search_ranks_by_bm25_and_skips_rows_without_query_terms():
+    index = BM25Index()
+    index.add(["a", "b", "c"], ["error x-200 on startup", "startup is slow", "unrelated text"], [{}] * 3)
+
+    rows = index.search("x-200 startup", 10)
+    assert [row["id"] for row in rows] == ["a", "b"]
+    assert rows[0]["bm25"] > rows[1]["bm25"] > 0
+    assert set(rows[0]) == {"id", "content", "metadata", "bm25"}
+    assert index.search("nothing matches", 10) == []
+
+
+def test_deleted_rows_are_excluded_and_idf_counts_only_live_rows():
+    index = BM25Index()
+    index.add(["a", "b", "c", "d"], ["apple pie", "apple tart", "banana bread", "cherry cake"], [{}] * 4)
+    assert index.delete(["b", "b", "missing"]) == 1
+    assert index.delete(["b"]) == 0
+    assert len(index) == 3 and index.describe()["deleted_rows"] == 1
+
+    rows = index.search("apple", 10)
+    assert [row["id"] for row in rows] == ["a"]
+    # "apple" is now in 1 of 3 live rows; the deleted copy no longer lowers its idf
+    idf = math.log(1 + (3 - 1 + 0.5) / (1 + 0.5))
+    average_length = (2 + 2 + 2) / 3
+    norm = index.k1 * (1 - index.b + index.b * 2 / average_length)
+    assert rows[0]["bm25"] == pytest.approx(idf * (index.k1 + 1) / (1 + norm), rel=1e-5)
+
+
+def test_document_frequency_never_goes_negative_across_delete_and_readd():
+    index = BM25Index()
+    index.add(["a"], ["apple apple pie"], [{}])
+    index.delete(["a"])
+    index.delete(["a"])
+    assert index._df["apple"] == 0
+    assert index.search("apple", 10) == []
+
+    index.add(["a"], ["apple crumble"], [{}])
+    assert index._df["apple"] == 1
+    assert [row["content"] for row in index.search("apple", 10)] == ["apple crumble"]
+    assert all(count >= 0 for count in index._df.values())
+
+
+def test_filters_use_the_updated_metadata():
+    index = BM25Index()
+    index.add(["a", "b"], ["release notes v2", "release plan"], [{"source": "old.txt"}, {"source": "plan.txt"}])
+    index.update_metadata(["a"], [{"source": "notes.txt", "tags": ["faq"]}])
+
+    assert [row["id"] for row in index.search("release", 10, {"source": "notes.txt"})] == ["a"]
+    assert index.search("release", 10, {"source": "old.txt"}) == []
+    assert [row["id"] for row in index.search("release", 10, {"tags": ["faq"]})] == ["a"]
+
+
+def test_top_k_keeps_the_best_scores_in_order():
+    index = BM25Index()
+    index.add([f"id{i}" for i in range(20)], ["token " * (i + 1) + "filler " * 5 for i in range(20)], [{}] * 20)
+
+    rows = index.search("token", 3)
+    assert [row["id"] for row in rows] == ["id19", "id18", "id17"]
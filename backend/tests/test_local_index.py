@@ -0,0 +1,83 @@
+import json
+
+import numpy as np
+
+from app.local_index import LocalVectorIndex, normalize_rows
+
+
+def corpus(count: int, dimension: int = 16, seed: int = 0):
+    vectors = normalize_rows(np.random.default_rng(seed).standard_normal((count, dimension)), dimension)
+    ids = [f"id{i}" for i in range(count)]
+    return ids, [f"chunk {i}" for i in range(count)], [{"source": f"s{i % 3}.txt"} for i in range(count)], vectors
+
+
+def test_search_returns_the_exact_top_k_in_match_documents_shape():
+    ids, contents, metadatas, vectors = corpus(200)
+    index = LocalVectorIndex(dimension=16)
+    index.add(ids, contents, metadatas, vectors)
+    query = np.random.default_rng(1).standard_normal(16)
+
+    rows = index.search(query, 5)
+    expected = np.argsort(-(vectors @ (query / np.linalg.norm(query))))[:5]
+    assert [row["id"] for row in rows] == [f"id{i}" for i in expected]
+    assert set(rows[0]) == {"id", "content", "metadata", "similarity"}
+    assert rows[0]["content"] == f"chunk {expected[0]}"
+    similarities = [row["similarity"] for row in rows]
+    assert similarities == sorted(similarities, reverse=True)
+
+
+def test_search_many_matches_single_searches_and_k_beyond_the_corpus():
+    ids, contents, metadatas, vectors = corpus(30)
+    index = LocalVectorIndex(dimension=16)
+    index.add(ids, contents, metadatas, vectors)
+
+    queries = vectors[[3, 7]]
+    for batched, query in zip(index.search_many(queries, 4), queries):
+        single = index.search(query, 4)
+        assert [row["id"] for row in batched] == [row["id"] for row in single]
+        np.testing.assert_allclose([row["similarity"] for row in batched],
+                                   [row["similarity"] for row in single], rtol=1e-5)
+    assert len(index.search(vectors[0], 100)) == 30
+    assert index.search(vectors[3], 1)[0]["id"] == "id3"
+
+
+def test_rows_added_in_many_batches_and_deleted_rows():
+    index = LocalVectorIndex(dimension=16)
+    ids, contents, metadatas, vectors = corpus(3000)
+    for start in range(0, 3000, 700):
+        index.add(ids[start:start + 700], contents[start:start + 700], metadatas[start:start + 700],
+                  vectors[start:start + 700])
+    assert len(index) == 3000
+    assert index.search(vectors[2500], 1)[0]["id"] == "id2500"
+
+    assert index.delete(["id2500", "missing"]) == 1
+    assert "id2500" not in [row["id"] for row in index.search(vectors[2500], 10)]
+    assert index.describe()["deleted_rows"] == 1
+
+
+def test_load_from_supabase_pages_through_the_table():
+    ids, contents, metadatas, vectors = corpus(25)
+    table = [{"id": row_id, "content": content, "metadata": metadata,
+              # pgvector columns arrive as strings through PostgREST
+              "embedding": json.dumps(vector.tolist())}
+             for row_id, content, metadata, vector in zip(ids, contents, metadatas, vectors)]
+
+    class Query:
+        def select(self, columns):
+            return self
+
+        def range(self, start, end):
+            self.page = table[start:end + 1]
+            return self
+
+        def execute(self):
+            return type("Result", (), {"data": self.page})
+
+    client = type("Client", (), {"table": lambda self, name: Query()})()
+    index = LocalVectorIndex(dimension=16)
+    index.load_from_supabase(client, "documents", page_size=10)
+
+    assert len(index) == 25
+    top = index.search(vectors[24], 1)[0]
+    assert (top["id"], top["content"], top["metadata"]) == ("id24", "chunk 24", {"source": "s0.txt"})
+    assert abs(top["similarity"] - 1) < 1e-5
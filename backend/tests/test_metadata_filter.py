@@ -0,0 +1,108 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.local_index import filter_matches, metadata_matches
+from app.main import MetadataFilter
+from app.pipeline import run_rag_query
+
+from conftest import FakeLLM, index_texts
+
+METADATA = {"source": "a.txt", "tags": ["faq", "billing"], "page": 3, "draft": False,
+            "author": {"name": "ana", "teams": ["docs"]}, "ingested_at": "2026-02-01T00:00:00Z"}
+
+
+# Expected results follow Postgres jsonb containment: METADATA::jsonb @> pattern::jsonb
+@pytest.mark.parametrize("pattern, expected", [
+    ({}, True),
+    ({"source": "a.txt"}, True),
+    ({"source": "b.txt"}, False),
+    ({"missing": None}, False),
+    ({"tags": ["faq"]}, True),
+    ({"tags": ["billing", "faq"]}, True),
+    ({"tags": []}, True),
+    ({"tags": ["faq", "other"]}, False),
+    # A primitive is only contained in an array at the top level, never in a nested one
+    ({"tags": "faq"}, False),
+    ({"author": {"name": "ana"}}, True),
+    ({"author": {"teams": ["docs"]}}, True),
+    ({"author": {"name": "ana", "teams": ["ops"]}}, False),
+    ({"page": 3}, True),
+    ({"page": 3.0}, True),
+    ({"page": "3"}, False),
+    # jsonb booleans and numbers never compare equal
+    ({"draft": False}, True),
+    ({"draft": 0}, False),
+    ({"page": True}, False),
+])
+def test_metadata_matches_follows_jsonb_containment(pattern, expected):
+    assert metadata_matches(METADATA, pattern) is expected
+
+
+def test_boolean_metadata_is_not_matched_by_a_number():
+    assert metadata_matches({"flag": True}, {"flag": 1}) is False
+    assert metadata_matches({"flag": 1}, {"flag": True}) is False
+    assert metadata_matches({"flags": [True]}, {"flags": [1]}) is False
+    assert metadata_matches({"flag": True}, {"flag": True}) is True
+
+
+@pytest.mark.parametrize("after, before, expected", [
+    ("2026-02-01T00:00:00Z", None, True),    # after is inclusive
+    ("2026-02-01T00:00:01Z", None, False),
+    (None, "2026-02-01T00:00:00Z", False),   # before is exclusive
+    (None, "2026-02-01T00:00:01Z", True),
+    ("2026-01-01T00:00:00Z", "2026-03-01T00:00:00Z", True),
+])
+def test_ingested_range_bounds(after, before, expected):
+    metadata_filter = {key: value for key, value in
+                       (("$ingested_after", after), ("$ingested_before", before)) if value is not None}
+    assert filter_matches(METADATA, metadata_filter) is expected
+
+
+def test_rows_without_ingested_at_never_match_a_range():
+    assert filter_matches({"source": "a.txt"}, {"source": "a.txt"})
+    assert not filter_matches({"source": "a.txt"}, {"$ingested_after": "2000-01-01T00:00:00Z"})
+    assert not filter_matches({"ingested_at": None}, {"$ingested_before": "2100-01-01T00:00:00Z"})
+
+
+def test_only_the_range_keys_are_taken_out_of_containment():
+    # match_documents removes just these two keys; any other key is matched literally
+    assert filter_matches(METADATA, {"source": "a.txt", "$ingested_after": "2026-01-01T00:00:00Z"})
+    assert not filter_matches(METADATA, {"$other": 1})
+    assert filter_matches({**METADATA, "$other": 1}, {"$other": 1})
+
+
+def test_api_filter_becomes_the_retriever_filter():
+    tz = timezone(timedelta(hours=2))
+    metadata_filter = MetadataFilter(source="a.txt", tags=["faq"],
+                                     ingested_after=datetime(2026, 1, 1, 2, 0, tzinfo=tz),
+                                     ingested_before=datetime(2026, 3, 1))
+    assert metadata_filter.to_retriever_filter() == {
+        "source": "a.txt",
+        "tags": ["faq"],
+        "$ingested_after": "2026-01-01T00:00:00Z",
+        "$ingested_before": "2026-03-01T00:00:00Z",
+    }
+    assert MetadataFilter().to_retriever_filter() is None
+    assert MetadataFilter(tags=[]).to_retriever_filter() is None
+
+
+def test_filtered_query_retrieves_only_matching_chunks(rag_resources):
+    rag_resources.llm = FakeLLM()
+    texts = [f"notes on topic {i}" for i in range(12)]
+    index_texts(rag_resources, texts, [
+        {"source": "a.txt" if i % 2 else "b.txt", "tags": ["faq"] if i % 3 == 0 else [],
+         "ingested_at": f"2026-01-{i + 1:02d}T00:00:00Z"}
+        for i in range(12)
+    ])
+
+    def sources(metadata_filter):
+        result = asyncio.run(run_rag_query(rag_resources, "notes on topic 3", metadata_filter))
+        assert result["chunks"]
+        return [chunk["metadata"] for chunk in result["chunks"]]
+
+    assert {metadata["source"] for metadata in sources({"source": "a.txt"})} == {"a.txt"}
+    assert all("faq" in metadata["tags"] for metadata in sources({"tags": ["faq"]}))
+    dated = sources({"$ingested_after": "2026-01-06T00:00:00Z", "$ingested_before": "2026-01-09T00:00:00Z"})
+    assert sorted(metadata["ingested_at"][8:10] for metadata in dated) == ["06", "07", "08"]
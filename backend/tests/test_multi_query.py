@@ -0,0 +1,68 @@
+import asyncio
+
+from app.pipeline import embed_variants, fuse_rankings, query_variants, retrieve_variants, run_rag_query, to_chunks
+
+from conftest import FakeLLM, index_texts
+
+COMPOUND = "How do I reset my password and where is the billing page?"
+
+
+def test_variants_are_the_question_extras_keywords_and_compound_parts(rag_resources):
+    rag_resources.config["multi_query_max_variants"] = 10
+    variants = query_variants(rag_resources, COMPOUND, ["password reset steps"])
+    assert variants == [
+        COMPOUND,
+        "password reset steps",
+        "do reset my password billing page",
+        "How do I reset my password",
+        "where is the billing page",
+    ]
+
+
+def test_variants_are_deduplicated_and_capped(rag_resources):
+    rag_resources.config["multi_query_max_variants"] = 10
+    # Whitespace and case differences are not new variants; neither are short parts
+    variants = query_variants(rag_resources, "reset password", ["  Reset   PASSWORD ", "reset password"])
+    assert variants == ["reset password"]
+
+    rag_resources.config["multi_query_max_variants"] = 2
+    assert query_variants(rag_resources, COMPOUND, ["password reset steps"]) == [COMPOUND, "password reset steps"]
+
+
+def test_retrieve_variants_fuses_what_each_variant_finds(rag_resources):
+    texts = [f"notes on topic {i}" for i in range(20)]
+    index_texts(rag_resources, texts)
+    queries = [texts[4], texts[11]]
+
+    async def retrieve():
+        embeddings = await embed_variants(rag_resources, queries)
+        return await retrieve_variants(rag_resources, queries, embeddings, k=4)
+
+    fused, timings = asyncio.run(retrieve())
+    # Every variant over-fetches multi_query_candidates rows, then the lists are rank-fused
+    candidates = rag_resources.config["multi_query_candidates"]
+    rankings = [to_chunks(rag_resources.local_index.search(rag_resources.embeddings.embed_query(query), candidates))
+                for query in queries]
+    assert [chunk["id"] for chunk in fused] == [chunk["id"] for chunk in fuse_rankings(rankings, 4)]
+    assert [ranking[0]["content"] for ranking in rankings] == queries
+    assert [timing["query"] for timing in timings] == queries
+    assert all(timing["results"] > 0 and timing["retrieval_ms"] >= 0 for timing in timings)
+
+    single, no_timings = asyncio.run(retrieve_variants(rag_resources, [texts[4]],
+                                                       [rag_resources.embeddings.embed_query(texts[4])], k=4))
+    assert single[0]["content"] == texts[4] and no_timings is None
+
+
+def test_query_reports_variants_only_when_multi_query_is_on(rag_resources):
+    rag_resources.llm = FakeLLM()
+    index_texts(rag_resources, [f"notes on topic {i}" for i in range(10)])
+
+    plain = asyncio.run(run_rag_query(rag_resources, COMPOUND))
+    assert plain["variants"] is None
+    multi = asyncio.run(run_rag_query(rag_resources, COMPOUND, multi_query=True))
+    assert [timing["query"] for timing in multi["variants"]] == query_variants(rag_resources, COMPOUND)
+    # Caller-supplied variants imply multi-query
+    extra = asyncio.run(run_rag_query(rag_resources, "notes on topic 2", variants=["topic 2 notes"]))
+    assert [timing["query"] for timing in extra["variants"]][:2] == ["notes on topic 2", "topic 2 notes"]
+    # Every query still generates once, from the fused chunks
+    assert len(rag_resources.llm.prompts) == 3
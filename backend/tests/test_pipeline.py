@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+from app.pipeline import fuse_rankings, reciprocal_rank_fusion, run_rag_batch
+
+from conftest import FakeLLM, index_texts
+
+
+def chunk(chunk_id, similarity=0.5, **extra):
+    return {"id": chunk_id, "content": f"text {chunk_id}", "metadata": {}, "similarity": similarity, **extra}
+
+
+def run_batch(resources, questions, max_parallel=1, **kwargs):
+    async def collect():
+        return [item async for item in run_rag_batch(resources, questions, max_parallel, **kwargs)]
+    return asyncio.run(collect())
+
+
+def test_batch_answers_a_repeated_prompt_once(rag_resources):
+    llm = rag_resources.llm = FakeLLM(delay=0.01)
+    index_texts(rag_resources, [f"document about topic {i}" for i in range(10)])
+    # The copy sits more than max_parallel positions after the first one
+    questions = ["what is rag?", "q1", "q2", "q3", "q4", "what is rag?"]
+
+    results = run_batch(rag_resources, questions)
+    assert len(llm.prompts) == 5
+    assert sorted(index for index, _ in results) == list(range(6))
+    by_index = dict(results)
+    assert by_index[5]["response"] == by_index[0]["response"]
+    assert (by_index[0]["coalesced"], by_index[5]["coalesced"]) == (False, True)
+
+
+def test_fuse_rankings_orders_by_summed_reciprocal_rank():
+    first = [chunk("a", 0.9), chunk("b", 0.8), chunk("c", 0.7)]
+    second = [chunk("c", 0.95), chunk("d", 0.6), chunk("a", 0.5)]
+
+    fused = fuse_rankings([first, second], k=10, rrf_k=60)
+    # a: 1/61 + 1/63, c: 1/63 + 1/61 (tie, first seen wins), b: 1/62, d: 1/62
+    assert [entry["id"] for entry in fused] == ["a", "c", "b", "d"]
+    assert fused[0]["rrf_score"] == pytest.approx(1 / 61 + 1 / 63)
+    # A chunk found by several rankings keeps its best similarity
+    assert (fused[0]["similarity"], fused[1]["similarity"]) == (0.9, 0.95)
+    assert [entry["id"] for entry in fuse_rankings([first, second], k=2)] == ["a", "c"]
+
+
+def test_rank_agreement_beats_a_single_top_rank():
+    fused = fuse_rankings([[chunk("solo"), chunk("both")], [chunk("other"), chunk("both")]], k=3)
+    assert fused[0]["id"] == "both"
+
+
+def test_reciprocal_rank_fusion_merges_dense_and_lexical_hits():
+    dense = [chunk("a", 0.9), chunk("b", 0.8)]
+    lexical = [{"id": "c", "content": "text c", "metadata": {}, "bm25": 7.0},
+               {"id": "b", "content": "text b", "metadata": {}, "bm25": 3.0}]
+
+    fused = reciprocal_rank_fusion(dense, lexical, k=10, rrf_k=60)
+    assert [entry["id"] for entry in fused] == ["b", "a", "c"]
+    by_id = {entry["id"]: entry for entry in fused}
+    assert by_id["b"]["rrf_score"] == pytest.approx(1 / 62 + 1 / 62)
+    assert (by_id["a"]["bm25"], by_id["b"]["bm25"], by_id["c"]["bm25"]) == (None, 3.0, 7.0)
+    # Lexical-only hits get no cosine score
+    assert by_id["c"]["similarity"] == 0.0
@@ -0,0 +1,76 @@
+import numpy as np
+import pytest
+
+from app.embedding_store import EmbeddingStore
+from app.local_index import LocalVectorIndex, normalize_rows
+from app.quantization import ProductQuantizer, ScalarQuantizer, make_quantizer
+
+DIMENSION = 32
+
+
+def clustered(rows: int, seed: int = 0) -> np.ndarray:
+    # Same shape of corpus as benchmarks.quantization_benchmark: topics, not uniform noise
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((20, DIMENSION)).astype(np.float32)
+    vectors = centers[rng.integers(0, 20, rows)] + 0.6 * rng.standard_normal((rows, DIMENSION)).astype(np.float32)
+    return normalize_rows(vectors, DIMENSION)
+
+
+def recall(found, expected) -> float:
+    return np.mean([len(set(f) & set(e)) / len(e) for f, e in zip(found, expected)])
+
+
+def exact_top(vectors: np.ndarray, queries: np.ndarray, k: int):
+    return [list(np.argsort(-(vectors @ query))[:k]) for query in queries]
+
+
+@pytest.mark.parametrize("quantizer, minimum", [
+    (ScalarQuantizer(DIMENSION), 0.9),
+    (ProductQuantizer(DIMENSION, subspaces=8), 0.5),
+])
+def test_approximate_scores_rank_close_to_exact_search(quantizer, minimum):
+    vectors, queries = clustered(3000), clustered(50, seed=1)
+    quantizer.fit(vectors)
+    codes = quantizer.encode(vectors)
+    assert codes.dtype == quantizer.code_dtype and codes.shape == (3000, quantizer.code_bytes())
+
+    found = [list(np.argsort(-quantizer.scores(codes, query))[:10]) for query in queries]
+    assert recall(found, exact_top(vectors, queries, 10)) >= minimum
+
+
+@pytest.mark.parametrize("kind", ["int8", "pq"])
+def test_quantized_index_search_recalls_the_exact_top_k(tmp_path, kind):
+    vectors, queries = clustered(3000), clustered(50, seed=1)
+    index = LocalVectorIndex(DIMENSION, store=EmbeddingStore(str(tmp_path), dimension=DIMENSION),
+                             quantization=kind, quantize_min_rows=100, rerank_factor=10, pq_subspaces=8)
+    index.add([f"id{i}" for i in range(3000)], [f"chunk {i}" for i in range(3000)],
+              [{"source": "doc.txt"}] * 3000, vectors)
+
+    found = [[int(row["id"][2:]) for row in rows] for rows in index.search_many(queries, 10)]
+    assert index.describe()["quantization"] == kind
+    assert recall(found, exact_top(vectors, queries, 10)) >= 0.9
+    # Shortlisted rows are rescored exactly
+    top = index.search(queries[0], 1)[0]
+    assert top["similarity"] == pytest.approx(float(vectors[int(top["id"][2:])] @ queries[0]), rel=1e-5)
+
+
+def test_codebook_is_saved_with_the_store_and_reused(tmp_path):
+    vectors = clustered(500)
+    store_path = str(tmp_path)
+    index = LocalVectorIndex(DIMENSION, store=EmbeddingStore(store_path, dimension=DIMENSION),
+                             quantization="pq", quantize_min_rows=100, pq_subspaces=8)
+    index.add([f"id{i}" for i in range(500)], [""] * 500, [{}] * 500, vectors)
+    index.search(vectors[0], 5)
+
+    reopened = LocalVectorIndex(DIMENSION, store=EmbeddingStore(store_path, dimension=DIMENSION),
+                                quantization="pq", quantize_min_rows=100, pq_subspaces=8)
+    np.testing.assert_array_equal(reopened.quantizer.codebooks, index.quantizer.codebooks)
+    np.testing.assert_array_equal(reopened._codes, index._codes)
+
+
+def test_quantization_needs_a_memory_mapped_store():
+    assert make_quantizer("none", DIMENSION) is None
+    with pytest.raises(ValueError):
+        make_quantizer("int4", DIMENSION)
+    index = LocalVectorIndex(DIMENSION, quantization="int8", quantize_min_rows=1)
+    assert index.quantizer is None
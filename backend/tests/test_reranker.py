@@ -0,0 +1,104 @@
+import asyncio
+import gc
+import threading
+import time
+
+import pytest
+
+import app.reranker as reranker
+from app.reranker import CrossEncoderReranker
+
+
+class StubCrossEncoder:
+    """Stands in for fastembed's ``TextCrossEncoder``: scores by query-word overlap"""
+
+    def __init__(self, model_name=None, delay: float = 0.0, error: Exception = None):
+        self.model_name = model_name
+        self.delay = delay
+        self.error = error
+        self.batches = []
+        self.finished = threading.Event()
+
+    def rerank(self, query, documents, batch_size=64):
+        self.batches.append(list(documents))
+        time.sleep(self.delay)
+        self.finished.set()
+        if self.error is not None:
+            raise self.error
+        words = set(query.split())
+        return [float(len(words & set(document.split()))) for document in documents]
+
+
+@pytest.fixture
+def make_reranker(monkeypatch):
+    monkeypatch.setattr(reranker, "TextCrossEncoder", StubCrossEncoder, raising=False)
+    made = []
+
+    def make(budget_ms: float = 1000.0, batch_size: int = 2, **stub):
+        instance = CrossEncoderReranker("stub", batch_size=batch_size, budget_ms=budget_ms)
+        instance.model = StubCrossEncoder(**stub)
+        made.append(instance)
+        return instance
+
+    yield make
+    for instance in made:
+        instance.executor.shutdown(wait=True)
+
+
+def chunks(*contents):
+    return [{"id": f"c{i}", "content": content, "metadata": {}, "similarity": 0.5}
+            for i, content in enumerate(contents)]
+
+
+def test_chunks_are_reordered_by_cross_encoder_score(make_reranker):
+    instance = make_reranker(batch_size=2)
+    candidates = chunks("weather report", "reset your password here", "password policy", "billing page")
+
+    ranked, info = asyncio.run(instance.rerank("reset password", candidates, k=3))
+    assert [chunk["id"] for chunk in ranked] == ["c1", "c2", "c0"]
+    assert [chunk["rerank_score"] for chunk in ranked] == [2.0, 1.0, 0.0]
+    assert info["fallback"] is None and info["candidates"] == 4
+    # Scored in batches of batch_size
+    assert [len(batch) for batch in instance.model.batches] == [2, 2]
+
+
+def test_budget_overrun_falls_back_to_retrieval_order(make_reranker):
+    instance = make_reranker(budget_ms=20, batch_size=1, delay=0.2)
+    candidates = chunks("weather report", "reset your password here", "password policy")
+
+    start = time.monotonic()
+    ranked, info = asyncio.run(instance.rerank("reset password", candidates, k=2))
+    # Returned at the budget, without waiting for the batch in progress
+    assert time.monotonic() - start < 0.2
+    assert [chunk["id"] for chunk in ranked] == ["c0", "c1"]
+    assert "rerank_score" not in ranked[0]
+    assert info["fallback"] == "budget_exceeded"
+    assert instance.stats["budget_exceeded"] == 1
+    # The scoring thread stops at the deadline instead of finishing every batch
+    instance.executor.shutdown(wait=True)
+    assert len(instance.model.batches) == 1
+
+
+def test_scoring_error_keeps_retrieval_order(make_reranker):
+    instance = make_reranker(error=RuntimeError("onnx failed"))
+    ranked, info = asyncio.run(instance.rerank("reset password", chunks("a", "b", "c"), k=2))
+    assert [chunk["id"] for chunk in ranked] == ["c0", "c1"]
+    assert info["fallback"] == "error" and instance.stats["errors"] == 1
+
+
+def test_abandoned_scoring_failure_is_not_reported_as_unretrieved(make_reranker):
+    instance = make_reranker(budget_ms=10, delay=0.05, error=RuntimeError("onnx failed"))
+    reported = []
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        loop.set_exception_handler(lambda loop, context: reported.append(context["message"]))
+        _, info = await instance.rerank("reset password", chunks("a", "b"), k=2)
+        assert info["fallback"] == "budget_exceeded"
+        # Let the abandoned call fail after the request has moved on
+        await asyncio.to_thread(instance.model.finished.wait, 5)
+        await asyncio.sleep(0.05)
+        gc.collect()
+
+    asyncio.run(scenario())
+    assert reported == []
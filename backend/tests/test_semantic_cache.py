@@ -0,0 +1,80 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+from app.pipeline import answer_cache
+from app.semantic_cache import SemanticCache
+
+from conftest import FakeEmbeddings
+
+
+def near(vector, noise: float, seed: int = 0):
+    """``vector`` plus a random perturbation of norm ``noise``"""
+    offset = np.random.default_rng(seed).standard_normal(len(vector))
+    return (np.asarray(vector) + noise * offset / np.linalg.norm(offset)).tolist()
+
+
+def test_lookup_hits_only_above_the_threshold():
+    cache = SemanticCache(threshold=0.95)
+    question = FakeEmbeddings.vector("what is rag?")
+    cache.store(question, "what is rag?", {"response": "retrieval augmented generation"})
+
+    hit = cache.lookup(near(question, 0.1))
+    assert hit["response"] == "retrieval augmented generation"
+    assert hit["cache"]["similarity"] > 0.95
+    assert hit["cache"]["cached_question"] == "what is rag?"
+    assert cache.lookup(near(question, 0.6)) is None
+    assert cache.lookup(FakeEmbeddings.vector("something else entirely")) is None
+    assert (cache.stats["hits"], cache.stats["misses"]) == (1, 2)
+
+
+def test_answers_generated_across_a_corpus_change_are_not_stored():
+    cache = SemanticCache()
+    question = FakeEmbeddings.vector("q")
+    cache.store(question, "q", {"response": "old"})
+    version = cache.corpus_version
+
+    cache.invalidate()
+    assert cache.lookup(question) is None
+    cache.store(question, "q", {"response": "stale"}, corpus_version=version)
+    assert cache.lookup(question) is None
+    cache.store(question, "q", {"response": "fresh"}, corpus_version=cache.corpus_version)
+    assert cache.lookup(question)["response"] == "fresh"
+
+
+def test_filtered_queries_bypass_the_cache():
+    cache = SemanticCache()
+    resources = SimpleNamespace(semantic_cache=cache)
+    assert answer_cache(resources) is cache
+    assert answer_cache(resources, {}) is cache
+    assert answer_cache(resources, {"source": "a.txt"}) is None
+
+
+def test_entries_expire_and_are_evicted():
+    cache = SemanticCache(max_entries=2, ttl_seconds=60)
+    vectors = [FakeEmbeddings.vector(f"q{i}") for i in range(3)]
+    for i, vector in enumerate(vectors):
+        cache.store(vector, f"q{i}", {"response": str(i)})
+    assert cache.lookup(vectors[0]) is None
+    assert cache.stats["evictions"] == 1
+
+    for entry in cache._entries.values():
+        entry["created_at"] -= 120
+    assert cache.lookup(vectors[2]) is None
+    assert cache.describe()["entries"] == 0
+
+
+def test_pickle_persistence_restores_entries_and_corpus_version(tmp_path):
+    path = str(tmp_path / "semantic_cache.pkl")
+    cache = SemanticCache(persist_path=path)
+    cache.invalidate()
+    question = FakeEmbeddings.vector("q")
+    cache.store(question, "q", {"response": "kept", "sources": [{"id": "1"}]})
+    cache.save()
+
+    reloaded = SemanticCache(persist_path=path)
+    assert reloaded.corpus_version == 1
+    assert reloaded.lookup(question)["sources"] == [{"id": "1"}]
+    # A corrupt file is ignored rather than failing startup
+    (tmp_path / "semantic_cache.pkl").write_bytes(b"not a pickle")
+    assert SemanticCache(persist_path=path).describe()["entries"] == 0
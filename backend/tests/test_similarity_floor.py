@@ -0,0 +1,76 @@
+import asyncio
+
+from prometheus_client import REGISTRY
+
+from app.pipeline import lacks_relevant_context, run_rag_batch, run_rag_query, stream_rag_query
+
+from conftest import FakeLLM, index_texts
+
+TEXTS = [f"notes on topic {i}" for i in range(10)]
+
+
+def skipped_total() -> float:
+    return REGISTRY.get_sample_value("rag_generation_skipped_total") or 0.0
+
+
+def with_floor(resources, floor: float) -> FakeLLM:
+    resources.config["similarity_floor"] = floor
+    resources.llm = FakeLLM()
+    index_texts(resources, TEXTS)
+    return resources.llm
+
+
+def test_lacks_relevant_context_compares_the_best_chunk_with_the_floor(rag_resources):
+    chunks = [{"similarity": 0.3}, {"similarity": 0.6}]
+    rag_resources.config["similarity_floor"] = 0.5
+    assert not lacks_relevant_context(rag_resources, chunks)
+    rag_resources.config["similarity_floor"] = 0.7
+    assert lacks_relevant_context(rag_resources, chunks)
+    # Floor 0 (the default) never skips, but nothing retrieved always does
+    rag_resources.config["similarity_floor"] = 0
+    assert not lacks_relevant_context(rag_resources, [{"similarity": -0.2}])
+    assert lacks_relevant_context(rag_resources, [])
+
+
+def test_query_below_the_floor_is_answered_without_the_llm(rag_resources):
+    llm = with_floor(rag_resources, 0.5)
+    before = skipped_total()
+
+    result = asyncio.run(run_rag_query(rag_resources, "something the corpus never mentions"))
+    assert llm.prompts == []
+    assert result["skipped_generation"] is True
+    assert result["response"] == rag_resources.config["no_context_response"]
+    assert result["chunks"] and max(chunk["similarity"] for chunk in result["chunks"]) < 0.5
+    assert skipped_total() == before + 1
+
+    # A question that matches a chunk still reaches the LLM
+    result = asyncio.run(run_rag_query(rag_resources, TEXTS[3]))
+    assert len(llm.prompts) == 1 and TEXTS[3] in llm.prompts[0]
+    assert "skipped_generation" not in result
+
+
+def test_streamed_query_below_the_floor_skips_generation(rag_resources):
+    llm = with_floor(rag_resources, 0.5)
+
+    async def collect():
+        return [event async for event in stream_rag_query(rag_resources, "something the corpus never mentions")]
+
+    events = asyncio.run(collect())
+    assert [name for name, _ in events] == ["sources", "token", "done"]
+    assert events[0][1]["skipped_generation"] is True
+    assert events[1][1]["token"] == rag_resources.config["no_context_response"]
+    assert events[2][1]["skipped_generation"] is True
+    assert llm.prompts == []
+
+
+def test_batch_only_generates_for_prompts_above_the_floor(rag_resources):
+    llm = with_floor(rag_resources, 0.5)
+
+    async def collect():
+        return dict([item async for item in run_rag_batch(
+            rag_resources, [TEXTS[1], "something the corpus never mentions", TEXTS[2]], 2)])
+
+    results = asyncio.run(collect())
+    assert len(llm.prompts) == 2
+    assert results[1]["skipped_generation"] is True
+    assert not results[0].get("skipped_generation") and not results[2].get("skipped_generation")
@@ -0,0 +1,73 @@
+import asyncio
+
+import pytest
+
+from app.singleflight import SingleFlight
+
+
+def test_concurrent_calls_with_the_same_key_share_one_execution():
+    calls = []
+
+    async def work(key):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return {"answer": key}
+
+    async def scenario():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do(key, lambda key=key: work(key)) for key in "aaab"))
+        return flight, results
+
+    flight, results = asyncio.run(scenario())
+    assert calls == ["a", "b"]
+    assert [result.get("coalesced", False) for result in results] == [False, True, True, False]
+    assert results[1]["answer"] == results[0]["answer"] == "a"
+    assert flight.describe() == {"executions": 2, "coalesced": 2, "in_flight": 0}
+
+
+def test_sequential_calls_run_again():
+    async def scenario():
+        flight = SingleFlight()
+        for _ in range(2):
+            await flight.do("a", lambda: asyncio.sleep(0, result={"answer": 1}))
+        return flight
+
+    assert asyncio.run(scenario()).stats == {"executions": 2, "coalesced": 0}
+
+
+def test_an_exception_reaches_every_waiter():
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("ollama down")
+
+    async def scenario():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do("a", failing) for _ in range(3)), return_exceptions=True)
+        return flight, results
+
+    flight, results = asyncio.run(scenario())
+    assert all(isinstance(result, RuntimeError) and str(result) == "ollama down" for result in results)
+    assert flight.stats == {"executions": 1, "coalesced": 2}
+    assert flight.describe()["in_flight"] == 0
+
+
+def test_a_cancelled_caller_does_not_cancel_the_shared_execution():
+    async def scenario():
+        flight = SingleFlight()
+        started = asyncio.Event()
+
+        async def work():
+            started.set()
+            await asyncio.sleep(0.02)
+            return {"answer": 1}
+
+        leader = asyncio.ensure_future(flight.do("a", work))
+        await started.wait()
+        follower = asyncio.ensure_future(flight.do("a", work))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(scenario()) == {"answer": 1, "coalesced": True}
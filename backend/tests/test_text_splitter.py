@@ -0,0 +1,103 @@
+import asyncio
+import io
+import random
+
+import pytest
+from langchain_text_splitters import CharacterTextSplitter
+
+from app.ingestion import IngestProgress, StreamingTextSplitter, iter_decoded
+
+WORDS = ["lorem", "ipsum", "dolor", "sit", "amet", "naïve", "café", "straße", "日本語", "😀", "x-200"]
+
+
+def paragraph(rng: random.Random, max_chars: int) -> str:
+    text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, max_chars // 4 + 1)))
+    return text[:max_chars]
+
+
+def document(seed: int) -> str:
+    rng = random.Random(seed)
+    parts = []
+    for _ in range(rng.randint(5, 60)):
+        kind = rng.random()
+        if kind < 0.1:
+            parts.append("   ")          # whitespace-only paragraph
+        elif kind < 0.2:
+            parts.append("")             # run of blank lines
+        elif kind < 0.3:
+            parts.append(paragraph(rng, 2500))   # longer than chunk_size on its own
+        else:
+            parts.append(paragraph(rng, rng.choice([20, 150, 400, 900])))
+    # "\n\n\n" leaves a newline at the start of the next split, which the strip must absorb
+    separator = "\n\n\n" if seed % 3 == 0 else "\n\n"
+    return separator.join(parts)
+
+
+DOCUMENTS = [document(seed) for seed in range(12)] + [
+    "",
+    "\n\n",
+    "single paragraph without separators " * 20,
+    "\n\nleading and trailing separators\n\n",
+    "a\n\nb\n\nc",
+]
+
+
+def one_shot(text: str):
+    return CharacterTextSplitter(separator="\n\n", chunk_size=1000, chunk_overlap=200).split_text(text)
+
+
+def streamed(pieces):
+    splitter = StreamingTextSplitter(chunk_size=1000, chunk_overlap=200)
+    chunks = []
+    for piece in pieces:
+        chunks.extend(splitter.feed(piece))
+    return chunks + splitter.finish()
+
+
+def cut(text: str, next_size):
+    pieces, start = [], 0
+    while start < len(text):
+        size = next_size()
+        pieces.append(text[start:start + size])
+        start += size
+    return pieces
+
+
+@pytest.mark.parametrize("text", DOCUMENTS)
+def test_streamed_chunks_match_the_one_shot_splitter(text):
+    expected = one_shot(text)
+    assert streamed([text]) == expected
+    for size in (1, 2, 3, 7, 199, 1000, 4096):
+        assert streamed(cut(text, lambda: size)) == expected, size
+    rng = random.Random(len(text))
+    assert streamed(cut(text, lambda: rng.randint(1, 3000))) == expected
+
+
+def test_separator_split_across_pieces():
+    text = "first paragraph\n\nsecond paragraph\n\n\n\nthird"
+    for position in range(len(text)):
+        assert streamed([text[:position], text[position:]]) == one_shot(text), position
+
+
+@pytest.mark.parametrize("read_size", [1, 2, 3, 5, 4096])
+def test_read_buffer_edges_through_the_decoder(read_size):
+    # Separators and multi-byte characters straddle the read buffer edges
+    text = "\n\n".join([
+        "a" * (read_size - 1),
+        "é" * 700,
+        "日本語 " * 300,
+        "😀" * (read_size + 1),
+        "b" * 1200,
+        "tail",
+    ])
+    data = io.BytesIO(text.encode("utf-8"))
+
+    async def read(size: int) -> bytes:
+        return data.read(size)
+
+    async def decoded_pieces():
+        return [piece async for piece in iter_decoded(read, read_size, IngestProgress("doc.txt"))]
+
+    pieces = asyncio.run(decoded_pieces())
+    assert "".join(pieces) == text
+    assert streamed(pieces) == one_shot(text)
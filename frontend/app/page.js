@@ -31,10 +31,27 @@ export default function Home() {
       
       if (res.ok) {
         const data = await res.json();
-        setUploadStatus(`✅ ${data.message}`);
+        if (data.error) {
+          setUploadStatus(`❌ ${data.error}`);
+          return;
+        }
         setFile(null);
         // Reset file input
         document.getElementById("fileInput").value = "";
+        // Ingestion runs in the background; poll the job until it finishes
+        let job = { status: data.status, committed_chunks: 0, progress: {} };
+        while (job.status === "queued" || job.status === "running") {
+          setUploadStatus(`⏳ Processing ${file.name}: ${job.committed_chunks || 0} chunks stored` +
+            (job.progress.percent != null ? ` (${job.progress.percent}% read)` : ""));
+          await new Promise((resolve) => setTimeout(resolve, 1000));
+          const statusRes = await fetch(`http://localhost:8000${data.status_url}`);
+          job = await statusRes.json();
+        }
+        if (job.status === "completed") {
+          setUploadStatus(`✅ Successfully ingested ${file.name} (${job.committed_chunks} chunks)`);
+        } else {
+          setUploadStatus(`❌ Ingestion failed: ${job.error}`);
+        }
       } else {
         setUploadStatus("❌ Upload failed");
       }
@@ -6,6 +6,8 @@ create extension if not exists vector;
 -- This ensures compatibility with FastEmbed all-MiniLM-L6-v2 model (384 dimensions)
 DROP TABLE IF EXISTS documents CASCADE;
 DROP FUNCTION IF EXISTS match_documents(vector, int, jsonb);
+DROP FUNCTION IF EXISTS match_documents_batch(jsonb, int, jsonb);
+DROP FUNCTION IF EXISTS set_document_metadata(uuid[], jsonb);
 
 -- Create a table to store your documents
 create table documents (
@@ -15,7 +17,11 @@ create table documents (
   embedding vector(384) -- 384-dimensional vector for FastEmbed embeddings (all-MiniLM-L6-v2)
 );
 
--- Create a function to search for documents
+-- Create a function to search for documents.
+-- filter: metadata containment (e.g. {"source": "a.txt", "tags": ["faq"]}) plus
+-- the reserved keys "$ingested_after" (inclusive) and "$ingested_before"
+-- (exclusive), compared against metadata.ingested_at ("YYYY-MM-DDTHH:MM:SSZ",
+-- which sorts chronologically as text).
 create or replace function match_documents (
   query_embedding vector(384),
   match_count int DEFAULT null,
@@ -37,13 +43,102 @@ begin
     metadata,
     1 - (documents.embedding <=> query_embedding) as similarity
   from documents
-  where metadata @> filter
+  where metadata @> (filter - '$ingested_after' - '$ingested_before')
+    and (filter->>'$ingested_after' is null
+         or (metadata->>'ingested_at') collate "C" >= filter->>'$ingested_after')
+    and (filter->>'$ingested_before' is null
+         or (metadata->>'ingested_at') collate "C" < filter->>'$ingested_before')
   order by documents.embedding <=> query_embedding
   limit match_count;
 end;
 $$;
 
+-- Batched variant used by /api/prompt/batch: one round-trip for many queries.
+-- query_embeddings is a JSON array of 384-d arrays; rows are tagged with the
+-- zero-based index of the query they belong to.
+create or replace function match_documents_batch (
+  query_embeddings jsonb,
+  match_count int DEFAULT null,
+  filter jsonb DEFAULT '{}'
+) returns table (
+  query_index int,
+  id uuid,
+  content text,
+  metadata jsonb,
+  similarity float
+)
+language plpgsql
+as $$
+#variable_conflict use_column
+begin
+  return query
+  select
+    (q.ord - 1)::int as query_index,
+    m.id,
+    m.content,
+    m.metadata,
+    m.similarity
+  from jsonb_array_elements(query_embeddings) with ordinality as q(embedding, ord)
+  cross join lateral (
+    select
+      id,
+      content,
+      metadata,
+      1 - (documents.embedding <=> (q.embedding::text)::vector(384)) as similarity
+    from documents
+    where metadata @> (filter - '$ingested_after' - '$ingested_before')
+      and (filter->>'$ingested_after' is null
+           or (metadata->>'ingested_at') collate "C" >= filter->>'$ingested_after')
+      and (filter->>'$ingested_before' is null
+           or (metadata->>'ingested_at') collate "C" < filter->>'$ingested_before')
+    order by documents.embedding <=> (q.embedding::text)::vector(384)
+    limit match_count
+  ) m;
+end;
+$$;
+
+-- Re-ingest of a source: chunks whose text is unchanged keep their row and
+-- embedding but take the new upload's metadata (e.g. tags). Each row keeps
+-- its own content_hash (computed from the text if it has none yet) and its
+-- original ingested_at, so re-ingesting an unchanged file rewrites nothing.
+-- Returns the number of rows whose metadata actually changed.
+create or replace function set_document_metadata (
+  ids uuid[],
+  new_metadata jsonb
+) returns int
+language plpgsql
+as $$
+declare
+  updated int;
+begin
+  update documents d
+  set metadata = k.metadata
+  from (
+    select documents.id, new_metadata || jsonb_strip_nulls(jsonb_build_object(
+      'content_hash', coalesce(documents.metadata->>'content_hash',
+                               encode(sha256(convert_to(coalesce(documents.content, ''), 'UTF8')), 'hex')),
+      'ingested_at', documents.metadata->'ingested_at')) as metadata
+    from documents
+    where documents.id = any(ids)
+  ) k
+  where d.id = k.id
+    and d.metadata is distinct from k.metadata;
+  get diagnostics updated = row_count;
+  return updated;
+end;
+$$;
+
 -- Create an index to be used by the semantic search function
 create index on documents 
 using ivfflat (embedding vector_cosine_ops)
 with (lists = 100);
+
+-- Metadata filters: jsonb_path_ops GIN supports @> (source, tags) and is
+-- smaller than the default opclass. With a selective filter the planner can
+-- pick these rows first and sort them exactly instead of scanning ivfflat.
+create index documents_metadata_idx on documents
+using gin (metadata jsonb_path_ops);
+
+-- Ingest date range filters
+create index documents_ingested_at_idx on documents
+(((metadata->>'ingested_at') collate "C"));